@@ -1 +1 @@
-from reggie.reggie import convert_voter_file, convert_cli
\ No newline at end of file
+from reggie.reggie import convert_voter_file, convert_cli, cli
\ No newline at end of file
@@ -1,14 +1,468 @@
+from reggie.local_store import load_local_store, local_store_path, \
+    save_local_store
 from reggie.reggie_constants import CONFIG_DIR, PRIMARY_LOCALE_ALIAS, \
     LOCALE_TYPE, PRIMARY_LOCALE_TYPE, PRIMARY_LOCALE_NAMES, LOCALE_DIR
 import yaml
+import logging
+import numpy as np
+import os
 import pandas as pd
+import pickle
+import threading
 import json
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 config_cache = {}
+# config file -> shared Config, see Config.for_state
+config_registry = {}
+
+HISTORY_CHANGE_TYPES = [
+    "all_history",
+    "primary_history",
+    "special_history",
+    "general_history",
+    "sparse_history",
+    "vote_type",
+    "votetype_history",
+    "county_history",
+    "jurisdiction_history",
+    "schooldistrict_history",
+    "all_voting_methods",
+    "party_history",
+    "coded_history",
+    "verbose_history",
+    "voterhistory",
+    "lastvoteddate",
+    "Date_last_voted",
+    "Date_changed",
+    "Last_contact_date",
+    "text_election_code_1",
+    "text_election_code_2",
+    "text_election_code_3",
+    "text_election_code_4",
+    "text_election_code_5",
+    "text_election_code_6",
+    "text_election_code_7",
+    "text_election_code_8",
+    "text_election_code_9",
+    "text_election_code_10",
+    "Election_Date",
+    "Election_Type",
+    "Election_Party",
+    "Election_Voting_Method",
+    "election_type_history",
+    "election_category_history",
+    "town_history",
+    "history_bitmap"]
+HISTORY_CHANGE_TYPE_SET = frozenset(HISTORY_CHANGE_TYPES)
+
+COMPILED_CONFIG_DIR = "compiled_configs"
+# the C yaml loader, when PyYAML was built with libyaml
+YAML_LOADER = getattr(yaml, "CLoader", yaml.Loader)
+
+DATE_MEMO_STORE = "date_memo.json"
+DATE_FORMAT_STORE = "date_formats.json"
+
+
+class DateMemo(object):
+    """
+    Date strings already parsed, per date format. Columns are parsed through
+    their distinct values only, and the memo carries those results over to
+    the next column (and, when saved, the next run), since registration,
+    birth and status dates repeat the same strings over and over.
+    """
+    # columns with more distinct values than this are parsed without being
+    # remembered, to keep the memo small
+    max_uniques = 200000
+
+    def __init__(self, parsed=None):
+        # format -> {date string: datetime64[ns] as int, NaT included}
+        self.parsed = parsed if parsed is not None else {}
+        # columns can be coerced from several threads (Config.coerce_all)
+        self.lock = threading.Lock()
+
+    def load(self):
+        """
+        Merge the memo saved by a previous run into this one
+        :return: self
+        """
+        stored = load_local_store(DATE_MEMO_STORE, {})
+        with self.lock:
+            for format_str, parsed in stored.items():
+                self.parsed.setdefault(format_str, {}).update(parsed)
+        return self
+
+    def save(self):
+        with self.lock:
+            parsed = {k: dict(v) for k, v in self.parsed.items()}
+        save_local_store(DATE_MEMO_STORE, parsed)
+
+    def parse(self, strings, format_str):
+        """
+        :param strings: array of distinct date strings
+        :param format_str: strptime format
+        :return: datetime64[ns] array, NaT where a string did not parse
+        """
+        if len(strings) > self.max_uniques:
+            return pd.to_datetime(pd.Series(strings, dtype=object),
+                                  format=format_str,
+                                  errors='coerce').values
+        with self.lock:
+            memo = self.parsed.setdefault(format_str, {})
+            new = [x for x in strings if x not in memo]
+        if len(new) > 0:
+            # parsed outside the lock; another thread parsing the same
+            # strings meanwhile only stores the same values
+            parsed = pd.to_datetime(pd.Series(new, dtype=object),
+                                    format=format_str, errors='coerce')
+            parsed = parsed.values.astype('datetime64[ns]').view('i8')
+            with self.lock:
+                memo.update(zip(new, parsed.tolist()))
+        with self.lock:
+            values = [memo[x] for x in strings]
+        return np.array(values, dtype='i8').view('datetime64[ns]')
+
+
+class DateFormatInference(object):
+    """
+    Picks the date format of a column out of a list of candidates by trying
+    them on a sample of the column. Only when the sample can not decide is
+    a format tried on the whole column. The winning format is remembered per
+    state, column and (optionally) county, tried first the next time, and
+    kept in the local store between runs.
+    """
+    sample_size = 2000
+
+    def __init__(self):
+        self.formats = None
+        # columns can be coerced from several threads (Config.coerce_all)
+        self.lock = threading.Lock()
+
+    def remembered(self):
+        if self.formats is None:
+            self.formats = load_local_store(DATE_FORMAT_STORE, {})
+        return self.formats
+
+    def remember(self, key, format_str):
+        with self.lock:
+            if self.remembered().get(key) != format_str:
+                self.formats[key] = format_str
+                save_local_store(DATE_FORMAT_STORE, self.formats)
+
+    @classmethod
+    def verdict(cls, parsed, min_parsed, whole=True):
+        """
+        :param parsed: datetime64 array of parse results
+        :param min_parsed: share of values that must parse (more than it,
+        as coerce_dates always compared), or None to accept a format as soon
+        as it yields more than one distinct value (NaT included)
+        :param whole: parsed is the whole column; for a sample, shares
+        within 0.1 of min_parsed can not tell
+        :return: True / False, or None if a sample can not tell
+        """
+        ok = ~np.isnat(parsed)
+        if min_parsed is None:
+            if not ok.any():
+                return False
+            if len(pd.unique(parsed)) > 1:
+                return True
+            return False if whole else None
+        share = ok.mean() if len(ok) > 0 else 0.
+        if whole:
+            return bool(share > min_parsed)
+        if share > min_parsed + 0.1:
+            return True
+        if share < min_parsed - 0.1:
+            return False
+        return None
+
+    def infer(self, values, formats, parse, key, min_parsed=None):
+        """
+        :param values: Series of date strings
+        :param formats: candidate formats, in order of preference
+        :param parse: function (strings, format) -> datetime64 array
+        :param key: cache key, e.g. "state/column/county"
+        :param min_parsed: see verdict
+        :return: the chosen format, or None if no format fits
+        """
+        remembered = self.remembered().get(key)
+        if remembered in formats:
+            formats = [remembered] + [f for f in formats if f != remembered]
+
+        if len(values) > self.sample_size:
+            sample = values.sample(self.sample_size, random_state=0)
+        else:
+            sample = values
+        sample = np.asarray(sample, dtype=object)
+        whole = len(sample) == len(values)
+        for format_str in formats:
+            verdict = self.verdict(parse(sample, format_str), min_parsed,
+                                   whole=whole)
+            if verdict is None:
+                verdict = self.verdict(
+                    parse(np.asarray(values, dtype=object), format_str),
+                    min_parsed)
+            if verdict:
+                self.remember(key, format_str)
+                return format_str
+        return None
+
+
+# shared by every Config in the process
+date_memo = DateMemo()
+date_format_inference = DateFormatInference()
+
+
+def catch_floats(x):
+    if '.0' == x[-2:]:
+        return str(int(float(x)))
+    else:
+        return x
+
+
+def strip_float_suffix(col):
+    """
+    "19800101.0" -> "19800101", as catch_floats does; anything that is not
+    a plain digit string goes through catch_floats
+    :param col: Series of strings
+    :return: Series of strings
+    """
+    floats = col.str.endswith('.0').values
+    if not floats.any():
+        return col
+    digits = col[floats].str[:-2]
+    plain = digits.str.match(r'^\d{1,15}$').values
+    digits[plain] = digits[plain].str.lstrip('0').replace('', '0').values
+    digits[~plain] = col[floats][~plain].map(catch_floats).values
+    values = col.values.copy()
+    values[floats] = digits.values
+    return pd.Series(values, index=col.index, name=col.name)
+
+
+def disallow_future_dates(col, max_year):
+    future = (col.dt.year > max_year).values
+    if not future.any():
+        return col
+    shifted = col[future]
+    shifted = pd.to_datetime(pd.DataFrame({
+        'year': shifted.dt.year.values - 100,
+        'month': shifted.dt.month.values,
+        'day': shifted.dt.day.values}))
+    values = col.values.copy()
+    values[future] = shifted.values
+    return pd.Series(values, index=col.index, name=col.name)
+
+
+def disallow_past_dates(col, min_year=1910):
+    return col.mask(col.dt.year < min_year)
+
+
+def normalize_strings(col):
+    string_copy = col.astype(str)
+    stripped_copy = string_copy.str.strip()
+    lower_copy = stripped_copy.str.lower()
+    utf_decoded = lower_copy.str.encode('utf-8', errors='ignore')
+    return utf_decoded.str.decode('utf-8')
+
+
+def coerce_string_column(col, dtype=None):
+    """
+    Strip, lowercase and utf-8 clean a text column. Text columns hold few
+    distinct values, so those are normalized once and broadcast. Object
+    columns mixing types are done row by row, since factorize would take 1
+    and 1.0 for the same value.
+    :param col: Series
+    :param dtype: see Config.coerce_strings
+    :return: Series
+    """
+    if col.dtype == object and pd.api.types.infer_dtype(
+            col, skipna=True) not in ("string", "empty"):
+        normalized = normalize_strings(col)
+        if dtype is None:
+            return normalized
+        return normalized.astype(dtype)
+
+    codes, uniques = pd.factorize(col)
+    normalized = normalize_strings(pd.Series(uniques, dtype=object)).values
+    nulls = codes < 0
+    if nulls.any():
+        # nulls come out as astype(str) leaves them row by row: missing, or
+        # printed as "nan" by older pandas
+        printed = col[nulls].astype(str)
+        if not printed.isna().all():
+            printed = normalize_strings(printed)
+        null_codes, null_values = pd.factorize(printed.values,
+                                               use_na_sentinel=False)
+        codes[nulls] = null_codes + len(normalized)
+        normalized = np.concatenate([normalized, null_values])
+    # distinct raw values can normalize to the same string
+    value_codes, values = pd.factorize(normalized, use_na_sentinel=False)
+    codes = value_codes[codes]
+    if dtype == "category":
+        missing = pd.isna(values)
+        if missing.any():
+            codes = np.where(missing[codes], -1, codes)
+            codes -= np.cumsum(missing)[codes] * (codes >= 0)
+            values = values[~missing]
+        return pd.Series(pd.Categorical.from_codes(codes, values),
+                         index=col.index, name=col.name)
+    result = pd.Series(np.asarray(values, dtype=object)[codes],
+                       index=col.index, name=col.name)
+    if dtype is None:
+        return result
+    return result.astype(dtype)
+
+
+def smallest_int_dtype(col):
+    lo, hi = col.min(), col.max()
+    for dtype in [np.int8, np.int16, np.int32]:
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return dtype.__name__.capitalize()
+    return "Int64"
+
+
+def downcast_column(col, field_type=None):
+    """
+    :param col: numeric Series
+    :param field_type: yaml type of the column, if any
+    :return: col in the smallest nullable integer dtype holding its values,
+    or as float32 where that is exact
+    """
+    known = col[col.notna()]
+    if len(known) == 0:
+        if field_type is not None and "int" in field_type:
+            return col.astype("Int8")
+        return col
+    integral = np.isfinite(known).all() and (known == np.floor(known)).all()
+    if integral and field_type != "float" and field_type != "double":
+        return col.astype(smallest_int_dtype(known))
+    if field_type != "double":
+        small = col.astype(np.float32)
+        if (small.astype(np.float64) == col)[col.notna()].all():
+            return small
+    return col
+
+
+def coerce_numeric_column(col, field_type=None, downcast=False):
+    """
+    :param col: Series
+    :param field_type: yaml type, None for an extra column
+    :param downcast: see Config.coerce_numeric
+    :return: (coerced Series, Series of the values of an extra column that
+    are not numeric, or None)
+    """
+    numeric = pd.to_numeric(col, errors='coerce')
+    if field_type is None:
+        if not downcast:
+            return numeric.fillna(col), None
+        residual = col.where(numeric.isna() & col.notna())
+        return downcast_column(numeric), \
+            residual if residual.notna().any() else None
+    if downcast:
+        return downcast_column(numeric, field_type), None
+    if "int" in field_type:
+        numeric = numeric.astype(int, errors='ignore')
+    return numeric, None
+
+
+class LocaleNames(object):
+    """
+    A state's primary locale names as a pandas index: locale ids get
+    positional codes, so display names, filtering and grouping by locale
+    are array lookups rather than per row dict lookups.
+    """
+
+    def __init__(self, names):
+        """
+        :param names: dict of primary locale id -> display name
+        """
+        self.index = pd.Index([str(k) for k in names.keys()], dtype=object)
+        self.names = np.array(list(names.values()), dtype=object)
+        self.dtype = pd.CategoricalDtype(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    @classmethod
+    def as_ids(cls, values):
+        """
+        :param values: Series (or array) of locale ids, as read or coerced
+        :return: object array of the ids as strings, the form they take in
+        the locale file; missing values stay missing
+        """
+        values = pd.Series(values)
+        if pd.api.types.is_float_dtype(values):
+            values = values.astype("Int64")
+        missing = values.isna().to_numpy()
+        ids = values.astype(str).to_numpy(dtype=object)
+        ids[missing] = np.nan
+        return ids
+
+    def codes(self, values):
+        """
+        :param values: Series of locale ids
+        :return: int array of positions in index, -1 for unknown ids
+        """
+        return self.index.get_indexer(self.as_ids(values))
+
+    def display_names(self, values):
+        """
+        :param values: Series of locale ids
+        :return: Series of display names, NaN for unknown ids
+        """
+        codes = self.codes(values)
+        names = np.append(self.names, np.nan)
+        index = values.index if isinstance(values, pd.Series) else None
+        return pd.Series(names[codes], index=index, dtype=object)
+
+    def categorical(self, values, strict=True):
+        """
+        :param values: Series of locale ids
+        :param strict: unknown ids become NaN when True; otherwise they
+        are kept as extra categories after the known ones, so the codes of
+        known locales don't change
+        :return: categorical Series
+        """
+        ids = self.as_ids(values)
+        dtype = self.dtype
+        if not strict:
+            unknown = pd.unique(ids[(self.index.get_indexer(ids) == -1) &
+                                    ~pd.isna(ids)])
+            if len(unknown):
+                dtype = pd.CategoricalDtype(
+                    self.index.append(pd.Index(unknown, dtype=object)))
+        index = values.index if isinstance(values, pd.Series) else None
+        return pd.Series(pd.Categorical(ids, dtype=dtype), index=index,
+                         name=getattr(values, "name", None))
+
+    def mask(self, values, locales):
+        """
+        :param values: Series of locale ids
+        :param locales: ids to keep
+        :return: boolean array, True where the id is one of locales
+        """
+        wanted = self.codes(pd.Series(list(locales), dtype=object))
+        return np.isin(self.codes(values), wanted[wanted >= 0])
+
+    def groupby(self, df, field):
+        """
+        :param df: dataframe with a locale id column
+        :param field: the column
+        :return: groupby over the locale categorical, one group per known
+        locale (empty ones included)
+        """
+        return df.groupby(self.categorical(df[field]), observed=False)
 
 
 class Config(object):
+    """
+    A state's yaml config. Config objects are read only, so a single one per
+    state can be shared (see for_state) along with the views derived from
+    it, which are worked out on first use.
+    """
 
     def __init__(self, state=None, file_name=None):
         if state is None and file_name is None:
@@ -18,12 +472,45 @@ class Config(object):
         else:
             config_file = file_name
 
-        self.data = self.load_data(config_file, self.infer_locale_file(
-            config_file))
+        self.config_file = config_file
+        self.data = MappingProxyType(self.load_data(
+            config_file, self.infer_locale_file(config_file)))
 
         self.primary_locale_type = self.data.get(PRIMARY_LOCALE_TYPE, "county")
         self.primary_locale_names = self.data[PRIMARY_LOCALE_NAMES]
         self.primary_locale_column = self.data[PRIMARY_LOCALE_ALIAS]
+        self.column_plans = {}
+        self.database_column_list = None
+        self.change_types = None
+        self.locale_names = None
+        self.database_type_map = None
+        self.frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, "frozen", False):
+            raise AttributeError("Config objects are read only")
+        object.__setattr__(self, name, value)
+
+    def __reduce__(self):
+        # the mapping proxy does not pickle, so rebuild from the file
+        return self.__class__, (None, self.config_file)
+
+    @classmethod
+    def for_state(cls, state=None, file_name=None):
+        """
+        The shared Config of a state, built on first use
+        :param state: state name
+        :param file_name: or the path of a config file
+        :return: Config
+        """
+        if state is not None:
+            file_name = cls.config_file_from_state(state)
+        if file_name is None:
+            raise ValueError("either state or config file must be passed")
+        key = os.path.abspath(file_name)
+        if key not in config_registry:
+            config_registry[key] = cls(file_name=file_name)
+        return config_registry[key]
 
     @classmethod
     def config_file_from_state(cls, state):
@@ -47,23 +534,117 @@ class Config(object):
         if config_file in config_cache:
             return config_cache[config_file]
         else:
-            with open(config_file) as f:
-                config = yaml.load(f)
-
-                # add primary locale dict to config object
-                try:
-                    with open(locale_file) as f:
-                        locale_data = json.load(f)
-                    locale_dict = {}
-                    for locale in locale_data:
-                        locale_dict[locale['id']] = locale['name']
-                except:
-                    locale_dict = None
-                config[PRIMARY_LOCALE_NAMES] = locale_dict
-
-                config_cache[config_file] = config
+            config = cls.load_compiled(config_file, locale_file)
+            if config is None:
+                config = cls.compile(config_file, locale_file)
+            config_cache[config_file] = config
         return config
 
+    @classmethod
+    def parse_data(cls, config_file, locale_file):
+        """
+        Parse a state's yaml file and its primary locale names
+        :param config_file: state's yaml file
+        :param locale_file: json file from infer_locale_file
+        :return: config dictionary
+        """
+        with open(config_file) as f:
+            config = yaml.load(f, Loader=YAML_LOADER)
+
+            # add primary locale dict to config object
+            try:
+                with open(locale_file) as f:
+                    locale_data = json.load(f)
+                locale_dict = {}
+                for locale in locale_data:
+                    locale_dict[locale['id']] = locale['name']
+            except:
+                locale_dict = None
+            config[PRIMARY_LOCALE_NAMES] = locale_dict
+        return config
+
+    @classmethod
+    def compiled_file(cls, config_file):
+        return local_store_path(os.path.join(
+            COMPILED_CONFIG_DIR,
+            os.path.basename(config_file) + ".pickle"))
+
+    @classmethod
+    def source_mtimes(cls, config_file, locale_file):
+        mtimes = []
+        for path in [config_file, locale_file]:
+            try:
+                mtimes.append(os.path.getmtime(path))
+            except OSError:
+                mtimes.append(None)
+        return {"config_file": os.path.abspath(config_file),
+                "mtimes": mtimes}
+
+    @classmethod
+    def load_compiled(cls, config_file, locale_file):
+        """
+        Load the pickled config written by compile, if it is still up to
+        date with the yaml and locale files
+        :param config_file: state's yaml file
+        :param locale_file: json file from infer_locale_file
+        :return: config dictionary, or None
+        """
+        path = cls.compiled_file(config_file)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                compiled = pickle.load(f)
+            if compiled.get("source") != cls.source_mtimes(config_file,
+                                                            locale_file):
+                return None
+            return compiled["data"]
+        except Exception as e:
+            # truncated, or pickled by another version of the code: a miss,
+            # compile rebuilds it
+            logging.info("could not load compiled config {}: {}".format(
+                path, e))
+            return None
+
+    @classmethod
+    def compile(cls, config_file, locale_file=None):
+        """
+        Parse a state's config and keep a pickled copy in the local store,
+        keyed by the path and modification times of its source files
+        :param config_file: state's yaml file
+        :param locale_file: json file (default: from infer_locale_file)
+        :return: config dictionary
+        """
+        if locale_file is None:
+            locale_file = cls.infer_locale_file(config_file)
+        source = cls.source_mtimes(config_file, locale_file)
+        config = cls.parse_data(config_file, locale_file)
+        path = cls.compiled_file(config_file)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = "{}.{}.tmp".format(path, os.getpid())
+            with open(tmp_path, "wb") as f:
+                pickle.dump({"source": source, "data": config}, f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.info("could not write compiled config {}: {}".format(
+                path, e))
+        return config
+
+    @classmethod
+    def compile_all(cls):
+        """
+        Compile every state config in CONFIG_DIR
+        :return: list of compiled yaml files
+        """
+        config_files = sorted(
+            os.path.join(CONFIG_DIR, f) for f in os.listdir(CONFIG_DIR)
+            if f.endswith(".yaml"))
+        for config_file in config_files:
+            cls.compile(config_file)
+        return config_files
+
     # """
     # In the following 4 methods we recreate the functionality of a dictionary,
     # as needed in the rest of the application.
@@ -85,8 +666,27 @@ class Config(object):
         return self.data.items()
 
     def database_columns(self):
-        return [c for c in self.data["ordered_columns"] if c not in
-                self.data["blacklist_columns"]]
+        if self.database_column_list is None:
+            blacklist = set(self.data["blacklist_columns"])
+            object.__setattr__(self, "database_column_list", [
+                c for c in self.data["ordered_columns"]
+                if c not in blacklist])
+        return self.database_column_list
+
+    def database_column_types(self):
+        """
+        :return: dict of column -> yaml type of the processed snapshot:
+        columns, generated_columns and additional_snapshot_columns
+        """
+        if self.database_type_map is None:
+            types = {}
+            for key in ["columns", "generated_columns",
+                        "additional_snapshot_columns"]:
+                if isinstance(self.data.get(key), dict):
+                    types.update(self.data[key])
+            object.__setattr__(self, "database_type_map",
+                               MappingProxyType(types))
+        return self.database_type_map
 
     def raw_file_columns(self):
         """
@@ -105,62 +705,113 @@ class Config(object):
     def processed_file_columns(self):
         return self.data["ordered_columns"]
 
-    def coerce_dates(self, df, col_list="columns"):
+    def column_plan(self, col_list="columns"):
+        """
+        The columns of a yaml column list grouped by coercion, worked out
+        once per list
+        :param col_list: name of field in yaml to pull column types from
+        :return: dict with "dates" and "strings" lists of columns and
+        "numeric", a dict of column -> yaml type
+        """
+        if col_list not in self.column_plans:
+            column_types = self.data[col_list]
+            self.column_plans[col_list] = {
+                "dates": [c for c, v in column_types.items()
+                          if v == "date" or v == "timestamp"],
+                "numeric": {c: v for c, v in column_types.items()
+                            if "int" in v or v == "float" or v == "double"},
+                "strings": [c for c, v in column_types.items()
+                            if v == "text" or "char" in v]}
+        return self.column_plans[col_list]
+
+    def field_sets(self, col_list="columns"):
+        """
+        :param col_list: name of field in yaml to pull column types from
+        :return: dict of frozensets of the "dates", "numeric" and "strings"
+        columns, for membership tests
+        """
+        plan = self.column_plan(col_list)
+        if "sets" not in plan:
+            plan["sets"] = {k: frozenset(plan[k])
+                            for k in ["dates", "numeric", "strings"]}
+        return plan["sets"]
+
+    def coerce_date_column(self, col, field, memo=None):
+        """
+        :param col: Series of raw dates
+        :param field: column name
+        :param memo: DateMemo to parse through (default: the process wide one)
+        :return: datetime Series, or strings if no date format matched
+        """
+        memo = date_memo if memo is None else memo
+        min_voter_age = 17
+
+        if pd.api.types.is_datetime64_any_dtype(col):
+            col = col.map(str)
+        else:
+            col = col.astype(str)
+        col = strip_float_suffix(col)
+        # parse each distinct string once and broadcast back to the rows
+        codes, uniques = pd.factorize(col)
+        uniques = np.asarray(uniques, dtype=object)
+        if not isinstance(self.data["date_format"], list):
+            format_str = self.data["date_format"]
+        else:
+            format_str = self.infer_date_format(
+                pd.Series(uniques), field, parse=memo.parse)
+            # no format matched, the column is left as strings
+            if format_str is None:
+                return col
+        # missing values have code -1, which picks the NaT appended last
+        parsed = np.append(memo.parse(uniques, format_str),
+                           np.datetime64("NaT", "ns"))
+        col = pd.Series(parsed[codes], index=col.index, name=col.name)
+
+        if field == self.data['birthday_identifier']:
+            col = disallow_future_dates(
+                col, datetime.now().year - min_voter_age)
+        else:
+            col = disallow_future_dates(col, datetime.now().year)
+        return disallow_past_dates(col)
+
+    def coerce_dates(self, df, col_list="columns", memo=None):
         """
         takes all columns with timestamp or date labels in the config file and
         forces the corresponding entries in the raw file into datetime objects
         :param df: dataframe to modify
         :param col_list: name of field in yaml to pull column types from
+        :param memo: DateMemo to parse through (default: the process wide one)
         :return: modified dataframe
         """
-        def catch_floats(x):
-            if '.0' == x[-2:]:
-                return str(int(float(x)))
-            else:
-                return x
-
-        def disallow_future_dates(x, max_year):
-            if (type(x) != str) and (x.year > max_year):
-                return pd.Timestamp(x.year-100, x.month, x.day)
-            return x
-
-        def disallow_past_dates(x, min_year=1910):
-            if (type(x) != str) and (x.year < min_year):
-                return pd.NaT
-            return x
-
-        min_voter_age = 17
-
-        date_fields = [c for c, v in self.data[col_list].items() if
-                       v == "date" or v == "timestamp"]
-        date_fields = [x for x in date_fields if x in df.columns]
+        date_fields = [x for x in self.column_plan(col_list)["dates"]
+                       if x in df.columns]
         for field in date_fields:
-            df[field] = df[field].apply(str)
-            df[field] = df[field].map(catch_floats)
-            if not isinstance(self.data["date_format"], list):
-                df[field] = pd.to_datetime(df[field],
-                                           format=self.data["date_format"],
-                                           errors='coerce').fillna(pd.NaT)
-            else:
-                for format_str in self.data["date_format"]:
-                    formatted = pd.to_datetime(df[field],
-                                               format=format_str,
-                                               errors='coerce').fillna(pd.NaT)
-                    if len(formatted.unique()) > 1:
-                        df[field] = formatted
-                        break
-
-            if field == self.data['birthday_identifier']:
-                df[field] = df[field].map(lambda x: disallow_future_dates(
-                    x, datetime.now().year - min_voter_age))
-            else:
-                df[field] = df[field].map(lambda x: disallow_future_dates(
-                    x, datetime.now().year))
-
-            df[field] = df[field].map(disallow_past_dates)
+            df[field] = self.coerce_date_column(df[field], field, memo=memo)
         return df
 
-    def coerce_numeric(self, df, extra_cols=None, col_list="columns"):
+    def infer_date_format(self, values, field, county=None, parse=None,
+                          min_parsed=None):
+        """
+        Choose which of the config's date formats a column is written in
+        (see DateFormatInference)
+        :param values: Series of date strings
+        :param field: column name
+        :param county: remember the format per county as well
+        :param parse: function (strings, format) -> datetime64 array
+        (default: the process wide DateMemo)
+        :param min_parsed: share of values that must parse; by default a
+        format is taken if it yields more than one distinct date
+        :return: format string, or None
+        """
+        parse = date_memo.parse if parse is None else parse
+        key = "/".join([str(self.data["state"]), field] +
+                       ([str(county)] if county is not None else []))
+        return date_format_inference.infer(
+            values, self.data["date_format"], parse, key,
+            min_parsed=min_parsed)
+
+    def coerce_numeric(self, df, extra_cols=None, col_list="columns",
+                       downcast=None):
         """
         takes all columns with int labels in the config file as well as any
         requested extra columns, and forces the corresponding entries in the
@@ -168,27 +819,39 @@ class Config(object):
         :param df: dataframe to modify
         :param extra_cols: other columns to convert
         :param col_list: name of field in yaml to pull column types from
+        :param downcast: store each column in the smallest dtype that holds
+        its values (nullable Int8/16/32/64, or float32 where that is exact),
+        and split extra columns that are not all numeric into the numeric
+        column plus a "<column>_text" column holding the other values.
+        Defaults to the config's downcast_numeric setting (off).
         :return: modified dataframe
         """
-        extra_cols = [] if extra_cols is None else extra_cols
-        numeric_fields = [c for c, v in self.data[col_list].items()
-                          if "int" in v or v == "float" or v == "double"]
-        int_fields = [c for c, v in self.data[col_list].items()
-                      if "int" in v]
-        numeric_fields = [x for x in numeric_fields if x in df.columns]
-        int_fields = [x for x in int_fields if x in df.columns]
+        if downcast is None:
+            downcast = self.data.get("downcast_numeric", False)
+        numeric_fields = self.column_plan(col_list)["numeric"]
+        fields = [(x, t) for x, t in numeric_fields.items() if x in df.columns]
         if extra_cols is not None:
-            extra_cols = [x for x in extra_cols if x in df.columns]
-        for field in numeric_fields:
-            df[field] = pd.to_numeric(df[field], errors='coerce')
-        for field in int_fields:
-            df[field] = df[field].astype(int, errors='ignore')
-        for field in extra_cols:
-            df[field] = pd.to_numeric(df[field],
-                                      errors='coerce').fillna(df[field])
+            fields += [(x, None) for x in extra_cols if x in df.columns]
+        for field, field_type in fields:
+            df[field], residual = coerce_numeric_column(
+                df[field], field_type, downcast=downcast)
+            if residual is not None:
+                df["{}_text".format(field)] = residual
         return df
 
-    def coerce_strings(self, df, extra_cols=None, exclude=[''], col_list="columns"):
+    def string_fields(self, df, extra_cols=None, exclude=[''],
+                      col_list="columns"):
+        text_fields = self.column_plan(col_list)["strings"]
+        if extra_cols is not None:
+            text_fields = text_fields + extra_cols
+        return [field for field in text_fields
+                if (field in df)
+                and (field != self.data["voter_status"])
+                and (field != self.data["party_identifier"])
+                and (field not in exclude)]
+
+    def coerce_strings(self, df, extra_cols=None, exclude=[''],
+                       col_list="columns", dtype=None):
         """
         takes all columns with text or varchar labels in the config,
         strips out whitespace and converts text to all lowercase
@@ -198,70 +861,104 @@ class Config(object):
         :param extra_cols: extra columns to add
         :param exclude: columns to exclude
         :param col_list: name of field in yaml to pull column types from
+        :param dtype: None to keep python strings, "category" or a pandas
+        string dtype (e.g. "string[pyarrow]") to store the result as
         :return: modified dataframe
         """
-        text_fields = [c for c, v in self.data[col_list].items()
-                       if v == "text" or "char" in v]
-        if extra_cols is not None:
-            text_fields = text_fields + extra_cols
+        for field in self.string_fields(df, extra_cols, exclude, col_list):
+            df[field] = coerce_string_column(df[field], dtype=dtype)
+        return df
 
-        for field in text_fields:
-            if (field in df) \
-            and (field != self.data["voter_status"]) \
-            and (field != self.data["party_identifier"]) \
-            and (field not in exclude):
-                string_copy = df[field].astype(str)
-                stripped_copy = string_copy.str.strip()
-                lower_copy = stripped_copy.str.lower()
-                utf_decoded = lower_copy.str.encode('utf-8', errors='ignore')
-                df[field] = utf_decoded.str.decode('utf-8')
+    def coerce_all(self, df, numeric_extra_cols=None, string_extra_cols=None,
+                   exclude=[''], col_list="columns", downcast=None,
+                   string_dtype=None, memo=None, max_workers=None,
+                   categorical_locale=None):
+        """
+        coerce_strings, coerce_dates and coerce_numeric in one pass: every
+        column gets its coercions (in that order) as a single task. The
+        tasks run in the calling thread unless max_workers asks for a
+        thread pool; most of the work holds the GIL, so measure before
+        raising it (tests/benchmark.py coerce_all_threads). The frame itself
+        is only modified from the calling thread.
+        :param df: dataframe to modify
+        :param numeric_extra_cols: extra_cols of coerce_numeric
+        :param string_extra_cols: extra_cols of coerce_strings
+        :param exclude: exclude of coerce_strings
+        :param col_list: name of field in yaml to pull column types from
+        :param downcast: see coerce_numeric
+        :param string_dtype: dtype of coerce_strings
+        :param memo: see coerce_dates
+        :param max_workers: thread pool size (default: 1, no pool)
+        :param categorical_locale: store the primary locale column as a
+        categorical over the locale names (default: yaml key
+        categorical_primary_locale, else False)
+        :return: modified dataframe
+        """
+        if downcast is None:
+            downcast = self.data.get("downcast_numeric", False)
+        if categorical_locale is None:
+            categorical_locale = self.data.get("categorical_primary_locale",
+                                               False)
+        plan = self.column_plan(col_list)
+        strings = set(self.string_fields(df, string_extra_cols, exclude,
+                                         col_list))
+        dates = set(x for x in plan["dates"] if x in df.columns)
+        numeric = {x: t for x, t in plan["numeric"].items()
+                   if x in df.columns}
+        if numeric_extra_cols is not None:
+            numeric.update((x, None) for x in numeric_extra_cols
+                           if x in df.columns)
+
+        def coerce_column(field):
+            col = df[field]
+            residual = None
+            if field in strings:
+                col = coerce_string_column(col, dtype=string_dtype)
+            if field in dates:
+                col = self.coerce_date_column(col, field, memo=memo)
+            if field in numeric:
+                col, residual = coerce_numeric_column(
+                    col, numeric[field], downcast=downcast)
+            return col, residual
+
+        fields = [c for c in df.columns
+                  if c in strings or c in dates or c in numeric]
+        if max_workers is None or max_workers <= 1:
+            results = [coerce_column(field) for field in fields]
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                results = list(pool.map(coerce_column, fields))
+        for field, (col, residual) in zip(fields, results):
+            df[field] = col
+            if residual is not None:
+                df["{}_text".format(field)] = residual
+        locales = self.locales()
+        if categorical_locale and locales is not None and \
+                self.primary_locale_column in df.columns:
+            df[self.primary_locale_column] = locales.categorical(
+                df[self.primary_locale_column], strict=False)
         return df
 
     def admissible_change_types(self):
-        change_types = [col for col in self.data["ordered_columns"]
-                        if (col not in self.history_change_types() and
-                            col != self.data["voter_id"])]
-        return change_types
+        if self.change_types is None:
+            change_types = [col for col in self.data["ordered_columns"]
+                            if (col not in HISTORY_CHANGE_TYPE_SET and
+                                col != self.data["voter_id"])]
+            object.__setattr__(self, "change_types", change_types)
+        return self.change_types
 
     def history_change_types(self):
-        history_cols = [
-            "all_history",
-            "primary_history",
-            "special_history",
-            "general_history",
-            "sparse_history",
-            "vote_type",
-            "votetype_history",
-            "county_history",
-            "jurisdiction_history",
-            "schooldistrict_history",
-            "all_voting_methods",
-            "party_history",
-            "coded_history",
-            "verbose_history",
-            "voterhistory",
-            "lastvoteddate",
-            "Date_last_voted",
-            "Date_changed",
-            "Last_contact_date",
-            "text_election_code_1",
-            "text_election_code_2",
-            "text_election_code_3",
-            "text_election_code_4",
-            "text_election_code_5",
-            "text_election_code_6",
-            "text_election_code_7",
-            "text_election_code_8",
-            "text_election_code_9",
-            "text_election_code_10",
-            "Election_Date",
-            "Election_Type",
-            "Election_Party",
-            "Election_Voting_Method",
-            "election_type_history",
-            "election_category_history",
-            "town_history"]
-        return history_cols
+        return HISTORY_CHANGE_TYPES
+
+    def locales(self):
+        """
+        :return: LocaleNames of the primary locale, or None if the state has
+        no locale names file
+        """
+        if self.locale_names is None and self.primary_locale_names:
+            object.__setattr__(self, "locale_names",
+                               LocaleNames(self.primary_locale_names))
+        return self.locale_names
 
     def get_locale_field(self, locale_type):
         """
@@ -294,7 +991,7 @@ class Config(object):
             return False
 
     def to_json(self):
-        return json.dumps(self.data)
+        return json.dumps(dict(self.data))
 
     def is_primary_locale_type(self, locale_type):
         """
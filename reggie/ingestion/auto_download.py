@@ -8,7 +8,7 @@ import logging
 
 def state_download(state, s3_bucket):
     config_file = Config.config_file_from_state(state=state)
-    configs = Config(file_name=config_file)
+    configs = Config.for_state(file_name=config_file)
 
     if state == "north_carolina":
         today = nc_date_grab()
@@ -1,20 +1,28 @@
 import uuid
 from datetime import datetime
-from subprocess import Popen, PIPE
 from datetime import date as dt
 import pandas as pd
 from dateutil import parser
 import json
 from reggie.reggie_constants import *
-from reggie.configs.configs import Config
+from reggie.configs.configs import Config, date_memo
+from reggie.ingestion.elections import ElectionCatalog, ElectionRegistry, \
+    ElectionCodeTable, pack_history
 
 from reggie.ingestion.utils import date_from_str, df_to_postgres_array_string, \
     format_column_name, generate_s3_key, get_metadata_for_key, \
-    get_surrounding_dates, MissingElectionCodesError, normalize_columns, \
-    s3, strcol_to_array, TooManyMalformedLines
-
-from xlrd.book import XLRDError
-from pandas.io.parsers import ParserError
+    get_surrounding_dates, meta_key_for, MissingElectionCodesError, \
+    normalize_columns, record_snapshot, s3, tokenize_delimited, TooManyMalformedLines
+from reggie.ingestion.output_formats import check_output_format, \
+    frame_bytes, OUTPUT_EXTENSIONS, read_frame, write_frame
+from reggie.ingestion.metadata import dumps_meta
+from reggie.ingestion.pg_copy import pg_copy_columns
+from reggie.ingestion.partitions import build_manifest, DEFAULT_BUCKETS, \
+    MANIFEST_FILE, part_file_name, partition_frame
+from reggie.ingestion.streaming import CSV_CHUNK_ROWS, GZIP_BLOCK_SIZE, \
+    gzip_stream, ParallelGzipWriter, S3MultipartWriter, write_csv_chunks
+
+from pandas.errors import ParserError
 import shutil
 import numpy as np
 import subprocess
@@ -23,15 +31,14 @@ from zipfile import ZipFile, BadZipfile
 from gzip import GzipFile
 from bz2 import BZ2File
 from io import StringIO, BytesIO, SEEK_END, SEEK_SET
-import bs4
-import requests
-from urllib.request import urlopen
-import xml.etree.ElementTree
 import os
 import sys
 
 
 def ohio_get_last_updated():
+    import bs4
+    import requests
+
     html = requests.get("https://www6.ohiosos.gov/ords/f?p=VOTERFTP:STWD",
                         verify=False).text
     soup = bs4.BeautifulSoup(html, "html.parser")
@@ -40,6 +47,9 @@ def ohio_get_last_updated():
 
 
 def nc_date_grab():
+    from urllib.request import urlopen
+    import xml.etree.ElementTree
+
     nc_file = urlopen(
         'https://s3.amazonaws.com/dl.ncsbe.gov?delimiter=/&prefix=data/')
     data = nc_file.read()
@@ -84,6 +94,109 @@ def concat_and_delete(in_list):
     return outfile
 
 
+def iowa_history(df_voters, election_dates, key_delim="_"):
+    """
+    Iowa's election history. Each election slot of a voter (a date column
+    and its vote method, party and organization columns) becomes a key
+    <election_type>_<date>_<voting_method>_<political_party>_<political_org>
+    :param df_voters: voter file with the election columns
+    :param election_dates: the date column of each slot
+    :param key_delim: separator of the key's parts
+    :return: (elections, counts, codes, code_index, voted): the keys, most
+    frequent first, and their counts; codes, the (voters x slots) block of
+    key codes flattened row by row; code_index, the position in elections
+    of each code; voted, codes that are not an empty slot
+    """
+    def factorize_part(col, clean):
+        # election columns hold a handful of distinct dates / methods /
+        # parties repeated statewide, so clean the distinct values only
+        codes, uniques = pd.factorize(df_voters[col])
+        uniques = [clean(u) if isinstance(u, str) else "" for u in
+                   uniques] + [""]
+        codes[codes < 0] = len(uniques) - 1
+        return codes, uniques
+
+    # keys are built once per distinct combination in each slot
+    slot_codes = []
+    slot_keys = []
+    for c in election_dates:
+        # each key contains info from the columns
+        prefix = c.split("_")[0] + key_delim
+
+        # and the corresponding votervotemethod column
+        vote_type_col = c.replace("ELECTION_DATE", "VOTERVOTEMETHOD")
+        parts = [(c, str.strip), (vote_type_col, str.strip)]
+        if "PRIMARY" in prefix:
+            # we need more columns in the event of a primary
+            org_col = c.replace("PRIMARY_ELECTION_DATE",
+                                "POLITICAL_ORGANIZATION")
+            party_col = c.replace("PRIMARY_ELECTION_DATE",
+                                  "POLITICAL_PARTY")
+            parts += [(party_col, str.strip),
+                      (org_col, lambda s: s.replace(" ", ""))]
+        parts = [factorize_part(col, clean) for col, clean in parts]
+
+        # mixed-radix combination of the part codes, one int per voter
+        combined = np.zeros(len(df_voters), dtype=np.int64)
+        for codes, uniques in parts:
+            combined = combined * len(uniques) + codes
+        codes, combos = pd.factorize(combined)
+
+        for combo in combos:
+            values = []
+            for _, uniques in parts[::-1]:
+                combo, i = divmod(combo, len(uniques))
+                values.insert(0, uniques[i])
+            # add 'blank' values for the primary slots
+            values += [""] * (4 - len(values))
+            key = prefix + key_delim.join(values)
+            slot_keys.append(key.replace(prefix + key_delim * 3, '')
+                             .replace('"', '').replace("'", ''))
+        slot_codes.append(codes + len(slot_keys) - len(combos))
+
+    # stack the slots into one (voters x slots) block, row-major so that
+    # each voter's keys stay in column order; empty slots collapse to ''
+    codes, clean_uniques = pd.factorize(np.array(slot_keys, dtype=object))
+    codes = codes[np.column_stack(slot_codes).ravel()]
+    del slot_codes
+
+    # sorted uniques + counts, as np.unique would have produced them
+    lex_order = np.argsort(clean_uniques)
+    elections = clean_uniques[lex_order]
+    counts = np.bincount(codes, minlength=len(clean_uniques))[lex_order]
+
+    # we want reverse order (lower indices are higher frequency)
+    count_order = counts.argsort()[::-1]
+    elections = elections[count_order]
+    counts = counts[count_order]
+
+    # map factor codes straight to their final sparse index
+    code_index = np.empty(len(clean_uniques), dtype=np.int64)
+    code_index[lex_order[count_order]] = np.arange(len(elections))
+
+    # null slots are '' so they are left out of each voter's history
+    voted = ~np.isin(codes, np.flatnonzero(clean_uniques == ''))
+    return elections, counts, codes, code_index, voted
+
+
+def history_lists(elections, code_index, codes, voted, n_slots):
+    """
+    :param elections: array_decoding
+    :param code_index: position in elections of each code
+    :param codes: (voters x slots) block of codes, flattened row by row
+    :param voted: codes that are not an empty slot
+    :param n_slots: slots per voter
+    :return: (all_history, sparse_history, sparse_index): each voter's keys
+    and their indices as lists, and the indices of all voted slots
+    """
+    offsets = np.cumsum(voted.reshape(-1, n_slots).sum(axis=1))[:-1]
+    sparse_index = code_index[codes[voted]]
+    all_history = [a.tolist() for a in np.split(elections[sparse_index],
+                                                offsets)]
+    sparse_history = [a.tolist() for a in np.split(sparse_index, offsets)]
+    return all_history, sparse_history, sparse_index
+
+
 class ErrorLog(object):
     """
     Allow us to catch and count number of error lines skipped during read_csv,
@@ -136,6 +249,89 @@ class FileItem(object):
             .format(self.name, self.obj, s)
 
 
+class ProcessedFile(FileItem):
+    """
+    What a preprocess_<state> returns: the processed dataframe (frame) and
+    its meta. obj, the file itself, is only serialized when first asked for
+    (s3_dump, local_dump, ...), so callers that just want the dataframe
+    never pay for the csv.
+    """
+
+    def __init__(self, name, frame, meta=None, output_format="csv",
+                 s3_bucket="", column_types=None, **to_csv_kwargs):
+        self.name = name
+        self.frame = frame
+        self.meta = meta
+        self.output_format = check_output_format(output_format)
+        # yaml types of the columns, for the pgcopy format
+        self.column_types = column_types
+        self.to_csv_kwargs = to_csv_kwargs
+        self.s3_bucket = s3_bucket
+        self.serialized = None
+
+    @property
+    def obj(self):
+        if self.serialized is None:
+            logging.info("serializing {} as {}".format(
+                self.name, self.output_format))
+            if self.output_format == "csv":
+                self.serialized = StringIO(
+                    self.frame.to_csv(**self.to_csv_kwargs))
+            else:
+                self.serialized = frame_bytes(
+                    self.frame, self.output_format,
+                    index=bool(self.to_csv_kwargs.get("index", True)),
+                    column_types=self.column_types)
+        return self.serialized
+
+    @obj.setter
+    def obj(self, value):
+        self.serialized = value
+
+    def write(self, target, compress=True,
+              level=GZIP_COMPRESSION_LEVEL, chunksize=CSV_CHUNK_ROWS):
+        """
+        Serialize frame straight into target. csv is written chunksize rows
+        at a time (and gzipped as it goes), so memory stays at one chunk
+        rather than the whole file.
+        :param target: path or binary file object (local file, BytesIO,
+        upload stream...)
+        :param compress: gzip the csv (the columnar formats compress
+        themselves)
+        :param level: gzip level
+        :param chunksize: csv rows per chunk
+        :return: None
+        """
+        logging.info("writing {} as {}".format(self.name, self.output_format))
+        kwargs = dict(self.to_csv_kwargs)
+        if self.output_format != "csv":
+            write_frame(self.frame, target, self.output_format,
+                        index=bool(kwargs.get("index", True)),
+                        column_types=self.column_types)
+            return
+        # to_csv ignores encoding when it returns a str, so processed csvs
+        # have always been utf-8 whatever the state passes
+        kwargs.pop("encoding", None)
+        if compress:
+            sink = ParallelGzipWriter(target, level=level)
+        elif isinstance(target, str):
+            sink = open(target, "wb")
+        else:
+            sink = None
+        try:
+            write_csv_chunks(self.frame, target if sink is None else sink,
+                             chunksize=chunksize, **kwargs)
+        finally:
+            if sink is not None:
+                sink.close()
+
+    def __str__(self):
+        if self.serialized is None:
+            return "ProcessedFile: name={}, frame={}, not serialized" \
+                .format(self.name, self.frame.shape)
+        return super(ProcessedFile, self).__str__()
+
+
 class Loader(object):
     """
     this object should be used to perform downloads directly from
@@ -155,9 +351,11 @@ class Loader(object):
     """
 
     def __init__(self, config_file=CONFIG_OHIO_FILE, force_date=None,
-                 force_file=None, testing=False, s3_bucket=""):
+                 force_file=None, testing=False, s3_bucket="",
+                 output_format="csv",
+                 compression_level=GZIP_COMPRESSION_LEVEL):
         self.config_file_path = config_file
-        config = Config(file_name=config_file)
+        config = Config.for_state(file_name=config_file)
         self.config = config
         self.chunk_urls = config[
             CONFIG_CHUNK_URLS] if CONFIG_CHUNK_URLS in config else []
@@ -172,6 +370,9 @@ class Loader(object):
         self.meta = None
         self.testing = testing
         self.s3_bucket = s3_bucket
+        # format of processed files, see output_formats.OUTPUT_FORMATS
+        self.output_format = check_output_format(output_format)
+        self.compression_level = compression_level
         if force_date is not None:
             self.download_date = parser.parse(force_date).isoformat()
         else:
@@ -202,14 +403,27 @@ class Loader(object):
         :param compression_type: gzip is default
         :return: None
         """
+        if self.output_format != "csv":
+            # the columnar formats are compressed as they are written
+            self.is_compressed = True
+        if not self.is_compressed and \
+                isinstance(self.main_file, ProcessedFile) and \
+                self.main_file.serialized is None:
+            # gzip straight from the frame, the csv never exists in full
+            compressed = BytesIO()
+            self.main_file.write(compressed, level=self.compression_level)
+            compressed.seek(0)
+            self.is_compressed = True
+            self.main_file.obj = compressed
         if not self.is_compressed:
             logging.info("compressing")
-            p = Popen(["gzip", "-c"], stdout=PIPE,
-                      stderr=PIPE, stdin=PIPE)
-            op, err = p.communicate(self.main_file.obj.read().encode())
-            self.main_file.obj.seek(0)
+            source = self.main_file.obj
+            compressed = BytesIO()
+            gzip_stream(source, compressed, level=self.compression_level)
+            source.seek(0)
+            compressed.seek(0)
             self.is_compressed = True
-            self.main_file.obj = BytesIO(op)
+            self.main_file.obj = compressed
 
     def unzip_decompress(self, file_name):
         """
@@ -363,19 +577,49 @@ class Loader(object):
         self.is_compressed = False
         return new_files
 
-    def generate_key(self, file_class=PROCESSED_FILE_PREFIX):
-        if "native_file_extension" in self.config and \
+    def generate_key(self, file_class=PROCESSED_FILE_PREFIX,
+                     partitioned=False):
+        if partitioned:
+            # a prefix, holding the parts and their manifest
+            k = generate_s3_key(file_class, self.state, self.source,
+                                self.download_date, "parts") + "/"
+        elif "native_file_extension" in self.config and \
                 file_class != "voter_file":
             k = generate_s3_key(file_class, self.state,
                                 self.source, self.download_date,
                                 self.config["native_file_extension"])
+        elif file_class == PROCESSED_FILE_PREFIX and \
+                self.output_format != "csv":
+            k = generate_s3_key(file_class, self.state, self.source,
+                                self.download_date,
+                                *OUTPUT_EXTENSIONS[self.output_format])
         else:
             k = generate_s3_key(file_class, self.state, self.source,
                                 self.download_date, "csv", "gz")
         return "testing/" + k if self.testing else k
 
-    def s3_dump(self, file_item, file_class=PROCESSED_FILE_PREFIX):
-        if not isinstance(file_item, FileItem):
+    def generate_meta_key(self):
+        """
+        :return: key of the meta data of the processed file, whatever its
+        output format (see utils.meta_key_for)
+        """
+        return meta_key_for(self.generate_key())
+
+    def s3_dump(self, file_item, file_class=PROCESSED_FILE_PREFIX,
+                client=None):
+        """
+        Upload file_item and, unless it is a raw file, its meta. The file
+        is streamed up in concurrent multipart parts through the shared s3
+        client: an unserialized ProcessedFile is written (and gzipped)
+        straight into the upload, so compressing and uploading overlap.
+        :param file_item: FileItem, or a producer: a callable writing the
+        file to the binary stream it is given
+        :param file_class: s3 key prefix
+        :param client: s3 client to use instead of the shared one (e.g. of
+        a local s3 stand-in)
+        :return: None
+        """
+        if not isinstance(file_item, FileItem) and not callable(file_item):
             raise ValueError("'file_item' must be of type 'FileItem'")
         if file_class != PROCESSED_FILE_PREFIX:
             if self.config["state"] == 'ohio':
@@ -385,32 +629,159 @@ class Loader(object):
                 self.download_date = str(nc_date_grab())
         meta = self.meta if self.meta is not None else {}
         meta["last_updated"] = self.download_date
-        s3.Object(self.s3_bucket, self.generate_key(file_class=file_class)).put(
-            Body=file_item.obj, ServerSideEncryption='AES256')
+        client = s3.client() if client is None else client
+        with S3MultipartWriter(self.s3_bucket,
+                               self.generate_key(file_class=file_class),
+                               client=client,
+                               ServerSideEncryption='AES256') as upload:
+            if callable(file_item):
+                file_item(upload)
+            elif isinstance(file_item, ProcessedFile) and \
+                    file_item.serialized is None:
+                file_item.write(upload, level=self.compression_level)
+            else:
+                self.copy_to(file_item.obj, upload)
+        if file_class == PROCESSED_FILE_PREFIX:
+            record_snapshot(self.s3_bucket, upload.key, upload.etag)
         if file_class != RAW_FILE_PREFIX:
-            s3.Object(self.s3_bucket, self.generate_key(
-                file_class=META_FILE_PREFIX) + ".json").put(
-                Body=json.dumps(meta), ServerSideEncryption='AES256')
+            client.put_object(
+                Bucket=self.s3_bucket, Key=self.generate_meta_key(),
+                Body=dumps_meta(meta), ServerSideEncryption='AES256')
+
+    @classmethod
+    def copy_to(cls, obj, sink, chunk_size=GZIP_BLOCK_SIZE):
+        """
+        Copy a file object (text is utf-8 encoded) into a binary sink a
+        chunk at a time, then rewind it
+        """
+        while True:
+            chunk = obj.read(chunk_size)
+            if not chunk:
+                break
+            sink.write(chunk.encode() if isinstance(chunk, str) else chunk)
+        obj.seek(0)
+
+    def dump_partitions(self, file_item, write_part, partition_by="locale",
+                        buckets=DEFAULT_BUCKETS):
+        """
+        Write a processed file as partitions (see partitions.partition_frame)
+        :param file_item: ProcessedFile
+        :param write_part: function(file name, ProcessedFile of the part)
+        writing the part and returning its size in bytes
+        :param partition_by: "locale" or "voter_id"
+        :param buckets: number of voter_id hash buckets
+        :return: manifest dict
+        """
+        if not isinstance(file_item, ProcessedFile):
+            raise ValueError("only a ProcessedFile can be partitioned")
+        extension = ".".join(OUTPUT_EXTENSIONS[self.output_format])
+        parts = []
+        for part, frame in partition_frame(file_item.frame, self.config,
+                                           partition_by, buckets):
+            part["file"] = part_file_name(len(parts), extension)
+            part["bytes"] = write_part(part["file"], ProcessedFile(
+                file_item.name, frame, output_format=self.output_format,
+                column_types=file_item.column_types,
+                **file_item.to_csv_kwargs))
+            parts.append(part)
+        logging.info("wrote {} partitions by {}".format(len(parts),
+                                                        partition_by))
+        return build_manifest(self.state, self.download_date, partition_by,
+                              self.output_format, parts, buckets=buckets)
+
+    def local_partitioned_dump(self, file_item, partition_by="locale",
+                               buckets=DEFAULT_BUCKETS):
+        """
+        local_dump, as a directory of partitions and their manifest.json
+        """
+        directory = self.generate_local_key(partitioned=True)
+        os.makedirs(directory, exist_ok=True)
+
+        def write_part(name, part_file):
+            path = os.path.join(directory, name)
+            part_file.write(path, level=self.compression_level)
+            return os.path.getsize(path)
+
+        manifest = self.dump_partitions(file_item, write_part,
+                                        partition_by, buckets)
+        with open(os.path.join(directory, MANIFEST_FILE), 'w') as fp:
+            json.dump(manifest, fp)
+        with open(self.generate_local_key(meta=True), 'w') as fp:
+            fp.write(dumps_meta(self.meta))
+        return manifest
 
-    def generate_local_key(self, meta=False):
+    def s3_partitioned_dump(self, file_item, partition_by="locale",
+                            buckets=DEFAULT_BUCKETS, client=None):
+        """
+        s3_dump of a processed file, as partitions under one prefix along
+        with their manifest.json
+        """
+        client = s3.client() if client is None else client
+        prefix = self.generate_key(partitioned=True)
+
+        def write_part(name, part_file):
+            with S3MultipartWriter(self.s3_bucket, prefix + name,
+                                   client=client,
+                                   ServerSideEncryption='AES256') as upload:
+                part_file.write(upload, level=self.compression_level)
+            return upload.bytes_out
+
+        manifest = self.dump_partitions(file_item, write_part,
+                                        partition_by, buckets)
+        meta = self.meta if self.meta is not None else {}
+        meta["last_updated"] = self.download_date
+        meta_key = self.generate_meta_key()
+        manifest["meta_key"] = meta_key
+        client.put_object(
+            Bucket=self.s3_bucket, Key=meta_key,
+            Body=dumps_meta(meta), ServerSideEncryption='AES256')
+        # the manifest goes last: once it is there the snapshot is complete
+        response = client.put_object(
+            Bucket=self.s3_bucket, Key=prefix + MANIFEST_FILE,
+            Body=json.dumps(manifest), ServerSideEncryption='AES256')
+        record_snapshot(self.s3_bucket, prefix + MANIFEST_FILE,
+                        response.get("ETag"))
+        return manifest
+
+    def generate_local_key(self, meta=False, partitioned=False):
         if meta:
             name = "meta_" + self.state + "_" + self.download_date + ".json"
+        elif partitioned:
+            name = "{}_{}.parts".format(self.state, self.download_date)
         else:
-            name = self.state + "_" + self.download_date + ".csv.gz"
+            name = "{}_{}.{}".format(
+                self.state, self.download_date,
+                ".".join(OUTPUT_EXTENSIONS[self.output_format]))
         return name
 
     def output_dataframe(self, file_item):
+        if isinstance(file_item, ProcessedFile):
+            return file_item.frame
+        if self.output_format != "csv":
+            df = read_frame(file_item.obj, self.output_format)
+            file_item.obj.seek(0)
+            return df
         return pd.read_csv(file_item.obj)
 
     def local_dump(self, file_item):
-        df = self.output_dataframe(file_item)
-        df.to_csv(self.generate_local_key(), compression='gzip')
+        if isinstance(file_item, ProcessedFile):
+            file_item.write(self.generate_local_key(),
+                            level=self.compression_level)
+        elif self.output_format != "csv":
+            with open(self.generate_local_key(), "wb") as f:
+                shutil.copyfileobj(file_item.obj, f)
+            file_item.obj.seek(0)
+        else:
+            df = self.output_dataframe(file_item)
+            df.to_csv(self.generate_local_key(), compression='gzip')
         with open(self.generate_local_key(meta=True), 'w') as fp:
-            json.dump(self.meta, fp)
+            fp.write(dumps_meta(self.meta))
 
 
 class Preprocessor(Loader):
-    def __init__(self, raw_s3_file, config_file, force_date=None, **kwargs):
+    def __init__(self, raw_s3_file, config_file, force_date=None,
+                 stable_election_codes=False, history_bitmaps=False,
+                 persist_date_memo=False, **kwargs):
 
         if force_date is None:
             force_date = date_from_str(raw_s3_file)
@@ -419,10 +790,35 @@ class Preprocessor(Loader):
             config_file=config_file, force_date=force_date,
             **kwargs)
         self.raw_s3_file = raw_s3_file
+        self.stable_election_codes = stable_election_codes
+        self.history_bitmaps = history_bitmaps
+        # reuse date strings parsed by earlier runs (see configs.DateMemo)
+        self.persist_date_memo = persist_date_memo
+        if self.persist_date_memo:
+            date_memo.load()
 
         if self.raw_s3_file is not None:
             self.main_file = self.s3_download()
 
+    def processed_file(self, df, **to_csv_kwargs):
+        """
+        The result of a preprocess_<state>
+        :param df: processed dataframe
+        :param to_csv_kwargs: how the state writes its csv
+        :return: ProcessedFile of df and self.meta, serialized in the output
+        format of this run once something reads its obj
+        """
+        column_types = self.config.database_column_types()
+        if self.output_format == "pgcopy" and self.meta is not None:
+            # binary COPY files carry no header
+            self.meta["copy_columns"] = pg_copy_columns(
+                df, column_types, bool(to_csv_kwargs.get("index", True)))
+        return ProcessedFile("{}.processed".format(self.config["state"]),
+                             df, meta=self.meta,
+                             output_format=self.output_format,
+                             s3_bucket=self.s3_bucket,
+                             column_types=column_types, **to_csv_kwargs)
+
     def s3_download(self):
         name = "/tmp/voteshield_{}" \
             .format(self.raw_s3_file.split("/")[-1])
@@ -505,13 +901,17 @@ class Preprocessor(Loader):
         file_names = sorted(file_names, key=lambda x: lengths[x["name"]],
                             reverse=True)
         outfile = StringIO()
+        unreadable = (ParserError,)
+        if self.config["file_type"] == 'xlsx':
+            from xlrd.book import XLRDError
+            unreadable = (XLRDError, ParserError)
         for f in file_names:
             try:
                 if self.config["file_type"] == 'xlsx':
                     df = pd.read_excel(f["obj"])
                 else:
                     df = pd.read_csv(f["obj"])
-            except (XLRDError, ParserError):
+            except unreadable:
                 logging.info("Skipping {} ... Unsupported format, or corrupt "
                              "file".format(f["name"]))
                 continue
@@ -566,6 +966,60 @@ class Preprocessor(Loader):
 
         return df
 
+    def stable_encoding(self, sorted_codes, sorted_codes_dict):
+        """
+        If stable_election_codes is set, renumber this snapshot's election
+        codes with the state's ElectionRegistry, so that every election keeps
+        the sparse_history index it had in earlier snapshots.
+        :param sorted_codes: array_decoding computed for this snapshot
+        :param sorted_codes_dict: array_encoding computed for this snapshot
+        :return: (array_decoding, array_encoding, array mapping each index of
+        this snapshot to the index to write in sparse_history)
+        """
+        if not self.stable_election_codes:
+            return sorted_codes, sorted_codes_dict, \
+                np.arange(len(sorted_codes))
+        registry = ElectionRegistry.load(
+            self.state, parser.parse(self.download_date).date(),
+            s3_bucket=self.s3_bucket, testing=self.testing)
+        sorted_codes, sorted_codes_dict, index_map = registry.encoding(
+            sorted_codes, sorted_codes_dict)
+        registry.save()
+        return sorted_codes, sorted_codes_dict, index_map
+
+    def history_bitmap(self, voter_ids, positions, n_codes):
+        """
+        If history_bitmaps is set, bit-pack each voter's history over the
+        state's array_decoding (see elections.pack_history), to be stored in
+        a "history_bitmap" column next to sparse_history.
+        :param voter_ids: voter id of each history row
+        :param positions: sparse_history index of each history row
+        :param n_codes: length of array_decoding
+        :return: Series of hex bitmaps indexed by voter id, or None
+        """
+        if not self.history_bitmaps:
+            return None
+        return pack_history(voter_ids, positions, n_codes)
+
+    def history_bitmap_of_lists(self, histories, n_codes):
+        """
+        history_bitmap of a column of per voter sparse_history lists
+        :param histories: Series of lists of array positions (NaN or an
+        empty list for voters without history)
+        :param n_codes: length of array_decoding
+        :return: Series of hex bitmaps with the index of histories, or None
+        """
+        if not self.history_bitmaps:
+            return None
+        # by row position, since the index may repeat voter ids
+        rows = pd.Series(histories.to_numpy(), dtype=object).explode()
+        rows = rows[rows.notna()]
+        bitmaps = pack_history(rows.index.to_numpy(),
+                               rows.to_numpy(dtype=np.int64), n_codes)
+        bitmaps = bitmaps.reindex(np.arange(len(histories)))
+        bitmaps.index = histories.index
+        return bitmaps
+
     def reconcile_columns(self, df, expected_cols):
         for c in expected_cols:
             if c not in df.columns:
@@ -631,28 +1085,15 @@ class Preprocessor(Loader):
                                    df_hist['Election_Type'].astype(
                                        str) + "_" + df_hist['Election_Party'].astype(str)
 
-        valid_elections, counts = np.unique(df_hist["election_name"],
-                                            return_counts=True)
+        # codes without a valid date are placed at the epoch
+        catalog = ElectionCatalog(df_hist["election_name"], "%Y%m%d",
+                                  date_token=lambda x: x[0:8],
+                                  default_date="1970-01-01")
+        catalog.sort(reverse=True)
+        sorted_codes, sorted_codes_dict, index_map = self.stable_encoding(
+            *catalog.encoding(catalog.iso_dates()))
 
-        def texas_datetime(x):
-            try:
-                return datetime.strptime(x[0:8], "%Y%m%d")
-            except (ValueError):
-                return datetime(1970, 1, 1)
-
-        date_order = [idx for idx, election in
-                      sorted(enumerate(valid_elections),
-                             key=lambda x: texas_datetime(x[1]),
-                             reverse=True)]
-        valid_elections = valid_elections[date_order]
-        counts = counts[date_order]
-        sorted_codes = valid_elections.tolist()
-        sorted_codes_dict = {k: {"index": i, "count": int(counts[i]),
-                                 "date": str(texas_datetime(k).date())}
-                             for i, k in enumerate(sorted_codes)}
-
-        df_hist["array_position"] = df_hist["election_name"].map(
-            lambda x: int(sorted_codes_dict[x]["index"]))
+        df_hist["array_position"] = index_map[catalog.positions]
         logging.info("Texas: history apply")
         voter_groups = df_hist.groupby(self.config['voter_id'])
         sparse_history = voter_groups["array_position"].apply(list)
@@ -662,23 +1103,23 @@ class Preprocessor(Loader):
         df_voter["sparse_history"] = sparse_history
         df_voter["all_history"] = voter_groups["election_name"].apply(list)
         df_voter["vote_type"] = vote_type
+        if self.history_bitmaps:
+            df_voter["history_bitmap"] = self.history_bitmap(
+                df_hist[self.config['voter_id']], df_hist["array_position"],
+                len(sorted_codes))
         gc.collect()
-        df_voter = self.config.coerce_strings(df_voter)
-        df_voter = self.config.coerce_dates(df_voter)
-        df_voter = self.config.coerce_numeric(df_voter, extra_cols=[
+        df_voter = self.config.coerce_all(df_voter, numeric_extra_cols=[
             'Permanent_Zipcode', 'Permanent_House_Number', 'Mailing_Zipcode'])
         df_voter.drop(self.config['hist_columns'],
                       axis=1, inplace=True)
         self.meta = {
             "message": "texas_{}".format(datetime.now().isoformat()),
-            "array_encoding": json.dumps(sorted_codes_dict),
-            "array_decoding": json.dumps(sorted_codes),
+            "array_encoding": sorted_codes_dict,
+            "array_decoding": sorted_codes,
         }
         gc.collect()
         logging.info("Texas: writing out")
-        return FileItem(name="{}.processed".format(self.config["state"]),
-                        io_obj=StringIO(df_voter.to_csv()),
-                        s3_bucket=self.s3_bucket)
+        return self.processed_file(df_voter)
 
     def preprocess_ohio(self):
         new_files = self.unpack_files(file_obj=self.main_file)
@@ -706,12 +1147,10 @@ class Preprocessor(Loader):
                              for i, k in enumerate(voting_history_cols)}
         self.meta = {
             "message": "ohio_{}".format(datetime.now().isoformat()),
-            "array_encoding": json.dumps(sorted_codes_dict),
-            "array_decoding": json.dumps(sorted_codes),
+            "array_encoding": sorted_codes_dict,
+            "array_decoding": sorted_codes,
         }
-        return FileItem(name="{}.processed".format(self.config["state"]),
-                        io_obj=StringIO(df.to_csv(encoding='utf-8')),
-                        s3_bucket=self.s3_bucket)
+        return self.processed_file(df, encoding='utf-8')
 
     def preprocess_minnesota(self):
         logging.info("Minnesota: loading voter file")
@@ -737,22 +1176,13 @@ class Preprocessor(Loader):
 
         voter_hist_df["election_name"] = voter_hist_df["ElectionDate"] + \
                                          "_" + voter_hist_df["VotingMethod"]
-        valid_elections, counts = np.unique(voter_hist_df["election_name"],
-                                            return_counts=True)
-        date_order = [idx for idx, election in
-                      sorted(enumerate(valid_elections),
-                             key=lambda x: datetime.strptime(x[1][:-2],
-                                                             "%m/%d/%Y"),
-                             reverse=True)]
-        valid_elections = valid_elections[date_order]
-        counts = counts[date_order]
-        sorted_codes = valid_elections.tolist()
-        sorted_codes_dict = {k: {"index": i, "count": int(counts[i]),
-                                 "date": date_from_str(k)}
-                             for i, k in enumerate(sorted_codes)}
+        catalog = ElectionCatalog(voter_hist_df["election_name"], "%m/%d/%Y",
+                                  date_token=lambda x: x[:-2])
+        catalog.sort(reverse=True)
+        sorted_codes, sorted_codes_dict, index_map = self.stable_encoding(
+            *catalog.encoding())
 
-        voter_hist_df["array_position"] = voter_hist_df["election_name"].map(
-            lambda x: int(sorted_codes_dict[x]["index"]))
+        voter_hist_df["array_position"] = index_map[catalog.positions]
 
         logging.info("Minnesota: history apply")
         voter_groups = voter_hist_df.groupby("VoterId")
@@ -763,26 +1193,26 @@ class Preprocessor(Loader):
 
         voter_reg_df["all_history"] = all_history
         voter_reg_df["vote_type"] = vote_type
+        if self.history_bitmaps:
+            voter_reg_df["history_bitmap"] = self.history_bitmap(
+                voter_hist_df["VoterId"], voter_hist_df["array_position"],
+                len(sorted_codes))
         gc.collect()
 
-        voter_reg_df = self.config.coerce_strings(voter_reg_df)
-        voter_reg_df = self.config.coerce_dates(voter_reg_df)
-        voter_reg_df = self.config.coerce_numeric(voter_reg_df)
+        voter_reg_df = self.config.coerce_all(voter_reg_df)
 
         self.meta = {
             "message": "minnesota_{}".format(datetime.now().isoformat()),
-            "array_encoding": json.dumps(sorted_codes_dict),
-            "array_decoding": json.dumps(sorted_codes),
+            "array_encoding": sorted_codes_dict,
+            "array_decoding": sorted_codes,
         }
 
         gc.collect()
         logging.info("Minnesota: writing out")
-        return FileItem(name="{}.processed".format(self.config["state"]),
-                        io_obj=StringIO(voter_reg_df.to_csv()),
-                        s3_bucket=self.s3_bucket)
+        return self.processed_file(voter_reg_df)
 
     def preprocess_colorado(self):
-        config = Config("colorado")
+        config = self.config
         new_files = self.unpack_files(compression='unzip',
                                       file_obj=self.main_file)
         df_voter = pd.DataFrame(columns=self.config.raw_file_columns())
@@ -846,23 +1276,13 @@ class Preprocessor(Loader):
         df_hist["election_name"] = df_hist["ELECTION_DATE"].astype(
             str) + "_" + df_hist["VOTING_METHOD"]
 
-        valid_elections, counts = np.unique(df_hist["election_name"],
-                                            return_counts=True)
+        catalog = ElectionCatalog(df_hist["election_name"], "%Y-%m-%d",
+                                  date_token=lambda x: x[0:10])
+        catalog.sort(reverse=True)
+        sorted_codes, sorted_codes_dict, index_map = self.stable_encoding(
+            *catalog.encoding())
 
-        date_order = [idx for idx, election in
-                      sorted(enumerate(valid_elections),
-                             key=lambda x: datetime.strptime(x[1][0:10],
-                                                             "%Y-%m-%d"),
-                             reverse=True)]
-        valid_elections = valid_elections[date_order]
-        counts = counts[date_order]
-        sorted_codes = valid_elections.tolist()
-        sorted_codes_dict = {k: {"index": i, "count": int(counts[i]),
-                                 "date": date_from_str(k)}
-                             for i, k in enumerate(sorted_codes)}
-
-        df_hist["array_position"] = df_hist["election_name"].map(
-            lambda x: int(sorted_codes_dict[x]["index"]))
+        df_hist["array_position"] = index_map[catalog.positions]
 
         logging.info("Colorado: history apply")
         voter_groups = df_hist.groupby(self.config["voter_id"])
@@ -875,29 +1295,29 @@ class Preprocessor(Loader):
 
         df_voter["all_history"] = all_history
         df_voter["vote_type"] = vote_type
+        if self.history_bitmaps:
+            df_voter["history_bitmap"] = self.history_bitmap(
+                df_hist[self.config["voter_id"]], df_hist["array_position"],
+                len(sorted_codes))
         gc.collect()
 
-        df_voter = self.config.coerce_strings(df_voter)
-        df_voter = self.config.coerce_dates(df_voter)
-        df_voter = self.config.coerce_numeric(df_voter, extra_cols=[
+        df_voter = self.config.coerce_all(df_voter, numeric_extra_cols=[
             "HOUSE_NUM", "UNIT_NUM", "RESIDENTIAL_ZIP_CODE",
             "RESIDENTIAL_ZIP_PLUS", "MAILING_ZIP_CODE", "MAILING_ZIP_PLUS",
             "PRECINCT_NAME", "PRECINCT", "MAILING_ADDRESS_3", "PHONE_NUM"])
 
         self.meta = {
             "message": "Colorado_{}".format(datetime.now().isoformat()),
-            "array_encoding": json.dumps(sorted_codes_dict),
-            "array_decoding": json.dumps(sorted_codes),
+            "array_encoding": sorted_codes_dict,
+            "array_decoding": sorted_codes,
         }
 
         gc.collect()
         logging.info("Colorado: writing out")
-        return FileItem(name="{}.processed".format(self.config["state"]),
-                        io_obj=StringIO(df_voter.to_csv(encoding='utf-8')),
-                        s3_bucket=self.s3_bucket)
+        return self.processed_file(df_voter, encoding='utf-8')
 
     def preprocess_georgia(self):
-        config = Config("georgia")
+        config = self.config
         logging.info("GEORGIA: loading voter and voter history file")
         new_files = self.unpack_files(
             compression='unzip', file_obj=self.main_file)
@@ -947,22 +1367,12 @@ class Preprocessor(Loader):
 
         logging.info("Creating GA sparse history")
 
-        valid_elections, counts = np.unique(history["Combo_history"],
-                                            return_counts=True)
-
-        date_order = [idx for idx, election in
-                      sorted(enumerate(valid_elections),
-                             key=lambda x: datetime.strptime(
-                                 x[1][0:8], "%Y%m%d"), reverse=True)]
-
-        valid_elections = valid_elections[date_order]
-        counts = counts[date_order]
-        sorted_codes = valid_elections.tolist()
-        sorted_codes_dict = {k: {"index": i, "count": int(counts[i]),
-                                 "date": datetime.strptime(k[0:8], "%Y%m%d")}
-                             for i, k in enumerate(sorted_codes)}
-        history["array_position"] = history["Combo_history"].map(
-            lambda x: int(sorted_codes_dict[x]["index"]))
+        catalog = ElectionCatalog(history["Combo_history"], "%Y%m%d",
+                                  date_token=lambda x: x[0:8])
+        catalog.sort(reverse=True)
+        sorted_codes, sorted_codes_dict, index_map = self.stable_encoding(
+            *catalog.encoding(list(catalog.dates)))
+        history["array_position"] = index_map[catalog.positions]
 
         voter_groups = history.groupby('Registration_Number')
         all_history = voter_groups['Combo_history'].apply(list)
@@ -971,6 +1381,10 @@ class Preprocessor(Loader):
         df_voters["party_identifier"] = "npa"
         df_voters["all_history"] = all_history
         df_voters["sparse_history"] = all_history_indices
+        if self.history_bitmaps:
+            df_voters["history_bitmap"] = self.history_bitmap(
+                history['Registration_Number'], history["array_position"],
+                len(sorted_codes))
         df_voters = config.coerce_dates(df_voters)
         df_voters = config.coerce_numeric(df_voters, extra_cols=[
             "Land_district", "Mail_house_nbr", "Land_lot",
@@ -983,15 +1397,12 @@ class Preprocessor(Loader):
 
         self.meta = {
             "message": "georgia_{}".format(datetime.now().isoformat()),
-            "array_encoding": json.dumps(sorted_codes_dict, indent=4,
-                                         sort_keys=True, default=str),
-            "array_decoding": json.dumps(sorted_codes),
-            "election_type": json.dumps(type_dict)
+            "array_encoding": sorted_codes_dict,
+            "array_decoding": sorted_codes,
+            "election_type": type_dict
         }
 
-        return FileItem(name="{}.processed".format(self.config["state"]),
-                        io_obj=StringIO(df_voters.to_csv()),
-                        s3_bucket=self.s3_bucket)
+        return self.processed_file(df_voters)
 
     def preprocess_nevada(self):
         new_files = self.unpack_files(self.main_file, compression='unzip')
@@ -1007,25 +1418,22 @@ class Preprocessor(Loader):
             error_bad_lines=False)
         df_voters.columns = self.config["ordered_columns"]
 
-        sorted_codes = df_hist.date.unique().tolist()
-        sorted_codes.sort(key=lambda x: datetime.strptime(x, "%m/%d/%Y"))
-        counts = df_hist.date.value_counts()
-        sorted_codes_dict = {k: {"index": i,
-                                 "count": int(counts.loc[k]),
-                                 "date": date_from_str(k)}
-                             for i, k in enumerate(sorted_codes)}
-
-        def insert_code_bin(arr):
-            if isinstance(arr, list):
-                return [sorted_codes_dict[k]["index"] for k in arr]
-            else:
-                return np.nan
+        catalog = ElectionCatalog(df_hist.date, "%m/%d/%Y", sort=False)
+        catalog.sort()
+        sorted_codes, sorted_codes_dict, index_map = self.stable_encoding(
+            *catalog.encoding())
+        df_hist['array_position'] = index_map[catalog.positions]
 
         df_voters = df_voters.set_index('VoterID', drop=False)
         voter_id_groups = df_hist.groupby('VoterID')
         df_voters['all_history'] = voter_id_groups['date'].apply(list)
         df_voters['votetype_history'] = voter_id_groups['vote_code'].apply(list)
-        df_voters['sparse_history'] = df_voters['all_history'].map(insert_code_bin)
+        df_voters['sparse_history'] = voter_id_groups['array_position'].apply(
+            list)
+        if self.history_bitmaps:
+            df_voters['history_bitmap'] = self.history_bitmap(
+                df_hist['VoterID'], df_hist['array_position'],
+                len(sorted_codes))
 
         # create compound string for unique voter ID from county ID
         df_voters['County_Voter_ID'] = df_voters['County'].str.replace(
@@ -1040,12 +1448,10 @@ class Preprocessor(Loader):
 
         self.meta = {
             "message": "nevada_{}".format(datetime.now().isoformat()),
-            "array_encoding": json.dumps(sorted_codes_dict),
-            "array_decoding": json.dumps(sorted_codes),
+            "array_encoding": sorted_codes_dict,
+            "array_decoding": sorted_codes,
         }
-        return FileItem(name="{}.processed".format(self.config["state"]),
-                        io_obj=StringIO(df_voters.to_csv(index=False)),
-                        s3_bucket=self.s3_bucket)
+        return self.processed_file(df_voters, index=False)
 
     def preprocess_florida(self):
         logging.info("preprocessing florida")
@@ -1073,22 +1479,13 @@ class Preprocessor(Loader):
         df_hist = df_hist[df_hist["date"].map(lambda x: len(x)) > 5]
         df_hist["election_name"] = df_hist["date"] + "_" + \
                                    df_hist["election_type"]
-        valid_elections, counts = np.unique(df_hist["election_name"],
-                                            return_counts=True)
-        date_order = [idx for idx, election in
-                      sorted(enumerate(valid_elections),
-                             key=lambda x: datetime.strptime(x[1][:-4],
-                                                             "%m/%d/%Y"),
-                             reverse=True)]
-        valid_elections = valid_elections[date_order]
-        counts = counts[date_order]
-        sorted_codes = valid_elections.tolist()
-        sorted_codes_dict = {k: {"index": i, "count": int(counts[i]),
-                                 "date": date_from_str(k)}
-                             for i, k in enumerate(sorted_codes)}
+        catalog = ElectionCatalog(df_hist["election_name"], "%m/%d/%Y",
+                                  date_token=lambda x: x[:-4])
+        catalog.sort(reverse=True)
+        sorted_codes, sorted_codes_dict, index_map = self.stable_encoding(
+            *catalog.encoding())
 
-        df_hist["array_position"] = df_hist["election_name"].map(
-            lambda x: int(sorted_codes_dict[x]["index"]))
+        df_hist["array_position"] = index_map[catalog.positions]
 
         logging.info("FLORIDA: history apply")
         voter_groups = df_hist.groupby("VoterID")
@@ -1104,11 +1501,13 @@ class Preprocessor(Loader):
 
         df_voters["all_history"] = all_history
         df_voters["vote_type"] = vote_type
+        if self.history_bitmaps:
+            df_voters["history_bitmap"] = self.history_bitmap(
+                df_hist["VoterID"], df_hist["array_position"],
+                len(sorted_codes))
         gc.collect()
 
-        df_voters = self.config.coerce_strings(df_voters)
-        df_voters = self.config.coerce_dates(df_voters)
-        df_voters = self.config.coerce_numeric(df_voters, extra_cols=[
+        df_voters = self.config.coerce_all(df_voters, numeric_extra_cols=[
             "Precinct", "Precinct_Split", "Daytime_Phone_Number",
             "Daytime_Area_Code", "Daytime_Phone_Extension",
             "Daytime_Area_Code", "Daytime_Phone_Extension",
@@ -1125,9 +1524,7 @@ class Preprocessor(Loader):
 
         gc.collect()
         logging.info("FLORIDA: writing out")
-        return FileItem(name="{}.processed".format(self.config["state"]),
-                        io_obj=StringIO(df_voters.to_csv()),
-                        s3_bucket=self.s3_bucket)
+        return self.processed_file(df_voters)
 
     def preprocess_kansas(self):
         new_files = self.unpack_files(
@@ -1177,6 +1574,8 @@ class Preprocessor(Loader):
             sorted_codes_dict = {k: {"index": i, "count": int(counts[i]),
                                      "date": ks_hist_date(k)}
                                  for i, k in enumerate(sorted_codes)}
+            sorted_codes, sorted_codes_dict, _ = self.stable_encoding(
+                sorted_codes, sorted_codes_dict)
 
             def insert_code_bin(arr):
                 return [sorted_codes_dict[k]["index"] for k in arr]
@@ -1188,19 +1587,18 @@ class Preprocessor(Loader):
             return sorted_codes, sorted_codes_dict
 
         sorted_codes, sorted_codes_dict = add_history(main_df=df)
+        if self.history_bitmaps:
+            df["history_bitmap"] = self.history_bitmap_of_lists(
+                df["all_history"], len(sorted_codes))
 
-        df = self.config.coerce_numeric(df)
-        df = self.config.coerce_strings(df)
-        df = self.config.coerce_dates(df)
+        df = self.config.coerce_all(df)
         self.meta = {
             "message": "kansas_{}".format(datetime.now().isoformat()),
             "array_encoding": sorted_codes_dict,
             "array_decoding": sorted_codes,
         }
 
-        return FileItem(name="{}.processed".format(self.config["state"]),
-                        io_obj=StringIO(df.to_csv(encoding='utf-8',index=False)),
-                        s3_bucket=self.s3_bucket)
+        return self.processed_file(df, encoding='utf-8', index=False)
 
     def preprocess_iowa(self):
         def is_first_file(fname):
@@ -1232,86 +1630,47 @@ class Preprocessor(Loader):
                 skiprows=skiprows, names=total_cols, error_bad_lines=False)
             df_voters = pd.concat([df_voters, new_df], axis=0)
 
-        key_delim = "_"
-        df_voters["all_history"] = ''
         df_voters = df_voters[df_voters.COUNTY != "COUNTY"]
-        # instead of iterating over all of the columns for each row, we should
-        # handle all this beforehand.
-        # also we should not compute the unique values until after, not before
         df_voters.drop(columns=buffer_cols, inplace=True)
 
-        for c in self.config["election_dates"]:
-            null_rows = df_voters[c].isnull()
-            df_voters[c][null_rows] = ""
-
-            # each key contains info from the columns
-            prefix = c.split("_")[0] + key_delim
-
-            # and the corresponding votervotemethod column
-            vote_type_col = c.replace("ELECTION_DATE", "VOTERVOTEMETHOD")
-            null_rows = df_voters[vote_type_col].isnull()
-            df_voters[vote_type_col].loc[null_rows] = ""
-            # add election type and date
-            df_voters[c] = prefix + df_voters[c].str.strip()
-            # add voting method
-            df_voters[c] += key_delim + df_voters[vote_type_col].str.strip()
-
-            # the code below will format each key as
-            # <election_type>_<date>_<voting_method>_<political_party>_
-            # <political_org>
-            if "PRIMARY" in prefix:
-
-                # so far so good but we need more columns in the event of a
-                # primary
-                org_col = c.replace("PRIMARY_ELECTION_DATE",
-                                    "POLITICAL_ORGANIZATION")
-                party_col = c.replace("PRIMARY_ELECTION_DATE",
-                                      "POLITICAL_PARTY")
-                df_voters[org_col].loc[df_voters[org_col].isnull()] = ""
-                df_voters[party_col].loc[df_voters[party_col].isnull()] = ""
-                party_info = df_voters[party_col].str.strip() + key_delim + \
-                             df_voters[org_col].str.replace(" ", "")
-                df_voters[c] += key_delim + party_info
-            else:
-                # add 'blank' values for the primary slots
-                df_voters[c] += key_delim + key_delim
-
-            df_voters[c] = df_voters[c].str.replace(prefix + key_delim * 3, '')
-            df_voters[c] = df_voters[c].str.replace('"', '')
-            df_voters[c] = df_voters[c].str.replace("'", '')
-            df_voters.all_history += " " + df_voters[c]
-
-        # make into an array (null values are '' so they are ignored)
-        df_voters.all_history = df_voters.all_history.str.split()
-        elections, counts = np.unique(df_voters[self.config["election_dates"]],
-                                      return_counts=True)
-        # we want reverse order (lower indices are higher frequency)
-        count_order = counts.argsort()[::-1]
-        elections = elections[count_order]
-        counts = counts[count_order]
+        elections, counts, codes, code_index, voted = iowa_history(
+            df_voters, self.config["election_dates"])
 
         # create meta
         sorted_codes_dict = {j: {"index": i, "count": int(counts[i]),
                                  "date": date_from_str(j)}
                              for i, j in enumerate(elections)}
-
-        default_item = {"index": len(elections)}
-
-        def ins_code_bin(a):
-            return [sorted_codes_dict.get(k, default_item)["index"] for k in a]
+        elections, sorted_codes_dict, index_map = self.stable_encoding(
+            elections.tolist(), sorted_codes_dict)
+        elections = np.array(elections, dtype=object)
+        code_index = index_map[code_index]
 
         # In an instance like this, where we've created our own systematized
         # labels for each election I think it makes sense to also keep them
         # in addition to the sparse history
-        df_voters["sparse_history"] = df_voters.all_history.apply(ins_code_bin)
+        n_slots = len(self.config["election_dates"])
+        all_history, sparse_history, sparse_index = history_lists(
+            elections, code_index, codes, voted, n_slots)
+        df_voters["all_history"] = pd.Series(all_history,
+                                             index=df_voters.index)
+        df_voters["sparse_history"] = pd.Series(sparse_history,
+                                                index=df_voters.index)
+        if self.history_bitmaps:
+            # the code block is in voter order, so key bitmaps by row number
+            voter_rows = np.repeat(np.arange(len(df_voters)), n_slots)[voted]
+            df_voters["history_bitmap"] = self.history_bitmap(
+                voter_rows, sparse_index, len(elections)).reindex(
+                np.arange(len(df_voters))).values
 
         self.meta = {
             "message": "iowa_{}".format(datetime.now().isoformat()),
-            "array_encoding": json.dumps(sorted_codes_dict),
-            "array_decoding": json.dumps(elections.tolist()),
+            "array_encoding": sorted_codes_dict,
+            "array_decoding": elections.tolist(),
         }
         wanted_cols = self.config["ordered_columns"] + \
                       self.config["ordered_generated_columns"]
+        if self.history_bitmaps:
+            wanted_cols = wanted_cols + ["history_bitmap"]
         df_voters = df_voters[wanted_cols]
         for c in df_voters.columns:
             df_voters[c].loc[df_voters[c].isnull()] = ""
@@ -1329,10 +1688,7 @@ class Preprocessor(Loader):
         df_voters['REGN_NUM'] = pd.to_numeric(df_voters['REGN_NUM'],
                                               errors='coerce').fillna(0)
         df_voters['REGN_NUM'] = df_voters['REGN_NUM'].astype(int)
-        return FileItem(name="{}.processed".format(self.config["state"]),
-                        io_obj=StringIO(df_voters.to_csv(encoding='utf-8',
-                                                         index=False)),
-                        s3_bucket=self.s3_bucket)
+        return self.processed_file(df_voters, encoding='utf-8', index=False)
 
     def preprocess_arizona2(self):
 
@@ -1378,9 +1734,7 @@ class Preprocessor(Loader):
         main_df = add_files_to_main_df(main_df, other_files)
         main_df.reset_index(drop=True, inplace=True)
 
-        main_df = self.config.coerce_dates(main_df)
-        main_df = self.config.coerce_strings(main_df)
-        main_df = self.config.coerce_numeric(main_df, extra_cols=[
+        main_df = self.config.coerce_all(main_df, numeric_extra_cols=[
             'HouseNumber', 'UnitNumber', 'ResidenceZip', 'MailingZip',
             'Phone', 'PrecinctPart', 'VRAZVoterID'])
 
@@ -1434,18 +1788,19 @@ class Preprocessor(Loader):
 
         expected_cols = self.config['ordered_columns'] + \
                         self.config['ordered_generated_columns']
+        if self.history_bitmaps:
+            voter_df['history_bitmap'] = self.history_bitmap_of_lists(
+                voter_df['sparse_history'], len(sorted_codes))
+            expected_cols = expected_cols + ['history_bitmap']
         voter_df = self.reconcile_columns(voter_df, expected_cols)
         voter_df = voter_df[expected_cols]
 
         self.meta = {
             "message": "arizona2_{}".format(datetime.now().isoformat()),
-            "array_encoding": json.dumps(sorted_codes_dict),
-            "array_decoding": json.dumps(sorted_codes),
+            "array_encoding": sorted_codes_dict,
+            "array_decoding": sorted_codes,
         }
-        return FileItem(name="{}.processed".format(self.config["state"]),
-                        io_obj=StringIO(voter_df.to_csv(encoding='utf-8',
-                                                        index=False)),
-                        s3_bucket=self.s3_bucket)
+        return self.processed_file(voter_df, encoding='utf-8', index=False)
 
     def preprocess_arizona(self):
         new_files = self.unpack_files(
@@ -1487,16 +1842,13 @@ class Preprocessor(Loader):
             "text_mail_address4"])
         self.meta = {
             "message": "arizona_{}".format(datetime.now().isoformat()),
-            "array_dates": json.dumps(elections_key)
+            "array_dates": elections_key
         }
 
-        return FileItem(name="{}.processed".format(self.config["state"]),
-                        io_obj=StringIO(main_df.to_csv(encoding='utf-8',
-                                                       index=False)),
-                        s3_bucket=self.s3_bucket)
+        return self.processed_file(main_df, encoding='utf-8', index=False)
 
     def preprocess_new_york(self):
-        config = Config("new_york")
+        config = self.config
         new_files = self.unpack_files(
             file_obj=self.main_file, compression="infer")
         self.main_file = list(filter(
@@ -1510,55 +1862,58 @@ class Preprocessor(Loader):
         gc.collect()
         null_hists = main_df.voterhistory != main_df.voterhistory
         main_df.voterhistory[null_hists] = NULL_CHAR
-        all_codes = main_df.voterhistory.str.replace(" ", "_") \
-            .str.replace("[", "") \
-            .str.replace("]", "")
-        all_codes = all_codes.str.cat(sep=";")
-        all_codes = np.array(all_codes.split(";"))
-        logging.info("Making all_history")
-        main_df["all_history"] = strcol_to_array(main_df.voterhistory,
-                                                 delim=";")
-        unique_codes, counts = np.unique(all_codes, return_counts=True)
+        logging.info("Tokenizing voter history")
+        codes, offsets, unique_codes = tokenize_delimited(
+            main_df.voterhistory, delim=";")
+        counts = np.bincount(codes, minlength=len(unique_codes))
         gc.collect()
 
-        count_order = counts.argsort()
+        # codes in lexical order, then by count
+        lex_order = unique_codes.argsort(kind="stable")
+        count_order = lex_order[counts[lex_order].argsort(kind="stable")]
         unique_codes = unique_codes[count_order]
         counts = counts[count_order]
         sorted_codes = unique_codes.tolist()
         sorted_codes_dict = {k: {"index": i, "count": int(counts[i])} for i, k in
                              enumerate(sorted_codes)}
+        sorted_codes, sorted_codes_dict, index_map = self.stable_encoding(
+            sorted_codes, sorted_codes_dict)
+        code_index = np.empty(len(count_order), dtype=np.int64)
+        code_index[count_order] = index_map
         gc.collect()
 
-        def insert_code_bin(arr):
-            return [sorted_codes_dict[k]["index"] for k in arr]
-
         # in this case we save ny as sparse array since so many elections are
         # stored
-        logging.info("Mapping history codes")
-        main_df.all_history = main_df.all_history.map(insert_code_bin)
-        main_df = self.config.coerce_dates(main_df)
-        main_df = self.config.coerce_strings(main_df)
-        main_df = self.config.coerce_numeric(main_df, extra_cols=[
+        logging.info("Making all_history")
+        main_df["all_history"] = pd.Series(
+            [a.tolist() for a in
+             np.split(code_index[codes], offsets[1:-1])],
+            index=main_df.index)
+        if self.history_bitmaps:
+            # packed straight from the codes, by row position
+            bitmaps = self.history_bitmap(
+                np.repeat(np.arange(len(main_df)), np.diff(offsets)),
+                code_index[codes], len(sorted_codes))
+            main_df["history_bitmap"] = bitmaps.reindex(
+                np.arange(len(main_df))).to_numpy()
+        del codes
+        main_df = self.config.coerce_all(main_df, numeric_extra_cols=[
             "raddnumber", "rhalfcode", "rapartment", "rzip5", "rzip4",
             "mailadd4", "ward", "countyvrnumber", "lastvoteddate",
             "prevyearvoted", "prevcounty"])
         self.meta = {
             "message": "new_york_{}".format(datetime.now().isoformat()),
-            "array_encoding": json.dumps(sorted_codes_dict),
-            "array_decoding": json.dumps(sorted_codes),
+            "array_encoding": sorted_codes_dict,
+            "array_decoding": sorted_codes,
         }
         gc.collect()
 
-        return FileItem(name="{}.processed".format(self.config["state"]),
-                        io_obj=StringIO(main_df.to_csv(index=False,
-                                                       encoding='utf-8')),
-                        s3_bucket=self.s3_bucket)
+        return self.processed_file(main_df, index=False, encoding='utf-8')
 
     def preprocess_north_carolina(self):
         new_files = self.unpack_files(
             file_obj=self.main_file)  # array of dicts
 
-        self.config = Config("north_carolina")
         for i in new_files:
             if ("ncvhis" in i['name']) and (".txt" in i['name']):
                 vote_hist_file = i
@@ -1581,6 +1936,8 @@ class Preprocessor(Loader):
         sorted_codes_dict = {k: {"index": i, "count": int(counts[i]),
                                  "date": date_from_str(k)}
                              for i, k in enumerate(sorted_codes)}
+        sorted_codes, sorted_codes_dict, _ = self.stable_encoding(
+            sorted_codes, sorted_codes_dict)
         vote_hist["array_position"] = vote_hist["election_desc"].map(
             lambda x: int(sorted_codes_dict[x]["index"]))
 
@@ -1592,10 +1949,12 @@ class Preprocessor(Loader):
 
         voter_df["all_history"] = all_history
         voter_df["vote_type"] = vote_type
+        if self.history_bitmaps:
+            voter_df["history_bitmap"] = self.history_bitmap(
+                vote_hist[self.config["voter_id"]],
+                vote_hist["array_position"], len(sorted_codes))
 
-        voter_df = self.config.coerce_strings(voter_df)
-        voter_df = self.config.coerce_dates(voter_df)
-        voter_df = self.config.coerce_numeric(voter_df, extra_cols=[
+        voter_df = self.config.coerce_all(voter_df, numeric_extra_cols=[
             "county_commiss_abbrv", "fire_dist_abbrv", "full_phone_number",
             "judic_dist_abbrv", "munic_dist_abbrv", "municipality_abbrv",
             "precinct_abbrv", "precinct_desc", "school_dist_abbrv",
@@ -1604,14 +1963,11 @@ class Preprocessor(Loader):
 
         self.meta = {
             "message": "north_carolina_{}".format(datetime.now().isoformat()),
-            "array_encoding": json.dumps(sorted_codes_dict),
-            "array_decoding": json.dumps(sorted_codes),
+            "array_encoding": sorted_codes_dict,
+            "array_decoding": sorted_codes,
         }
         self.is_compressed = False
-        return FileItem(name="{}.processed".format(self.config["state"]),
-                        io_obj=StringIO(voter_df.to_csv(
-                            index=True, encoding='utf-8')),
-                        s3_bucket=self.s3_bucket)
+        return self.processed_file(voter_df, index=True, encoding='utf-8')
 
     def preprocess_missouri(self):
         new_files = self.unpack_files(
@@ -1653,6 +2009,8 @@ class Preprocessor(Loader):
             sorted_codes_dict = {k: {"index": i, "count": int(counts[i]),
                                      "date": date_from_str(k)}
                                  for i, k in enumerate(sorted_codes)}
+            sorted_codes, sorted_codes_dict, _ = self.stable_encoding(
+                sorted_codes, sorted_codes_dict)
 
             def insert_code_bin(arr):
                 return [sorted_codes_dict[k]["index"] for k in arr]
@@ -1664,6 +2022,9 @@ class Preprocessor(Loader):
             return sorted_codes, sorted_codes_dict
 
         sorted_codes, sorted_codes_dict = add_history(main_df)
+        if self.history_bitmaps:
+            main_df["history_bitmap"] = self.history_bitmap_of_lists(
+                main_df["all_history"], len(sorted_codes))
         main_df.drop(self.config['hist_columns'], axis=1, inplace=True)
 
         main_df = self.config.coerce_dates(main_df)
@@ -1678,13 +2039,41 @@ class Preprocessor(Loader):
             "array_decoding": sorted_codes,
         }
 
-        return FileItem(name="{}.processed".format(self.config["state"]),
-                        io_obj=StringIO(main_df.to_csv(encoding='utf-8',
-                                                       index=False)),
-                        s3_bucket=self.s3_bucket)
+        return self.processed_file(main_df, encoding='utf-8', index=False)
+
+    def election_code_table(self, election_codes):
+        """
+        Election codes of a state that ships no code file with this
+        snapshot: the local code table, and only if that is missing codes,
+        those in the meta data of the closest earlier snapshot
+        :param election_codes: history column of election codes
+        :return: ElectionCodeTable
+        """
+        code_table = ElectionCodeTable.load(self.state)
+        if len(code_table.missing(election_codes)) > 0:
+            this_date = parser.parse(
+                date_from_str(self.raw_s3_file)).date()
+            pre_date, post_date, pre_key, post_key = \
+                get_surrounding_dates(this_date, self.state,
+                                      self.s3_bucket, testing=self.testing)
+            if pre_key is not None:
+                nearest_meta = get_metadata_for_key(pre_key, self.s3_bucket)
+                nearest_codes = nearest_meta.get('elec_code_dict')
+                if nearest_codes and code_table.update(
+                        nearest_codes, snapshot=pre_date):
+                    code_table.save()
+                if len(code_table) == 0:
+                    raise MissingElectionCodesError(
+                        'No election codes in nearby meta data.')
+        if len(code_table) == 0:
+            raise MissingElectionCodesError(
+                'No election code file or nearby meta data found.')
+        logging.info('Using {} election code table version {}'.format(
+            self.state, code_table.version))
+        return code_table
 
     def preprocess_michigan(self):
-        config = Config('michigan')
+        config = self.config
         new_files = self.unpack_files(file_obj=self.main_file)
         voter_file = ([n for n in new_files if 'entire_state_v' in n['name'] or
                        'EntireStateVoters' in n['name']] + [None])[0]
@@ -1784,35 +2173,24 @@ class Preprocessor(Loader):
                     edf = self.read_csv_count_error_lines(
                         elec_codes['obj'], names=config['elec_code_columns'],
                         na_filter=False, error_bad_lines=False)
+                    edf['Date'] = pd.to_datetime(edf['Date'])
                 else:
                     raise NotImplementedError('File format not implemented')
 
                 # make a code dictionary that will be stored with meta data
-                for idx, row in edf.iterrows():
-                    d = row['Date'].strftime('%Y-%m-%d')
-                    elec_code_dict[row['Election_Code']] = {
-                        'Date': d,
-                        'Slug': d + '_' + str(row['Election_Code']) + '_' + \
-                                row['Title'].replace(' ', '-').replace('_', '-')}
+                file_table = ElectionCodeTable.from_frame(self.state, edf)
+                elec_code_dict = file_table.codes
+                code_table = ElectionCodeTable.load(self.state)
+                if code_table.update(elec_code_dict,
+                                     snapshot=self.download_date):
+                    code_table.save()
+                code_table = file_table
             else:
-                # Get election codes from most recent meta data
-                this_date = parser.parse(date_from_str(self.raw_s3_file)).date()
-                pre_date, post_date, pre_key, post_key = get_surrounding_dates(
-                    this_date, self.state, self.s3_bucket, testing=self.testing)
-                if pre_key is not None:
-                    nearest_meta = get_metadata_for_key(pre_key, self.s3_bucket)
-                    elec_code_dict = nearest_meta['elec_code_dict']
-                    if len(elec_code_dict) == 0:
-                        raise MissingElectionCodesError(
-                            'No election codes in nearby meta data.')
-                else:
-                    raise MissingElectionCodesError(
-                        'No election code file or nearby meta data found.')
+                code_table = self.election_code_table(hdf['ELECTION_CODE'])
+                elec_code_dict = code_table.codes
 
             # Election code lookup
-            hdf['ELECTION_NAME'] = hdf['ELECTION_CODE'].map(
-                lambda x: elec_code_dict[str(x)]['Slug']
-                if str(x) in elec_code_dict else str(x))
+            hdf['ELECTION_NAME'] = code_table.resolve(hdf['ELECTION_CODE'])
 
         # Create meta data
         counts = hdf['ELECTION_NAME'].value_counts()
@@ -1822,6 +2200,8 @@ class Preprocessor(Loader):
                                  'count': int(counts[i]),
                                  'date': date_from_str(k)}
                              for i, k in enumerate(sorted_codes)}
+        sorted_codes, sorted_codes_dict, _ = self.stable_encoding(
+            sorted_codes, sorted_codes_dict)
 
         # Collect histories
         vdf.set_index(config['voter_id'], drop=False, inplace=True)
@@ -1844,6 +2224,9 @@ class Preprocessor(Loader):
         if missing_history_dates:
             vdf['all_history'] = None
             vdf['sparse_history'] = None
+        elif self.history_bitmaps:
+            vdf['history_bitmap'] = self.history_bitmap_of_lists(
+                vdf['sparse_history'], len(sorted_codes))
 
         vdf = self.config.coerce_dates(vdf)
         vdf = self.config.coerce_numeric(
@@ -1857,13 +2240,10 @@ class Preprocessor(Loader):
             "array_decoding": sorted_codes,
             "elec_code_dict": elec_code_dict
         }
-        return FileItem(name="{}.processed".format(self.config["state"]),
-                        io_obj=StringIO(vdf.to_csv(encoding='utf-8',
-                                                   index=False)),
-                        s3_bucket=self.s3_bucket)
+        return self.processed_file(vdf, encoding='utf-8', index=False)
 
     def preprocess_pennsylvania(self):
-        config = Config('pennsylvania')
+        config = self.config
         new_files = self.unpack_files(file_obj=self.main_file)
         voter_files = [f for f in new_files if "FVE" in f["name"]]
         election_maps = [f for f in new_files if "Election Map" in f["name"]]
@@ -1961,14 +2341,11 @@ class Preprocessor(Loader):
             "message": "pennsylvania_{}".format(datetime.now().isoformat()),
         }
 
-        return FileItem(name="{}.processed".format(self.config["state"]),
-                        io_obj=StringIO(main_df.to_csv(encoding='utf-8',
-                                                       index=False)),
-                        s3_bucket=self.s3_bucket)
+        return self.processed_file(main_df, encoding='utf-8', index=False)
 
     def preprocess_new_jersey(self):
         new_files = self.unpack_files(file_obj=self.main_file)
-        config = Config("new_jersey")
+        config = self.config
         voter_files = [n for n in new_files if 'AlphaVoter' in n["name"]]
 
         hist_files = [n for n in new_files if 'History' in n["name"]]
@@ -2024,6 +2401,9 @@ class Preprocessor(Loader):
                 return [elec_dict[k]['index'] for k in arr]
 
         vdf['sparse_history'] = vdf['all_history'].apply(insert_code_bin)
+        if self.history_bitmaps:
+            vdf['history_bitmap'] = self.history_bitmap_of_lists(
+                vdf['sparse_history'], len(elections))
         vdf.loc[
             vdf[self.config['birthday_identifier']] <
             pd.to_datetime('1900-01-01'),
@@ -2035,22 +2415,18 @@ class Preprocessor(Loader):
             "array_decoding": elections
         }
 
-        return FileItem(name="{}.processed".format(self.config["state"]),
-                        io_obj=StringIO(vdf.to_csv(encoding='utf-8',
-                                                   index=False)),
-                        s3_bucket=self.s3_bucket)
+        return self.processed_file(vdf, encoding='utf-8', index=False)
 
     def preprocess_new_jersey2(self):
 
-        def format_birthdays_differently_per_county(df):
+        def format_birthdays_differently_per_county(df, county):
             field = self.config['birthday_identifier']
             df[field] = df[field].apply(str)
-            for format_str in self.config['date_format']:
-                formatted = pd.to_datetime(df[field], format=format_str,
+            format_str = self.config.infer_date_format(
+                df[field], field, county=county, min_parsed=0.5)
+            if format_str is not None:
+                df[field] = pd.to_datetime(df[field], format=format_str,
                                            errors='coerce')
-                if len(formatted[~formatted.isna()]) > (0.5 * len(formatted)):
-                    df[field] = formatted
-                    break
             return df
 
         def combine_dfs(filelist):
@@ -2060,7 +2436,8 @@ class Preprocessor(Loader):
                 new_df = self.read_csv_count_error_lines(
                     f['obj'], error_bad_lines=False)
                 if 'vlist' in f['name']:
-                    new_df = format_birthdays_differently_per_county(new_df)
+                    new_df = format_birthdays_differently_per_county(
+                        new_df, os.path.basename(f['name']))
                 df = pd.concat([df, new_df], axis=0)
             return df
 
@@ -2142,24 +2519,25 @@ class Preprocessor(Loader):
 
         expected_cols = self.config['ordered_columns'] + \
                         self.config['ordered_generated_columns']
+        if self.history_bitmaps:
+            voter_df['history_bitmap'] = self.history_bitmap_of_lists(
+                voter_df['sparse_history'], len(sorted_codes))
+            expected_cols = expected_cols + ['history_bitmap']
         voter_df = self.reconcile_columns(voter_df, expected_cols)
         voter_df = voter_df[expected_cols]
 
         self.meta = {
             "message": "new_jersey2_{}".format(datetime.now().isoformat()),
-            "array_encoding": json.dumps(sorted_codes_dict),
-            "array_decoding": json.dumps(sorted_codes),
+            "array_encoding": sorted_codes_dict,
+            "array_decoding": sorted_codes,
         }
-        return FileItem(name="{}.processed".format(self.config["state"]),
-                        io_obj=StringIO(voter_df.to_csv(encoding='utf-8',
-                                                        index=False)),
-                        s3_bucket=self.s3_bucket)
+        return self.processed_file(voter_df, encoding='utf-8', index=False)
 
     def preprocess_wisconsin(self):
         new_files = self.unpack_files(
             file_obj=self.main_file, compression="unzip")
 
-        config = Config("wisconsin")
+        config = self.config
         preferred_files = [x for x in new_files
                            if (".txt" in x["name"])]
         if len(preferred_files) > 0:
@@ -2237,6 +2615,9 @@ class Preprocessor(Loader):
         main_df['sparse_history'] = main_df[valid_elections].apply(insert_code_bin, axis=1)
         main_df['all_history'] = main_df[valid_elections].apply(get_all_history, axis=1)
         main_df['votetype_history'] = main_df[valid_elections].apply(get_type_history, axis=1)
+        if self.history_bitmaps:
+            main_df['history_bitmap'] = self.history_bitmap_of_lists(
+                main_df['sparse_history'], len(sorted_codes))
 
         main_df.drop(columns=valid_elections, inplace=True)
         gc.collect()
@@ -2255,13 +2636,10 @@ class Preprocessor(Loader):
         # self.is_compressed = False
         logging.info("Wisconsin: writing out")
 
-        return FileItem(name="{}.processed".format(self.config["state"]),
-                        io_obj=StringIO(main_df.to_csv(encoding='utf-8',
-                                                       index=False)),
-                        s3_bucket=self.s3_bucket)
+        return self.processed_file(main_df, encoding='utf-8', index=False)
 
     def preprocess_new_hampshire(self):
-        config = Config('new_hampshire')
+        config = self.config
         new_files = self.unpack_files(file_obj=self.main_file,
                                       compression='unzip')
         for f in new_files:
@@ -2298,25 +2676,23 @@ class Preprocessor(Loader):
         hist_df['combined_name'] = hist_df['election_name'].str.replace(
             ' ', '_').str.lower() + '_' + hist_df['election_date']
 
-        sorted_codes = hist_df['combined_name'].unique().tolist()
-        sorted_codes.sort(key=lambda x: datetime.strptime(
-            x.split('_')[-1], "%m/%d/%Y"))
-        counts = hist_df['combined_name'].value_counts()
-        sorted_codes_dict = {k: {'index': i,
-                                 'count': int(counts.loc[k]),
-                                 'date': k.split('_')[-1]}
-                             for i, k in enumerate(sorted_codes)}
-
-        def insert_code_bin(arr):
-            if isinstance(arr, list):
-                return [sorted_codes_dict[k]['index'] for k in arr]
-            else:
-                return np.nan
+        catalog = ElectionCatalog(hist_df['combined_name'], "%m/%d/%Y",
+                                  date_token=lambda x: x.split('_')[-1],
+                                  sort=False)
+        catalog.sort()
+        sorted_codes, sorted_codes_dict, index_map = self.stable_encoding(
+            *catalog.encoding())
+        hist_df['array_position'] = index_map[catalog.positions]
 
         voters_df = voters_df.set_index('id_voter', drop=False)
         voter_id_groups = hist_df.groupby('id_voter')
         voters_df['all_history'] = voter_id_groups['combined_name'].apply(list)
-        voters_df['sparse_history'] = voters_df['all_history'].map(insert_code_bin)
+        voters_df['sparse_history'] = voter_id_groups['array_position'].apply(
+            list)
+        if self.history_bitmaps:
+            voters_df['history_bitmap'] = self.history_bitmap(
+                hist_df['id_voter'], hist_df['array_position'],
+                len(sorted_codes))
         voters_df['election_type_history'] = voter_id_groups['election_type'].apply(list)
         voters_df['election_category_history'] = voter_id_groups['election_category'].apply(list)
         voters_df['votetype_history'] = voter_id_groups['ballot_type'].apply(list)
@@ -2325,12 +2701,10 @@ class Preprocessor(Loader):
 
         self.meta = {
             "message": "new_hampshire_{}".format(datetime.now().isoformat()),
-            "array_encoding": json.dumps(sorted_codes_dict),
-            "array_decoding": json.dumps(sorted_codes),
+            "array_encoding": sorted_codes_dict,
+            "array_decoding": sorted_codes,
         }
-        return FileItem(name="{}.processed".format(self.config["state"]),
-                        io_obj=StringIO(voters_df.to_csv(index=False)),
-                        s3_bucket=self.s3_bucket)
+        return self.processed_file(voters_df, index=False)
 
     def preprocess_virginia(self):
         new_files = self.unpack_files(file_obj=self.main_file,
@@ -2353,11 +2727,9 @@ class Preprocessor(Loader):
                 logging.info("voter file found")
                 voters_df = self.read_csv_count_error_lines(f['obj'], error_bad_lines=False, encoding="ISO-8859-1")
         voters_df[self.config["party_identifier"]] = np.nan
-        voters_df = self.config.coerce_strings(voters_df)
-        voters_df = self.config.coerce_numeric(
-                voters_df, extra_cols=['TOWNPREC_CODE_VALUE', 'SUPERDIST_CODE_VALUE',
-                                       'HOUSE_NUMBER', 'MAILING_ZIP' ])
-        voters_df = self.config.coerce_dates(voters_df)
+        voters_df = self.config.coerce_all(voters_df, numeric_extra_cols=[
+            'TOWNPREC_CODE_VALUE', 'SUPERDIST_CODE_VALUE', 'HOUSE_NUMBER',
+            'MAILING_ZIP'])
 
         hist_df['combined_name'] = hist_df['ELECTION_NAME'].str.replace(
                 ' ', '_').str.lower() + '_' + hist_df['ELECTION_DATE']
@@ -2372,25 +2744,23 @@ class Preprocessor(Loader):
         # replace the empty strings with nan for cleaner db cell values
         hist_df['votetype_history'].replace('', np.nan, inplace=True)
 
-        sorted_codes = hist_df['combined_name'].unique().tolist()
-        sorted_codes.sort(key=lambda x: datetime.strptime(
-                x.split('_')[-1], "%m/%d/%Y"))
-        counts = hist_df['combined_name'].value_counts()
+        catalog = ElectionCatalog(hist_df['combined_name'], "%m/%d/%Y",
+                                  date_token=lambda x: x.split('_')[-1],
+                                  sort=False)
+        catalog.sort()
+        sorted_codes, sorted_codes_dict, index_map = self.stable_encoding(
+            *catalog.encoding())
+        hist_df['array_position'] = index_map[catalog.positions]
 
-        sorted_codes_dict = {k: {'index': i,
-                                 'count': int(counts.loc[k]),
-                                 'date': k.split('_')[-1]}
-                             for i, k in enumerate(sorted_codes)}
-
-        def insert_code_bin(arr):
-            if isinstance(arr, list):
-                return [sorted_codes_dict[k]['index'] for k in arr]
-            else:
-                return np.nan
         voters_df = voters_df.set_index('IDENTIFICATION_NUMBER', drop=False)
         voter_id_groups = hist_df.groupby('IDENTIFICATION_NUMBER')
         voters_df['all_history'] = voter_id_groups['combined_name'].apply(list)
-        voters_df['sparse_history'] = voters_df['all_history'].map(insert_code_bin)
+        voters_df['sparse_history'] = voter_id_groups['array_position'].apply(
+            list)
+        if self.history_bitmaps:
+            voters_df['history_bitmap'] = self.history_bitmap(
+                hist_df['IDENTIFICATION_NUMBER'], hist_df['array_position'],
+                len(sorted_codes))
         voters_df['election_type_history'] = voter_id_groups['ELECTION_TYPE'].apply(list)
         voters_df['party_history'] = voter_id_groups['PRIMARY_TYPE_CODE_NAME'].apply(list)
         voters_df['votetype_history'] = voter_id_groups['votetype_history'].apply(list)
@@ -2398,13 +2768,11 @@ class Preprocessor(Loader):
 
         self.meta = {
                 "message": "virginia_{}".format(datetime.now().isoformat()),
-                "array_encoding": json.dumps(sorted_codes_dict),
-                "array_decoding": json.dumps(sorted_codes),
+                "array_encoding": sorted_codes_dict,
+                "array_decoding": sorted_codes,
         }
 
-        return FileItem(name="{}.processed".format(self.config["state"]),
-                        io_obj=StringIO(voters_df.to_csv(index=False)),
-                        s3_bucket=self.s3_bucket)
+        return self.processed_file(voters_df, index=False)
 
     def preprocess_washington(self):
         new_files = [n for n in self.unpack_files(self.main_file, compression='unzip') \
@@ -2439,7 +2807,11 @@ class Preprocessor(Loader):
         all_history = voter_groups['all_history'].apply(list)
         sparse_history = voter_groups['sparse_history'].apply(list)
         county_history = voter_groups['county_history'].apply(list)
-        df_hist = pd.concat([all_history, sparse_history, county_history], axis=1)
+        history_bitmap = self.history_bitmap(
+            df_hist[self.config['voter_id']], df_hist['sparse_history'],
+            len(sorted_elections))
+        df_hist = pd.concat([all_history, sparse_history, county_history,
+                             history_bitmap], axis=1)
 
         # --- handling the voter file --- #
 
@@ -2453,24 +2825,21 @@ class Preprocessor(Loader):
         to_numeric = [df_voter.loc[:,col].str.isnumeric().all() for col in df_voter.columns]
         df_voter.loc[:,to_numeric] = df_voter.loc[:,to_numeric].fillna(-1).astype(int)
 
-        df_voter = self.config.coerce_numeric(df_voter)
-        df_voter = self.config.coerce_strings(df_voter,
+        df_voter = self.config.coerce_all(df_voter,
             exclude=[self.config['primary_locale_identifier'], self.config['voter_id']])
-        df_voter = self.config.coerce_dates(df_voter)
 
         # add voter history
         df_voter = df_voter.join(df_hist)
 
         self.meta = {
             'message': 'washington_{}'.format(datetime.now().isoformat()),
-            'array_encoding': json.dumps(sorted_elections_dict),
-            'array_decoding': json.dumps(sorted_elections)
+            'array_encoding': sorted_elections_dict,
+            'array_decoding': sorted_elections
         }
 
         self.is_compressed = False
 
-        return FileItem(name='{}.processed'.format(self.config['state']),
-                        io_obj=StringIO(df_voter.to_csv(index=True, encoding='latin-1')))
+        return self.processed_file(df_voter, index=True, encoding='latin-1')
 
     def preprocess_west_virginia(self):
         new_files = [n for n in self.unpack_files(self.main_file, compression='unzip')]
@@ -2511,8 +2880,7 @@ class Preprocessor(Loader):
 #            'array_decoding': json.dumps()
         }
 
-        return FileItem(name='{}.processed'.format(self.config['state']),
-                        io_obj=StringIO(df_voter.to_csv(index=True, encoding='latin-1')))
+        return self.processed_file(df_voter, index=True, encoding='latin-1')
 
     def preprocess_oregon(self):
         new_files = [f for f in
@@ -2528,10 +2896,7 @@ class Preprocessor(Loader):
         df_voter = (pd.read_csv(voter_file['obj'], sep='\t', dtype=str)
                     .dropna(how='all', axis=1))
 
-        df_voter = self.config.coerce_dates(df_voter)
-        df_voter = self.config.coerce_strings(df_voter,
-                                              exclude=['STATE'])
-        df_voter = self.config.coerce_numeric(df_voter)
+        df_voter = self.config.coerce_all(df_voter, exclude=['STATE'])
 
         df_voter.loc[:,self.config['voter_id']] = df_voter.loc[:,self.config['voter_id']].str.zfill(9).astype('str')
         df_voter.loc[:,'UNLISTED'] = df_voter.loc[:,'UNLISTED'].map({'yes':True, 'no':False})
@@ -2544,8 +2909,7 @@ class Preprocessor(Loader):
             # 'array_decoding': json.dumps()
         }
 
-        return FileItem(name='{}.processed'.format(self.config['state']),
-                        io_obj=StringIO(df_voter.to_csv(index=None, encoding='latin-1')))
+        return self.processed_file(df_voter, index=None, encoding='latin-1')
 
     def preprocess_oklahoma(self):
         new_files = self.unpack_files(self.main_file)
@@ -2575,7 +2939,11 @@ class Preprocessor(Loader):
         all_history = (voter_groups['all_history'].apply(list))
         sparse_history = (voter_groups['sparse_history'].apply(list))
         votetype_history = (voter_groups['VotingMethod'].apply(list).rename('votetype_history'))
-        df_hist = pd.concat([all_history, sparse_history, votetype_history], axis=1)
+        history_bitmap = self.history_bitmap(
+            df_hist[self.config['voter_id']], df_hist['sparse_history'],
+            len(sorted_elections))
+        df_hist = pd.concat([all_history, sparse_history, votetype_history,
+                             history_bitmap], axis=1)
 
         # --- handling the voter file --- #
 
@@ -2588,9 +2956,8 @@ class Preprocessor(Loader):
 
         df_voter = pd.concat(dfs, ignore_index=True)
 
-        df_voter = self.config.coerce_dates(df_voter)
-        df_voter = self.config.coerce_strings(df_voter, exclude=[self.config['voter_id']])
-        df_voter = self.config.coerce_numeric(df_voter)
+        df_voter = self.config.coerce_all(df_voter,
+            exclude=[self.config['voter_id']])
         df_voter = df_voter.loc[:, ~df_voter.columns.str.contains('Hist\w+\d')]
         df_voter = df_voter.set_index(self.config['voter_id'])
 
@@ -2598,12 +2965,11 @@ class Preprocessor(Loader):
 
         self.meta = {
             'message': 'oklahoma_{}'.format(datetime.now().isoformat()),
-            'array_encoding': json.dumps(sorted_elections_dict),
-            'array_decoding': json.dumps(sorted_elections)
+            'array_encoding': sorted_elections_dict,
+            'array_decoding': sorted_elections
             }
 
-        return FileItem(name='{}.processed'.format(self.config['state']),
-                        io_obj=StringIO(df_voter.to_csv(index=True, encoding='latin-1')))
+        return self.processed_file(df_voter, index=True, encoding='latin-1')
 
     def preprocess_arkansas(self):
         new_files = self.unpack_files(self.main_file)
@@ -2649,26 +3015,27 @@ class Preprocessor(Loader):
             int(sorted_elections_dict[x]['index']))
 
         group = df_hist.groupby(self.config['voter_id'])
-        df_hist = pd.concat([group[col].apply(list) for col in df_hist.columns[1:]], axis=1)
+        history_bitmap = self.history_bitmap(
+            df_hist[self.config['voter_id']], df_hist['sparse_history'],
+            len(sorted_elections))
+        df_hist = pd.concat([group[col].apply(list) for col in df_hist.columns[1:]] +
+                            [history_bitmap], axis=1)
 
         # --- handling the voter file --- #
         df_voter = pd.read_csv(voter_file['obj'], dtype=str)
 
-        df_voter = self.config.coerce_dates(df_voter)
-        df_voter = self.config.coerce_numeric(df_voter)
-        df_voter = self.config.coerce_strings(df_voter,
-                                              exclude=[self.config['voter_id']])
+        df_voter = self.config.coerce_all(df_voter,
+            exclude=[self.config['voter_id']])
 
         df_voter = df_voter.set_index(self.config['voter_id']).join(df_hist)
 
         self.meta = {
             'message': 'arkansas_{}'.format(datetime.now().isoformat()),
-            'array_encoding': json.dumps(sorted_elections_dict),
-            'array_decoding': json.dumps(sorted_elections)
+            'array_encoding': sorted_elections_dict,
+            'array_decoding': sorted_elections
         }
 
-        return FileItem(name='{}.processed'.format(self.config['state']),
-                        io_obj=StringIO(df_voter.to_csv(index=True, encoding='latin-1')))
+        return self.processed_file(df_voter, index=True, encoding='latin-1')
 
     def preprocess_wyoming(self):
         new_files = self.unpack_files(self.main_file, compression='unzip')
@@ -2743,19 +3110,20 @@ class Preprocessor(Loader):
         precinct_history = (voter_groups['precinct'].apply(list)
             .rename('precinct_history'))
 
+        history_bitmap = self.history_bitmap(
+            df_hist[self.config['voter_id']], df_hist['sparse_history'],
+            len(sorted_elections))
         df_hist = pd.concat(
             [all_history, sparse_history, votetype_history,
-             party_history, precinct_history], axis=1)
+             party_history, precinct_history, history_bitmap], axis=1)
 
         # --- handling voter file --- #
 
         df_voter = pd.read_csv(voter_file['obj'], dtype=str)
 
-        df_voter = self.config.coerce_strings(df_voter,
-            exclude=[self.config['voter_id']])
-        df_voter = self.config.coerce_numeric(df_voter,
-            extra_cols=['Zip (RA)', 'Split', 'Precinct', 'ZIP (MA)', 'House', 'Senate'])
-        df_voter = self.config.coerce_dates(df_voter)
+        df_voter = self.config.coerce_all(df_voter,
+            exclude=[self.config['voter_id']],
+            numeric_extra_cols=['Zip (RA)', 'Split', 'Precinct', 'ZIP (MA)', 'House', 'Senate'])
 
         df_voter.loc[:,self.config['voter_id']] = df_voter.loc[:,self.config['voter_id']].str.zfill(9).astype(str)
         df_voter = df_voter.set_index(self.config['voter_id'])
@@ -2764,14 +3132,13 @@ class Preprocessor(Loader):
 
         self.meta = {
             'message': 'wyoming_{}'.format(datetime.now().isoformat()),
-            'array_encoding': json.dumps(sorted_elections_dict),
-            'array_decoding': json.dumps(sorted_elections)
+            'array_encoding': sorted_elections_dict,
+            'array_decoding': sorted_elections
         }
 
         self.is_compressed = False
 
-        return FileItem(name='{}.processed'.format(self.config['state']),
-                        io_obj=StringIO(df_voter.to_csv(index=True, encoding='latin-1')))
+        return self.processed_file(df_voter, index=True, encoding='latin-1')
 
     def preprocess_rhode_island(self):
         new_files = self.unpack_files(self.main_file, compression='unzip')
@@ -2821,15 +3188,17 @@ class Preprocessor(Loader):
             lambda x: int(sorted_elections_dict[x]['index']))
 
         df_group = election_df.sort_values('date', ascending=True).groupby(self.config['voter_id'])
-        df_hist = pd.concat([df_group[c].apply(list) for c in election_df.columns if 'history' in c], axis=1)
+        history_bitmap = self.history_bitmap(
+            election_df[self.config['voter_id']], election_df['sparse_history'],
+            len(sorted_elections))
+        df_hist = pd.concat([df_group[c].apply(list) for c in election_df.columns if 'history' in c] +
+                            [history_bitmap], axis=1)
 
         # --- handling vote file --- #
 
         df_voter = pd.read_csv(voter_file['obj'], sep='|', skiprows=1, dtype=str)
-        df_voter = self.config.coerce_strings(df_voter,
+        df_voter = self.config.coerce_all(df_voter,
             exclude=[self.config['voter_id']])
-        df_voter = self.config.coerce_numeric(df_voter)
-        df_voter = self.config.coerce_dates(df_voter)
 
         df_voter.loc[:, 'ZIP CODE'] = df_voter.loc[:, 'ZIP CODE'].astype(str).str.zfill(5).fillna('-')
         df_voter.loc[:, 'ZIP4 CODE'] = df_voter.loc[:, 'ZIP4 CODE'].fillna('0').astype(int).astype(str)
@@ -2838,12 +3207,11 @@ class Preprocessor(Loader):
 
         self.meta = {
             'message': 'rhode_island_{}'.format(datetime.now().isoformat()),
-            'array_encoding': json.dumps(sorted_elections_dict),
-            'array_decoding': json.dumps(sorted_elections)
+            'array_encoding': sorted_elections_dict,
+            'array_decoding': sorted_elections
         }
 
-        return FileItem(name='{}.processed'.format(self.config['state']),
-                        io_obj=StringIO(df_voter.to_csv(index=True, encoding='latin-1')))
+        return self.processed_file(df_voter, index=True, encoding='latin-1')
 
     def preprocess_south_dakota(self):
         new_files = self.unpack_files(self.main_file, compression='unzip')
@@ -2870,29 +3238,29 @@ class Preprocessor(Loader):
             lambda x: sorted_elections_dict[x]['index'])
 
         voter_groups = df_hist.groupby(self.config['voter_id'])
+        history_bitmap = self.history_bitmap(
+            df_hist[self.config['voter_id']], df_hist['sparse_history'],
+            len(sorted_elections))
         df_hist = pd.concat(
             [voter_groups[c].apply(list) for c in
              ['all_history', 'sparse_history', 'votetype_history']
-             ], axis=1)
+             ] + [history_bitmap], axis=1)
 
         # --- handling voter file --- #
 
         df_voter = pd.read_csv(voter_file['obj'], skiprows=2, dtype=str)
-        df_voter = self.config.coerce_strings(df_voter,
+        df_voter = self.config.coerce_all(df_voter,
             exclude=[self.config['voter_id']])
-        df_voter = self.config.coerce_numeric(df_voter)
-        df_voter = self.config.coerce_dates(df_voter)
 
         df_voter = df_voter.set_index(self.config['voter_id']).join(df_hist)
 
         self.meta = {
             'message': 'south_dakota_{}'.format(datetime.now().isoformat()),
-            'array_encoding': json.dumps(sorted_elections_dict),
-            'array_decoding': json.dumps(sorted_elections)
+            'array_encoding': sorted_elections_dict,
+            'array_decoding': sorted_elections
         }
 
-        return FileItem(name='{}.processed'.format(self.config['state']),
-                        io_obj=StringIO(df_voter.to_csv(index=True, encoding='latin-1')))
+        return self.processed_file(df_voter, index=True, encoding='latin-1')
 
     def preprocess_montana(self):
         new_files = self.unpack_files(self.main_file, compression='unzip')
@@ -2957,26 +3325,26 @@ class Preprocessor(Loader):
         for col in df_hist.columns[1:]:
             group = df_group[col].apply(list)
             groups.append(group)
+        groups.append(self.history_bitmap(
+            df_hist[self.config['voter_id']], df_hist['sparse_history'],
+            len(sorted_elections)))
 
         df_hist = pd.concat(groups, axis=1)
 
         # --- handling voter file --- #
 
         df_voter = pd.read_csv(voter_file['obj'], sep='\t', index_col=False)
-        df_voter = self.config.coerce_strings(df_voter)
-        df_voter = self.config.coerce_numeric(df_voter)
-        df_voter = self.config.coerce_dates(df_voter)
+        df_voter = self.config.coerce_all(df_voter)
 
         df_voter = df_voter.set_index(self.config['voter_id']).join(df_hist)
 
         self.meta = {
             'message': 'montana_{}'.format(datetime.now().isoformat()),
-            'array_encoding': json.dumps(sorted_elections_dict),
-            'array_decoding': json.dumps(sorted_elections)
+            'array_encoding': sorted_elections_dict,
+            'array_decoding': sorted_elections
         }
 
-        return FileItem(name='{}.processed'.format(self.config['state']),
-                        io_obj=StringIO(df_voter.to_csv(index=True, encoding='latin-1')))
+        return self.processed_file(df_voter, index=True, encoding='latin-1')
 
     def preprocess_alaska(self):
         new_files = self.unpack_files(self.main_file, compression='unzip')
@@ -3009,30 +3377,31 @@ class Preprocessor(Loader):
 
         df_hist.loc[:, 'sparse_history'] = df_hist.all_history.map(lambda x: sorted_elections_dict[x]['index'])
 
+        history_bitmap = self.history_bitmap(
+            df_hist[self.config['voter_id']], df_hist['sparse_history'],
+            len(sorted_elections))
         df_hist = pd.concat([df_hist.groupby(self.config['voter_id'])[c].apply(list)
                              for c in ['all_history',
                                        'votetype_history',
-                                       'sparse_history']], axis=1)
+                                       'sparse_history']] + [history_bitmap],
+                            axis=1)
 
         # --- handling the voter file --- #
 
         df_voter = df_voter.loc[:, ~df_voter.columns.isin(self.config['election_columns'])]
         df_voter = df_voter.set_index(self.config['voter_id'])
 
-        df_voter = self.config.coerce_strings(df_voter)
-        df_voter = self.config.coerce_numeric(df_voter)
-        df_voter = self.config.coerce_dates(df_voter)
+        df_voter = self.config.coerce_all(df_voter)
 
         df_voter = df_voter.join(df_hist)
 
         self.meta = {
             'message': 'alaska_{}'.format(datetime.now().isoformat()),
-            'array_encoding': json.dumps(sorted_elections_dict),
-            'array_decoding': json.dumps(sorted_elections)
+            'array_encoding': sorted_elections_dict,
+            'array_decoding': sorted_elections
         }
 
-        return FileItem(name='{}.processed'.format(self.config['state']),
-                        io_obj=StringIO(df_voter.to_csv(index=True, encoding='latin-1')))
+        return self.processed_file(df_voter, index=True, encoding='latin-1')
 
     def preprocess_connecticut(self):
         new_files = self.unpack_files(self.main_file, compression='unzip')
@@ -3103,6 +3472,9 @@ class Preprocessor(Loader):
 
         for c in df_hist.columns[1:]:
             election_df.append(group[c].apply(list))
+        election_df.append(self.history_bitmap(
+            df_hist[self.config['voter_id']], df_hist['sparse_history'],
+            len(sorted_elections)))
 
         df_hist = pd.concat(election_df, axis=1)
 
@@ -3111,19 +3483,16 @@ class Preprocessor(Loader):
         df_voter = df_voter.loc[:, ~df_voter.columns.isin(election_columns)]
         df_voter = df_voter.set_index(self.config['voter_id'])
 
-        df_voter = self.config.coerce_strings(df_voter)
-        df_voter = self.config.coerce_numeric(df_voter)
-        df_voter = self.config.coerce_dates(df_voter)
+        df_voter = self.config.coerce_all(df_voter)
         df_voter = df_voter.join(df_hist)
 
         self.meta = {
             'message': 'connecticut_{}'.format(datetime.now().isoformat()),
-            'array_encoding': json.dumps(sorted_elections_dict),
-            'array_decoding': json.dumps(sorted_elections)
+            'array_encoding': sorted_elections_dict,
+            'array_decoding': sorted_elections
         }
 
-        return FileItem(name='{}.processed'.format(self.config['state']),
-                        io_obj=StringIO(df_voter.to_csv(index=True, encoding='latin-1')))
+        return self.processed_file(df_voter, index=True, encoding='latin-1')
 
     def preprocess_vermont(self):
         new_files = self.unpack_files(self.main_file, compression='unzip')
@@ -3162,26 +3531,27 @@ class Preprocessor(Loader):
                                             .apply(lambda x: sorted_elections_dict[x]['index']))
 
         group = df_hist.groupby(self.config['voter_id'])
+        history_bitmap = self.history_bitmap(
+            df_hist[self.config['voter_id']], df_hist['sparse_history'],
+            len(sorted_elections))
         df_hist = pd.concat(
-            [group[col].apply(list) for col in df_hist.columns[1:]],
+            [group[col].apply(list) for col in df_hist.columns[1:]] +
+            [history_bitmap],
             axis=1)
 
         df_voter = df_voter.loc[:, ~df_voter.columns.isin(self.config['election_columns'])]
         df_voter = df_voter.set_index(self.config['voter_id'])
 
-        df_voter = self.config.coerce_strings(df_voter)
-        df_voter = self.config.coerce_numeric(df_voter)
-        df_voter = self.config.coerce_dates(df_voter)
+        df_voter = self.config.coerce_all(df_voter)
         df_voter = df_voter.join(df_hist)
 
         self.meta = {
             'message': 'vermont_{}'.format(datetime.now().isoformat()),
-            'array_encoding': json.dumps(sorted_elections_dict),
-            'array_decoding': json.dumps(sorted_elections)
+            'array_encoding': sorted_elections_dict,
+            'array_decoding': sorted_elections
         }
 
-        return FileItem(name='{}.processed'.format(self.config['state']),
-                        io_obj=StringIO(df_voter.to_csv(index=True, encoding='latin-1')))
+        return self.processed_file(df_voter, index=True, encoding='latin-1')
 
     def preprocess_delaware(self):
         new_files = self.unpack_files(self.main_file, compression='unzip')
@@ -3219,27 +3589,28 @@ class Preprocessor(Loader):
                                             .apply(lambda x: sorted_elections_dict[x]['index']))
 
         group = df_hist.groupby(self.config['voter_id'])
-        df_hist = pd.concat([group[c].apply(list) for c in ['all_history', 'sparse_history']], axis=1)
+        history_bitmap = self.history_bitmap(
+            df_hist[self.config['voter_id']], df_hist['sparse_history'],
+            len(sorted_elections))
+        df_hist = pd.concat([group[c].apply(list) for c in ['all_history', 'sparse_history']] +
+                            [history_bitmap], axis=1)
 
         # --- handling voter file  --- #
 
         df_voter = (df_voter
                     .loc[:, ~df_voter.columns.isin(self.config['election_columns'])]
                     .set_index(self.config['voter_id']))
-        df_voter = self.config.coerce_strings(df_voter)
-        df_voter = self.config.coerce_numeric(df_voter)
-        df_voter = self.config.coerce_dates(df_voter)
+        df_voter = self.config.coerce_all(df_voter)
 
         df_voter = df_voter.join(df_hist)
 
         self.meta = {
             'message': 'delaware_{}'.format(datetime.now().isoformat()),
-            'array_encoding': json.dumps(sorted_elections_dict),
-            'array_decoding': json.dumps(sorted_elections)
+            'array_encoding': sorted_elections_dict,
+            'array_decoding': sorted_elections
         }
 
-        return FileItem(name='{}.processed'.format(self.config['state']),
-                        io_obj=StringIO(df_voter.to_csv(index=True, encoding='latin-1')))
+        return self.processed_file(df_voter, index=True, encoding='latin-1')
 
     def preprocess_maryland(self):
         new_files = self.unpack_files(self.main_file, compression='unzip')
@@ -3296,26 +3667,27 @@ class Preprocessor(Loader):
         df_hist = (df_hist.loc[:, ['Voter ID'] + history]
                    .rename({'Voter ID': self.config['voter_id']}, axis=1))
         group = df_hist.groupby(self.config['voter_id'])
-        df_hist = pd.concat([group[c].apply(list) for c in df_hist.columns[1:]], axis=1)
+        history_bitmap = self.history_bitmap(
+            df_hist[self.config['voter_id']], df_hist['sparse_history'],
+            len(sorted_elections))
+        df_hist = pd.concat([group[c].apply(list) for c in df_hist.columns[1:]] +
+                            [history_bitmap], axis=1)
 
         # --- handling voter file --- #
         df_voter = (pd.read_csv(voter_file['obj'], sep='\t', dtype=str)
                     .iloc[:, :len(self.config['column_names'])]
                     .set_index(self.config['voter_id']))
-        df_voter = self.config.coerce_strings(df_voter)
-        df_voter = self.config.coerce_numeric(df_voter)
-        df_voter = self.config.coerce_dates(df_voter)
+        df_voter = self.config.coerce_all(df_voter)
 
         df_voter = df_voter.join(df_hist)
 
         self.meta = {
             'message': 'maryland_{}'.format(datetime.now().isoformat()),
-            'array_encoding': json.dumps(sorted_elections_dict),
-            'array_decoding': json.dumps(sorted_elections)
+            'array_encoding': sorted_elections_dict,
+            'array_decoding': sorted_elections
         }
 
-        return FileItem(name='{}.processed'.format(self.config['state']),
-                        io_obj=StringIO(df_voter.to_csv(index=True, encoding='latin-1')))
+        return self.processed_file(df_voter, index=True, encoding='latin-1')
 
     def preprocess_dc(self):
         new_files = self.unpack_files(self.main_file, compression='unzip')
@@ -3370,30 +3742,34 @@ class Preprocessor(Loader):
                                             .all_history
                                             .apply(lambda x:
                                                 sorted_elections_dict[x]['index']))
+        history_bitmap = self.history_bitmap(
+            df_hist['index'], df_hist['sparse_history'],
+            len(sorted_elections))
         df_hist = pd.concat(
             [df_hist.groupby('index')[c].apply(list) for c in
-             ['all_history', 'votetype_history', 'sparse_history']],
+             ['all_history', 'votetype_history', 'sparse_history']] +
+            [history_bitmap],
             axis=1)
 
         # --- handling voter file --- #
         df_voter = (df_voter
                     .loc[:, ~df_voter.columns.isin(self.config['election_columns'])])
-        df_voter = self.config.coerce_strings(df_voter)
-        df_voter = self.config.coerce_numeric(df_voter)
-        df_voter = self.config.coerce_dates(df_voter)
+        df_voter = self.config.coerce_all(df_voter)
         df_voter = df_voter.join(df_hist).rename_axis('temp_id')
 
         self.meta = {
             'message': 'dc_{}'.format(datetime.now().isoformat()),
-            'array_encoding': json.dumps(sorted_elections_dict),
-            'array_decoding': json.dumps(sorted_elections)
+            'array_encoding': sorted_elections_dict,
+            'array_decoding': sorted_elections
         }
 
-        return FileItem(name='{}.processed'.format(self.config['state']),
-                        io_obj=StringIO(df_voter.to_csv(index=True, encoding='latin-1')))
+        return self.processed_file(df_voter, index=True, encoding='latin-1')
 
     def execute(self):
-        return self.state_router()
+        file_item = self.state_router()
+        if self.persist_date_memo:
+            date_memo.save()
+        return file_item
 
     def state_router(self):
         routes = {
@@ -0,0 +1,460 @@
+import json
+import logging
+import numpy as np
+import pandas as pd
+
+from reggie.ingestion.utils import get_metadata_for_key, \
+    load_local_store, save_local_store, SnapshotIndex
+
+
+ELECTION_DATES_STORE = "election_dates.json"
+# (bucket or "local", with "_testing" for testing runs), state
+ELECTION_REGISTRY_STORE = "election_registry_{}_{}.json"
+
+# (date_format, date string) -> ISO date, shared by every catalog in the
+# process and persisted between runs, since the same elections show up in
+# every snapshot of a state
+election_date_cache = None
+
+
+def parse_election_dates(tokens, date_format):
+    """
+    Parse election date strings, only running pd.to_datetime on strings that
+    have not been seen before (in this process or in a previous run).
+    :param tokens: list of date strings
+    :param date_format: strptime format of the date strings
+    :return: list of ISO dates ("YYYY-MM-DD"), None where a date did not parse
+    """
+    global election_date_cache
+    if election_date_cache is None:
+        election_date_cache = load_local_store(ELECTION_DATES_STORE, {})
+    memo = election_date_cache.setdefault(date_format, {})
+
+    new_tokens = pd.unique(np.array([t for t in tokens if t not in memo],
+                                    dtype=object))
+    if len(new_tokens) > 0:
+        parsed = pd.to_datetime(pd.Series(new_tokens), format=date_format,
+                                errors='coerce')
+        iso = parsed.dt.strftime('%Y-%m-%d')
+        for t, d in zip(new_tokens, iso):
+            memo[t] = d if isinstance(d, str) else None
+        save_local_store(ELECTION_DATES_STORE, election_date_cache)
+    return [memo[t] for t in tokens]
+
+
+class ElectionCatalog(object):
+    """
+    The distinct election codes of a voter history column, with their counts
+    and the date embedded in each code parsed once.
+
+    The catalog holds one integer code per history row (`positions`), which
+    is the index of that row's election in `codes`, so sorting the catalog
+    chronologically also gives every row its array position.
+    """
+
+    def __init__(self, election_codes, date_format, date_token=None,
+                 sort=True, default_date=None):
+        """
+        :param election_codes: pandas Series of election codes, one per
+        history row
+        :param date_format: strptime format of the date in each code
+        :param date_token: function returning the date part of a code
+        (default: the whole code is the date)
+        :param sort: order codes as np.unique does, rather than in order of
+        appearance
+        :param default_date: ISO date used for codes whose date does not
+        parse; if None a ValueError is raised instead
+        """
+        positions, uniques = pd.factorize(election_codes, sort=sort)
+        if (positions < 0).any():
+            raise ValueError("election codes must not contain null values")
+        self.positions = positions
+        self.codes = np.asarray(uniques, dtype=object)
+        self.counts = np.bincount(positions, minlength=len(self.codes))
+        if date_token is None:
+            self.tokens = list(self.codes)
+        else:
+            self.tokens = [date_token(c) for c in self.codes]
+
+        iso_dates = parse_election_dates(self.tokens, date_format)
+        missing = [c for c, d in zip(self.codes, iso_dates) if d is None]
+        if len(missing) > 0:
+            if default_date is None:
+                raise ValueError("could not parse the date of election codes "
+                                 "{} with format {}".format(missing[:10],
+                                                            date_format))
+            iso_dates = [default_date if d is None else d for d in iso_dates]
+        self.dates = pd.to_datetime(pd.Index(iso_dates), format='%Y-%m-%d')
+
+    def __len__(self):
+        return len(self.codes)
+
+    def argsort(self, reverse=False):
+        """
+        Chronological order of the codes. The sort is stable, so codes
+        sharing a date keep their current relative order (as with sorted()).
+        :param reverse: newest first
+        :return: array of indices into codes
+        """
+        ns = self.dates.asi8
+        return np.argsort(-ns if reverse else ns, kind='stable')
+
+    def sort(self, reverse=False):
+        """
+        Reorder the catalog chronologically and renumber the row positions
+        :param reverse: newest first
+        :return: self
+        """
+        order = self.argsort(reverse=reverse)
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        self.positions = rank[self.positions]
+        self.codes = self.codes[order]
+        self.counts = self.counts[order]
+        self.tokens = [self.tokens[i] for i in order]
+        self.dates = self.dates[order]
+        return self
+
+    def iso_dates(self):
+        return list(self.dates.strftime('%Y-%m-%d'))
+
+    def encoding(self, dates=None):
+        """
+        Build the array_decoding list and array_encoding dictionary stored in
+        a state's meta data
+        :param dates: value of the "date" field for each code (default: the
+        date part of the code, as it appears in the code)
+        :return: (sorted_codes, sorted_codes_dict)
+        """
+        dates = self.tokens if dates is None else dates
+        sorted_codes = self.codes.tolist()
+        sorted_codes_dict = {k: {"index": i, "count": int(self.counts[i]),
+                                 "date": dates[i]}
+                             for i, k in enumerate(sorted_codes)}
+        return sorted_codes, sorted_codes_dict
+
+
+def is_empty_code(code):
+    """
+    :return: True for a missing or blank election code
+    """
+    if isinstance(code, str):
+        return code.strip() == ""
+    return code is None or code != code
+
+
+class ElectionRegistry(object):
+    """
+    All election codes seen for a state, in the order they were first seen.
+    A code keeps its index for good and new codes are only ever appended, so
+    sparse_history arrays from different snapshots can be compared directly.
+
+    With a bucket, s3 is the source of truth: a snapshot's registry is the
+    array_decoding of the closest earlier processed snapshot, and the local
+    store only caches that, keyed by the snapshot's key and etag. Without
+    one the registry lives in the local store. Either way the store is kept
+    per bucket and testing prefix.
+    """
+
+    def __init__(self, state, codes=None, dates=None, store_name=None,
+                 source=None):
+        """
+        :param state: state name
+        :param codes: registered codes, in index order
+        :param dates: code -> date
+        :param store_name: local store file of the registry
+        :param source: [key, etag] of the s3 snapshot it was seeded from
+        """
+        self.state = state
+        self.codes = list(codes) if codes is not None else []
+        self.dates = dict(dates) if dates is not None else {}
+        self.index = {k: i for i, k in enumerate(self.codes)}
+        self.store_name = store_name or self.local_store_name(state)
+        self.source = source
+
+    @classmethod
+    def local_store_name(cls, state, s3_bucket=None, testing=False):
+        scope = s3_bucket or "local"
+        if testing:
+            scope += "_testing"
+        return ELECTION_REGISTRY_STORE.format(scope, state)
+
+    @classmethod
+    def from_meta(cls, state, meta, **kwargs):
+        """
+        Seed a registry from the meta data of a processed snapshot
+        :param state: state name
+        :param meta: meta dictionary, as returned by get_metadata_for_key
+        :param kwargs: further ElectionRegistry arguments
+        :return: ElectionRegistry
+        """
+        encoding = meta.get("array_encoding", {})
+        decoding = meta.get("array_decoding", [])
+        if isinstance(encoding, str):
+            encoding = json.loads(encoding)
+        if isinstance(decoding, str):
+            decoding = json.loads(decoding)
+        if not decoding:
+            decoding = sorted(encoding, key=lambda k: encoding[k]["index"])
+        dates = {k: v["date"] for k, v in encoding.items()
+                 if v.get("date") is not None}
+        return cls(state, decoding, dates, **kwargs)
+
+    @classmethod
+    def load(cls, state, snapshot_date=None, s3_bucket=None, testing=False):
+        """
+        The registry a snapshot is encoded with: with a bucket, that of the
+        closest earlier processed snapshot on s3 (empty if there is none);
+        otherwise the one in the local store
+        :param state: state name
+        :param snapshot_date: date of the snapshot being processed
+        :param s3_bucket: bucket holding processed snapshots
+        :param testing: look up snapshots under the testing prefix
+        :return: ElectionRegistry (empty if nothing was found)
+        """
+        store_name = cls.local_store_name(state, s3_bucket, testing)
+        stored = load_local_store(store_name)
+        if not s3_bucket or snapshot_date is None:
+            if stored is not None:
+                return cls(state, stored["codes"], stored["dates"],
+                           store_name=store_name)
+            return cls(state, store_name=store_name)
+
+        # always listed, so every worker seeds from the same snapshot
+        index = SnapshotIndex.for_state(state, s3_bucket, testing=testing,
+                                        date=snapshot_date, max_age=0)
+        _, _, pre_key, _ = index.surrounding(snapshot_date)
+        if pre_key is None:
+            return cls(state, store_name=store_name)
+        source = [pre_key, index.etag(pre_key)]
+        if stored is not None and stored.get("source") == source:
+            return cls(state, stored["codes"], stored["dates"],
+                       store_name=store_name, source=source)
+        logging.info("seeding {} election registry from {}".format(
+            state, pre_key))
+        registry = cls.from_meta(
+            state, get_metadata_for_key(pre_key, s3_bucket),
+            store_name=store_name, source=source)
+        save_local_store(store_name, {"codes": registry.codes,
+                                      "dates": registry.dates,
+                                      "source": source})
+        return registry
+
+    def save(self):
+        """
+        Keep the registry in the local store. A registry seeded from s3 is
+        not: its new codes reach s3 with the snapshot's meta, and the store
+        only caches what was seeded.
+        """
+        if self.source is not None:
+            return
+        save_local_store(self.store_name,
+                         {"codes": self.codes, "dates": self.dates})
+
+    def register(self, codes, dates=None):
+        """
+        Append any codes not yet in the registry
+        :param codes: election codes of a snapshot
+        :param dates: optional date for each code
+        :return: array holding the registry index of each code, -1 for
+        empty codes (e.g. Iowa's empty election slots), which are not
+        registered
+        """
+        for i, k in enumerate(codes):
+            if k not in self.index:
+                if is_empty_code(k):
+                    continue
+                self.index[k] = len(self.codes)
+                self.codes.append(k)
+            if dates is not None and dates[i] is not None:
+                self.dates[k] = str(dates[i])
+        return np.array([self.index.get(k, -1) for k in codes],
+                        dtype=np.int64)
+
+    def encoding(self, sorted_codes, sorted_codes_dict):
+        """
+        Renumber a snapshot's array encoding with the registry indices
+        :param sorted_codes: snapshot array_decoding
+        :param sorted_codes_dict: snapshot array_encoding
+        :return: (registry array_decoding, registry array_encoding, array
+        mapping each snapshot index to its registry index)
+        """
+        index_map = self.register(
+            sorted_codes, [sorted_codes_dict[k].get("date")
+                           for k in sorted_codes])
+        encoding = {}
+        for i, k in enumerate(self.codes):
+            if k in sorted_codes_dict:
+                entry = dict(sorted_codes_dict[k])
+            else:
+                entry = {"count": 0}
+                if k in self.dates:
+                    entry["date"] = self.dates[k]
+            entry["index"] = i
+            encoding[k] = entry
+        return list(self.codes), encoding, index_map
+
+
+def pack_history(voter_ids, positions, n_codes):
+    """
+    Bit-pack voter histories: one np.packbits style row per voter with bit i
+    set if the voter participated in election i of array_decoding. Rows are
+    stored as fixed width hex strings so they fit in any output format.
+    :param voter_ids: voter id of each history row
+    :param positions: array position (sparse_history value) of each row
+    :param n_codes: number of election codes in array_decoding
+    :return: Series of hex strings indexed by voter id
+    """
+    rows, voters = pd.factorize(np.asarray(voter_ids))
+    positions = np.asarray(positions, dtype=np.int64)
+    keep = rows >= 0
+    rows, positions = rows[keep], positions[keep]
+
+    width = max((n_codes + 7) // 8, 1)
+    bitmap = np.zeros((len(voters), width), dtype=np.uint8)
+    np.bitwise_or.at(bitmap, (rows, positions >> 3),
+                     (0x80 >> (positions & 7)).astype(np.uint8))
+    hex_rows = np.frombuffer(bitmap.tobytes().hex().encode('ascii'),
+                             dtype='S{}'.format(2 * width))
+    return pd.Series(hex_rows.astype(str), index=voters,
+                     name="history_bitmap")
+
+
+def unpack_history(bitmaps):
+    """
+    Turn a column of hex history bitmaps back into a (voters x bytes) uint8
+    matrix; voters without a bitmap (no history) get all zero rows
+    :param bitmaps: Series or list of hex strings
+    :return: numpy uint8 array
+    """
+    bitmaps = pd.Series(bitmaps)
+    known = bitmaps[bitmaps.notna()]
+    width = len(known.iloc[0]) // 2 if len(known) > 0 else 1
+    packed = bitmaps.fillna("00" * width).str.cat()
+    return np.frombuffer(bytes.fromhex(packed), dtype=np.uint8).reshape(
+        len(bitmaps), width)
+
+
+def voted_in(bitmap, index):
+    """
+    :param bitmap: matrix from unpack_history
+    :param index: array_decoding index of an election
+    :return: boolean array, True for every voter who voted in the election
+    """
+    return (bitmap[:, index >> 3] & (0x80 >> (index & 7))) != 0
+
+
+def election_turnout(bitmap, n_codes):
+    """
+    :param bitmap: matrix from unpack_history
+    :param n_codes: number of election codes in array_decoding
+    :return: number of voters who voted in each election
+    """
+    counts = np.zeros(bitmap.shape[1] * 8, dtype=np.int64)
+    for bit in range(8):
+        counts[bit::8] = ((bitmap >> (7 - bit)) & 1).sum(axis=0)
+    return counts[:n_codes]
+
+
+ELECTION_CODE_TABLE_STORE = "election_codes_{}.json"
+ELECTION_CODE_TABLE_FORMAT = 1
+
+
+class ElectionCodeTable(object):
+    """
+    Lookup table from a state's numeric election codes to the election date
+    and slug used in all_history (currently only Michigan ships its history
+    this way). The table is kept in the local store and versioned: `version`
+    goes up every time a snapshot adds or changes codes, and `snapshot` is
+    the date of the snapshot that last did so.
+    """
+
+    def __init__(self, state, codes=None, version=0, snapshot=None):
+        self.state = state
+        self.codes = dict(codes) if codes is not None else {}
+        self.version = version
+        self.snapshot = snapshot
+
+    @classmethod
+    def load(cls, state):
+        """
+        :param state: state name
+        :return: the stored table, or an empty one if there is none (or it
+        was written in an older format)
+        """
+        stored = load_local_store(ELECTION_CODE_TABLE_STORE.format(state))
+        if stored is None or \
+                stored.get("format") != ELECTION_CODE_TABLE_FORMAT:
+            return cls(state)
+        return cls(state, stored["codes"], stored["version"],
+                   stored.get("snapshot"))
+
+    @classmethod
+    def from_frame(cls, state, edf, code_col="Election_Code",
+                   date_col="Date", title_col="Title"):
+        """
+        Build a table from an election code file
+        :param state: state name
+        :param edf: DataFrame with one row per election code, date_col
+        holding datetimes
+        :return: ElectionCodeTable
+        """
+        codes = edf[code_col].astype(str)
+        dates = edf[date_col].dt.strftime('%Y-%m-%d')
+        titles = edf[title_col].astype(str).str.replace(
+            ' ', '-', regex=False).str.replace('_', '-', regex=False)
+        slugs = dates + '_' + codes + '_' + titles
+        return cls(state, {k: {'Date': d, 'Slug': s}
+                           for k, d, s in zip(codes, dates, slugs)})
+
+    def __len__(self):
+        return len(self.codes)
+
+    def missing(self, election_codes):
+        """
+        :param election_codes: iterable of codes
+        :return: the distinct codes that are not in the table
+        """
+        return [k for k in pd.unique(pd.Series(election_codes, dtype=object)
+                                     .astype(str))
+                if k not in self.codes]
+
+    def update(self, codes, snapshot=None):
+        """
+        Merge in codes (e.g. from a code file or a snapshot's meta data),
+        bumping the version if anything changed
+        :param codes: {code: {'Date': ..., 'Slug': ...}}
+        :param snapshot: date of the snapshot the codes came from
+        :return: True if the table changed
+        """
+        changed = {str(k): v for k, v in codes.items()
+                   if self.codes.get(str(k)) != v}
+        if not changed:
+            return False
+        self.codes.update(changed)
+        self.version += 1
+        self.snapshot = str(snapshot) if snapshot is not None \
+            else self.snapshot
+        return True
+
+    def save(self):
+        save_local_store(ELECTION_CODE_TABLE_STORE.format(self.state),
+                         {"format": ELECTION_CODE_TABLE_FORMAT,
+                          "version": self.version,
+                          "snapshot": self.snapshot,
+                          "codes": self.codes})
+
+    def resolve(self, election_codes):
+        """
+        Translate a history column of election codes to slugs. The distinct
+        codes are looked up once and the result is broadcast back to the
+        rows; codes that are not in the table are kept as they are.
+        :param election_codes: pandas Series of codes
+        :return: Series of slugs aligned with election_codes
+        """
+        positions, uniques = pd.factorize(election_codes.astype(str))
+        uniques = pd.Series(uniques, dtype=object)
+        slugs = pd.Series({k: v['Slug'] for k, v in self.codes.items()},
+                          dtype=object)
+        resolved = uniques.map(slugs).fillna(uniques).values
+        return pd.Series(resolved[positions], index=election_codes.index)
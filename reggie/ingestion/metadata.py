@@ -0,0 +1,178 @@
+"""
+The meta data sidecar written next to each processed file.
+
+Format 2 is encoded once: every field is plain json, and the election
+codes (array_encoding/array_decoding) are stored as columns,
+    "elections": {"codes": [...], "counts": [...], "dates": [...]}
+with a code's index being its position. Files written before have no
+"meta_format" and hold most fields as json strings inside the json, which
+loads_meta still reads. legacy_meta builds that layout for the meta
+convert_voter_file returns, which callers get as before.
+"""
+import datetime
+import json
+
+import numpy as np
+
+META_FORMAT = 2
+# fields of the old layout that were plain strings rather than json
+PLAIN_FIELDS = frozenset(["message", "last_updated"])
+ELECTION_FIELDS = {"count": "counts", "date": "dates"}
+# states whose preprocessors kept their meta fields as python values in the
+# old layout; the others json encoded every field but the plain ones
+UNENCODED_META_STATES = frozenset(["florida", "kansas", "missouri",
+                                   "michigan", "new_jersey", "wisconsin"])
+# json.dumps arguments of old layout fields not encoded the default way
+LEGACY_FIELD_KWARGS = {
+    ("georgia", "array_encoding"): {"indent": 4, "sort_keys": True}}
+
+
+def decode_field(key, value):
+    """
+    :return: value of an old layout field, json decoded unless it was
+    stored as a plain string
+    """
+    if isinstance(value, str) and key not in PLAIN_FIELDS:
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    return value
+
+
+def election_columns(encoding, decoding=None):
+    """
+    :param encoding: array_encoding, code -> {"index", "count", "date"}
+    :param decoding: array_decoding, codes in index order
+    :return: the "elections" columns, or None if encoding does not have
+    that shape (it is then stored as it is)
+    """
+    if not isinstance(encoding, dict) or not encoding:
+        return None
+    for value in encoding.values():
+        if not isinstance(value, dict) or "index" not in value or \
+                set(value) - set(ELECTION_FIELDS) - {"index"}:
+            return None
+    ordered = sorted(encoding.items(), key=lambda kv: kv[1]["index"])
+    if [v["index"] for _, v in ordered] != list(range(len(ordered))):
+        return None
+    columns = {"codes": [k for k, _ in ordered]}
+    for field, column in ELECTION_FIELDS.items():
+        present = [field in v for _, v in ordered]
+        if all(present):
+            columns[column] = [v[field] for _, v in ordered]
+        elif any(present):
+            return None
+    if decoding is not None and list(decoding) != columns["codes"]:
+        columns["decoding"] = list(decoding)
+    return columns
+
+
+def compact_meta(meta):
+    """
+    :param meta: meta dictionary, as the preprocessors build it (fields may
+    still be json strings) or as loads_meta returns it
+    :return: format 2 dictionary
+    """
+    if meta.get("meta_format") == META_FORMAT:
+        return dict(meta)
+    fields = {k: decode_field(k, v) for k, v in meta.items()}
+    compact = {"meta_format": META_FORMAT}
+    columns = election_columns(fields.get("array_encoding"),
+                               fields.get("array_decoding"))
+    if columns is not None:
+        del fields["array_encoding"]
+        fields.pop("array_decoding", None)
+        compact["elections"] = columns
+    compact.update(fields)
+    return compact
+
+
+def expand_meta(compact):
+    """
+    :param compact: format 2 dictionary
+    :return: meta dictionary with array_encoding and array_decoding, the
+    shape readers of the old layout get
+    """
+    meta = {k: v for k, v in compact.items()
+            if k not in ("meta_format", "elections")}
+    columns = compact.get("elections")
+    if columns is not None:
+        codes = columns["codes"]
+        encoding = {k: {"index": i} for i, k in enumerate(codes)}
+        for field, column in ELECTION_FIELDS.items():
+            if column in columns:
+                for k, value in zip(codes, columns[column]):
+                    encoding[k][field] = value
+        meta["array_encoding"] = encoding
+        meta["array_decoding"] = columns.get("decoding", codes)
+    return meta
+
+
+def json_default(value):
+    """
+    json.dumps default for the values preprocessors put in meta that json
+    does not know
+    :param value: numpy scalar or array, or a date
+    :return: the plain python value
+    """
+    if isinstance(value, np.bool_):
+        return bool(value)
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (datetime.date, np.datetime64)):
+        # as the old layout wrote them, e.g. "2020-11-03 00:00:00"
+        return str(value)
+    raise TypeError("meta value {!r} of type {} is not json "
+                    "serializable".format(value, type(value).__name__))
+
+
+def legacy_meta(meta, state):
+    """
+    :param meta: meta dictionary
+    :param state: the state whose preprocessor built it
+    :return: the old layout of the state's meta, as its preprocessor built
+    it: every field but the plain strings json encoded, or for
+    UNENCODED_META_STATES the dictionary as it is
+    """
+    if meta is None or state in UNENCODED_META_STATES:
+        return meta
+    return {k: v if k in PLAIN_FIELDS and isinstance(v, str)
+            else json.dumps(v, default=json_default,
+                            **LEGACY_FIELD_KWARGS.get((state, k), {}))
+            for k, v in meta.items()}
+
+
+def dumps_meta(meta):
+    """
+    :param meta: meta dictionary
+    :return: json of its format 2 layout
+    """
+    if meta is None:
+        return json.dumps(None)
+    return json.dumps(compact_meta(meta), default=json_default)
+
+
+def loads_meta(text, expand=True):
+    """
+    Read a meta data file of either layout
+    :param text: json of the file
+    :param expand: rebuild array_encoding/array_decoding from the election
+    columns; otherwise return the format 2 dictionary as it is
+    :return: meta dictionary
+    """
+    meta = json.loads(text)
+    if meta is None:
+        return {}
+    version = meta.get("meta_format", 1)
+    if version > META_FORMAT:
+        raise ValueError("meta format {} is newer than this reader "
+                         "({})".format(version, META_FORMAT))
+    if version == 1:
+        meta = {k: decode_field(k, v) for k, v in meta.items()}
+        return compact_meta(meta) if not expand else meta
+    return expand_meta(meta) if expand else meta
@@ -0,0 +1,213 @@
+"""
+Output formats of processed voter files. csv.gz is the default; parquet
+and arrow (IPC file) keep dtypes, the index and list valued history
+columns as native list columns, and store low cardinality text columns
+dictionary encoded. The columnar formats need pyarrow
+(pip install reggie[columnar]). pgcopy is gzipped PostgreSQL binary COPY
+(see pg_copy).
+"""
+from gzip import GzipFile
+from io import BytesIO
+import logging
+import time
+
+import pandas as pd
+
+from reggie.ingestion.pg_copy import pg_copy_columns, read_pg_copy, \
+    write_pg_copy
+from reggie.ingestion.streaming import ParallelGzipWriter
+
+OUTPUT_FORMATS = ["csv", "parquet", "arrow", "pgcopy"]
+# key/file name extensions of each output format
+OUTPUT_EXTENSIONS = {
+    "csv": ["csv", "gz"],
+    "parquet": ["parquet"],
+    "arrow": ["arrow"],
+    "pgcopy": ["pgcopy", "gz"]}
+# text columns with at most this share of distinct values are stored as
+# dictionaries
+DICTIONARY_RATIO = 0.5
+COLUMNAR_COMPRESSION = "zstd"
+
+
+def check_output_format(output_format):
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError("output format must be one of {}, not {}".format(
+            OUTPUT_FORMATS, output_format))
+    return output_format
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("the parquet and arrow output formats need "
+                          "pyarrow: pip install reggie[columnar]")
+    return pyarrow
+
+
+def is_list_column(col):
+    """
+    :param col: object Series
+    :return: True if the first non null value is a list (e.g. all_history)
+    """
+    present = col.notna().to_numpy()
+    if not present.any():
+        return False
+    return isinstance(col.iloc[present.argmax()], (list, tuple))
+
+
+def dictionary_encode(df, ratio=DICTIONARY_RATIO):
+    """
+    :param df: processed dataframe
+    :param ratio: max share of distinct values of a dictionary column
+    :return: shallow copy of df with low cardinality text columns (and
+    only those) turned into categoricals
+    """
+    encoded = {}
+    for field in df.columns:
+        col = df[field]
+        if not (pd.api.types.is_object_dtype(col) or
+                pd.api.types.is_string_dtype(col)) or \
+                isinstance(col.dtype, pd.CategoricalDtype):
+            continue
+        if is_list_column(col):
+            continue
+        try:
+            n_unique = col.nunique()
+        except TypeError:
+            # unhashable values that aren't lists; leave them be
+            continue
+        if n_unique <= ratio * len(col):
+            encoded[field] = col.astype("category")
+    if not encoded:
+        return df
+    return df.assign(**encoded)
+
+
+def to_arrow_table(df, index=True, dictionary=True):
+    """
+    :param df: processed dataframe
+    :param index: keep the index, as to_csv(index=...) would
+    :param dictionary: dictionary encode low cardinality text columns
+    :return: pyarrow Table. Columns arrow can't type (e.g. text mixed with
+    numbers) are stored as text, missing values kept.
+    """
+    pa = import_pyarrow()
+    try:
+        return pa.Table.from_pandas(
+            dictionary_encode(df) if dictionary else df,
+            preserve_index=index)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        pass
+    mixed = {}
+    for field in df.columns:
+        col = df[field]
+        if not pd.api.types.is_object_dtype(col):
+            continue
+        try:
+            pa.array(col, from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            mixed[field] = col.where(col.isna(), col.astype(str))
+    logging.info("storing mixed type columns {} as text".format(
+        list(mixed)))
+    df = df.assign(**mixed)
+    return pa.Table.from_pandas(
+        dictionary_encode(df) if dictionary else df, preserve_index=index)
+
+
+def write_frame(df, fileobj, output_format, index=True,
+                compression=COLUMNAR_COMPRESSION, column_types=None,
+                **to_csv_kwargs):
+    """
+    :param df: processed dataframe
+    :param fileobj: binary file or path to write to
+    :param output_format: one of OUTPUT_FORMATS
+    :param index: keep the index
+    :param compression: codec of the columnar formats
+    :param column_types: yaml column types, for pgcopy
+    :param to_csv_kwargs: further to_csv arguments of the csv format
+    :return: None
+    """
+    check_output_format(output_format)
+    if output_format == "csv":
+        df.to_csv(fileobj, index=index, compression="gzip", **to_csv_kwargs)
+        return
+    if output_format == "pgcopy":
+        with ParallelGzipWriter(fileobj) as gz:
+            write_pg_copy(df, gz, column_types=column_types, index=index)
+        return
+    pa = import_pyarrow()
+    table = to_arrow_table(df, index=index)
+    if output_format == "parquet":
+        pa.parquet.write_table(table, fileobj, compression=compression)
+    else:
+        options = pa.ipc.IpcWriteOptions(compression=compression)
+        with pa.ipc.new_file(fileobj, table.schema, options=options) as w:
+            w.write_table(table)
+
+
+def read_frame(fileobj, output_format, index=True, copy_columns=None):
+    """
+    :param fileobj: binary file or path written by write_frame
+    :param output_format: one of OUTPUT_FORMATS
+    :param index: whether the index was written (only needed for csv)
+    :param copy_columns: column list of a pgcopy file (see
+    pg_copy.pg_copy_columns)
+    :return: dataframe
+    """
+    check_output_format(output_format)
+    if output_format == "csv":
+        return pd.read_csv(fileobj, compression="gzip",
+                           index_col=0 if index else None)
+    if output_format == "pgcopy":
+        if copy_columns is None:
+            raise ValueError("reading a pgcopy file needs its columns")
+        with GzipFile(fileobj=fileobj) if not isinstance(fileobj, str) \
+                else GzipFile(fileobj, "rb") as f:
+            return read_pg_copy(f, copy_columns)
+    pa = import_pyarrow()
+    if output_format == "parquet":
+        return pa.parquet.read_table(fileobj).to_pandas()
+    return pa.ipc.open_file(fileobj).read_all().to_pandas()
+
+
+def frame_bytes(df, output_format, index=True, **kwargs):
+    """
+    :return: BytesIO of df written in output_format, at position 0
+    """
+    buf = BytesIO()
+    write_frame(df, buf, output_format, index=index, **kwargs)
+    buf.seek(0)
+    return buf
+
+
+def compare_output_formats(df, formats=None, index=True):
+    """
+    Size, write and load time of df in each output format
+    :param df: processed dataframe
+    :param formats: formats to compare (default: all but pgcopy, which is
+    only read back by a pure python decoder)
+    :param index: keep the index
+    :return: dataframe indexed by format, with size relative to csv.gz
+    """
+    rows = []
+    copy_columns = pg_copy_columns(df, index=index)
+    for output_format in formats or [f for f in OUTPUT_FORMATS
+                                     if f != "pgcopy"]:
+        start = time.time()
+        buf = frame_bytes(df, output_format, index=index)
+        written = time.time()
+        read_frame(buf, output_format, index=index,
+                   copy_columns=copy_columns)
+        rows.append({"format": output_format,
+                     "bytes": len(buf.getvalue()),
+                     "write_seconds": written - start,
+                     "load_seconds": time.time() - written})
+    comparison = pd.DataFrame(rows).set_index("format")
+    if "csv" in comparison.index:
+        comparison["size_vs_csv"] = comparison["bytes"] / \
+            comparison.loc["csv", "bytes"]
+    return comparison
@@ -0,0 +1,133 @@
+"""
+Partitioned output of processed voter files: one part per primary locale
+(county, jurisdiction, ...) or per hash bucket of voter_id, plus a manifest
+of the parts, so downstream loads can run per partition in parallel and
+read only the partitions they need.
+"""
+import numpy as np
+import pandas as pd
+
+PARTITION_MODES = ["locale", "voter_id"]
+DEFAULT_BUCKETS = 16
+MANIFEST_FORMAT = 1
+MANIFEST_FILE = "manifest.json"
+UNKNOWN_LOCALE = "__unknown__"
+
+
+def check_partition_mode(partition_by):
+    if partition_by not in PARTITION_MODES:
+        raise ValueError("partition_by must be one of {}, not {}".format(
+            PARTITION_MODES, partition_by))
+    return partition_by
+
+
+def frame_column(df, field):
+    """
+    :return: df[field], or the index if it is the one named field
+    """
+    if field in df.columns:
+        return df[field]
+    if df.index.name == field:
+        return df.index.to_series(index=df.index)
+    raise ValueError("{} is neither a column nor the index of the "
+                     "processed file".format(field))
+
+
+def locale_partition_codes(df, config):
+    """
+    :param df: processed dataframe
+    :param config: the state's Config
+    :return: (codes, parts): an int array giving each row's partition, and
+    per partition a dict describing it. Locales of the state's locale names
+    file keep their position in it; other values follow, and rows with no
+    locale go to an UNKNOWN_LOCALE part.
+    """
+    col = frame_column(df, config.primary_locale_column)
+    locales = config.locales()
+    if locales is not None:
+        values = locales.as_ids(col)
+        known = locales.index.get_indexer(values)
+        extra, extra_ids = pd.factorize(values[known == -1])
+        codes = known.copy()
+        codes[known == -1] = np.where(extra == -1, -1, extra + len(locales))
+        ids = list(locales.index) + list(extra_ids)
+        names = list(locales.names) + [None] * len(extra_ids)
+    else:
+        codes, uniques = pd.factorize(col)
+        ids = [str(x) for x in uniques]
+        names = [None] * len(ids)
+    n = len(ids)
+    # rows without a locale get the last code
+    codes = np.where(codes == -1, n, codes)
+    parts = [{"locale": i, "locale_name": name} for i, name in
+             zip(ids, names)]
+    parts.append({"locale": UNKNOWN_LOCALE, "locale_name": None})
+    return codes, parts
+
+
+def bucket_partition_codes(df, config, buckets=DEFAULT_BUCKETS):
+    """
+    :param df: processed dataframe
+    :param config: the state's Config
+    :param buckets: number of partitions
+    :return: (codes, parts) as locale_partition_codes, by a hash of the
+    voter id that is the same across runs and snapshots, so a voter stays
+    in the same bucket
+    """
+    col = frame_column(df, config["voter_id"])
+    hashes = pd.util.hash_pandas_object(col.astype(str), index=False)
+    codes = (hashes.to_numpy() % np.uint64(buckets)).astype(np.int64)
+    return codes, [{"bucket": b} for b in range(buckets)]
+
+
+def partition_frame(df, config, partition_by="locale",
+                    buckets=DEFAULT_BUCKETS):
+    """
+    Split a processed dataframe into its partitions. Rows are ordered by
+    partition once (a stable argsort), and each partition is then a slice.
+    :param df: processed dataframe
+    :param config: the state's Config
+    :param partition_by: "locale" or "voter_id"
+    :param buckets: number of voter_id hash buckets
+    :return: generator of (part, sub dataframe) for non empty partitions,
+    part being a dict describing the partition with its "rows"
+    """
+    check_partition_mode(partition_by)
+    if partition_by == "locale":
+        codes, parts = locale_partition_codes(df, config)
+    else:
+        codes, parts = bucket_partition_codes(df, config, buckets)
+    order = np.argsort(codes, kind="stable")
+    counts = np.bincount(codes, minlength=len(parts))
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    for code, part in enumerate(parts):
+        if counts[code] == 0:
+            continue
+        part = dict(part, rows=int(counts[code]))
+        yield part, df.iloc[order[offsets[code]:offsets[code + 1]]]
+
+
+def part_file_name(index, extension):
+    return "part-{:05d}.{}".format(index, extension)
+
+
+def build_manifest(state, download_date, partition_by, output_format,
+                   parts, buckets=None):
+    """
+    :param parts: part dicts of partition_frame, each with its "file" and
+    "bytes" added
+    :return: manifest dict, listing the parts with their row counts and
+    byte sizes
+    """
+    manifest = {
+        "format": MANIFEST_FORMAT,
+        "state": state,
+        "download_date": download_date,
+        "partition_by": partition_by,
+        "output_format": output_format,
+        "rows": sum(p["rows"] for p in parts),
+        "bytes": sum(p["bytes"] for p in parts),
+        "parts": parts}
+    if partition_by == "voter_id":
+        manifest["buckets"] = buckets
+    return manifest
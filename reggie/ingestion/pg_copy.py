@@ -0,0 +1,388 @@
+"""
+PostgreSQL binary COPY output of processed voter files
+(COPY <table> (<columns>) FROM STDIN WITH (FORMAT binary)): ints, floats,
+dates and timestamps are sent in their binary form and the history columns
+as real int[]/text[] arrays, so the database does no text parsing.
+read_pg_copy decodes the format again, to check a file offline.
+"""
+from itertools import chain
+import struct
+
+import numpy as np
+import pandas as pd
+
+PG_COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+# postgres counts dates and timestamps from 2000-01-01
+PG_EPOCH = np.datetime64("2000-01-01", "us")
+PG_COPY_CHUNK_ROWS = 50000
+
+# binary type: (oid, fixed width numpy dtype or None if variable width)
+PG_TYPES = {
+    "bool": (16, ">u1"),
+    "int2": (21, ">i2"),
+    "int4": (23, ">i4"),
+    "int8": (20, ">i8"),
+    "float8": (701, ">f8"),
+    "date": (1082, ">i4"),
+    "timestamp": (1114, ">i8"),
+    "text": (25, None),
+}
+PG_ARRAY_TYPES = {"int2[]": "int2", "int4[]": "int4", "int8[]": "int8",
+                  "text[]": "text", "float8[]": "float8"}
+# yaml column types -> binary types
+YAML_PG_TYPES = {
+    "int": "int4", "integer": "int4", "smallint": "int2",
+    "bigint": "int8", "float": "float8", "double": "float8",
+    "boolean": "bool", "date": "date", "timestamp": "timestamp",
+    "int[]": "int4[]", "integer[]": "int4[]", "bigint[]": "int8[]",
+    "text[]": "text[]"}
+
+
+def pg_type(yaml_type):
+    """
+    :param yaml_type: a column type of a state's yaml, e.g. "varchar(60)"
+    :return: the binary COPY type it is sent as; text, char and varchar are
+    all sent as text
+    """
+    return YAML_PG_TYPES.get(str(yaml_type).strip().lower(), "text")
+
+
+def int_pg_type(dtype):
+    """
+    :param dtype: numpy or nullable integer dtype
+    :return: the smallest postgres integer holding its values; postgres has
+    no one byte integer, and its int8 is 8 bytes (bigint)
+    """
+    itemsize = dtype.itemsize
+    if pd.api.types.is_unsigned_integer_dtype(dtype):
+        itemsize *= 2
+    if itemsize <= 2:
+        return "int2"
+    if itemsize <= 4:
+        return "int4"
+    return "int8"
+
+
+def infer_pg_type(col):
+    """
+    :param col: Series without a yaml type
+    :return: binary COPY type of its dtype
+    """
+    if pd.api.types.is_bool_dtype(col):
+        return "bool"
+    if pd.api.types.is_integer_dtype(col):
+        return int_pg_type(col.dtype)
+    if pd.api.types.is_float_dtype(col):
+        return "float8"
+    if pd.api.types.is_datetime64_any_dtype(col):
+        return "timestamp"
+    present = col.notna().to_numpy()
+    if present.any() and isinstance(col.iloc[present.argmax()],
+                                    (list, tuple)):
+        return "text[]"
+    return "text"
+
+
+def check_integers(numbers, pg, name=None):
+    """
+    Raise rather than let a cast to a postgres integer type wrap around or
+    truncate: the file is loaded as it is
+    :param numbers: the non null values of a column
+    :param pg: "int2", "int4" or "int8"
+    :param name: column name, for the error
+    :return: None
+    """
+    if not len(numbers) or pd.api.types.is_bool_dtype(numbers.dtype):
+        return
+    if numbers.dtype == object:
+        # e.g. the values of a nullable integer column
+        numbers = pd.to_numeric(pd.Series(numbers)).to_numpy()
+    limits = np.iinfo(PG_TYPES[pg][1])
+    if pd.api.types.is_integer_dtype(numbers.dtype):
+        bad = (numbers < limits.min) | (numbers > limits.max)
+        problem = "out of the {} range".format(pg)
+    else:
+        numbers = numbers.astype(np.float64)
+        bad = ~np.isfinite(numbers) | (np.floor(numbers) != numbers)
+        problem = "that are not whole numbers"
+        if not bad.any():
+            # -min is a power of two, so exact as a float
+            bad = (numbers < limits.min) | (numbers >= -float(limits.min))
+            problem = "out of the {} range".format(pg)
+    if bad.any():
+        raise ValueError("column {} has values {} (e.g. {}); give it a "
+                         "wider type in the yaml".format(
+                             name, problem, numbers[bad.argmax()]))
+
+
+def fixed_payload(col, pg):
+    """
+    :return: (lengths, payload) of a fixed width column: lengths is -1 for
+    nulls, payload the big endian values of the other rows
+    """
+    dtype = PG_TYPES[pg][1]
+    if pg in ("date", "timestamp"):
+        values = pd.to_datetime(col, errors="coerce")
+        missing = values.isna().to_numpy()
+        values = values.to_numpy(dtype="datetime64[us]")[~missing]
+        delta = values - PG_EPOCH
+        if pg == "date":
+            numbers = delta.astype("timedelta64[D]").astype(np.int64)
+        else:
+            numbers = delta.astype(np.int64)
+    else:
+        values = col if pg == "bool" else pd.to_numeric(col, errors="coerce")
+        missing = values.isna().to_numpy()
+        numbers = values.to_numpy()[~missing]
+        if pg == "bool":
+            numbers = numbers.astype(bool)
+        elif pg in ("int2", "int4", "int8"):
+            check_integers(numbers, pg, col.name)
+    width = np.dtype(dtype).itemsize
+    lengths = np.where(missing, -1, width).astype(np.int64)
+    return lengths, numbers.astype(dtype).tobytes()
+
+
+def text_value(x):
+    return x.encode("utf-8") if isinstance(x, str) else str(x).encode("utf-8")
+
+
+def as_array(x):
+    """
+    :param x: a cell of a history column: a list, or a postgres array
+    string as df_to_postgres_array_string builds them
+    :return: list, or None for a missing value
+    """
+    if isinstance(x, (list, tuple, np.ndarray)):
+        return list(x)
+    if isinstance(x, str) and x.startswith("{") and x.endswith("}"):
+        return x[1:-1].split(",") if len(x) > 2 else []
+    return None
+
+
+def scatter_fields(buf, starts, lengths, payload):
+    """
+    Write fields (a 4 byte length, -1 for null, then the data) into buf
+    :param buf: uint8 array
+    :param starts: where each field starts in buf
+    :param lengths: data length of each field, -1 for nulls
+    :param payload: the data of the non null fields, concatenated
+    :return: None
+    """
+    prefix = lengths.astype(">i4").view(np.uint8).reshape(len(starts), 4)
+    buf[starts[:, None] + np.arange(4)] = prefix
+    payload = np.frombuffer(payload, dtype=np.uint8)
+    if not len(payload):
+        return
+    sizes = np.maximum(lengths, 0)
+    present = sizes > 0
+    sizes = sizes[present]
+    sources = np.cumsum(sizes) - sizes
+    shift = np.repeat(starts[present] + 4 - sources, sizes)
+    buf[np.arange(len(payload)) + shift] = payload
+
+
+def array_payload(col, pg):
+    """
+    :return: (lengths, payload) of an array column. The elements of all
+    cells are encoded together as one column, then each cell is laid out as
+    a one dimensional array: ndim, has null, element oid, length, lower
+    bound, elements (an empty array is just ndim 0, 0, element oid).
+    """
+    element = PG_ARRAY_TYPES[pg]
+    oid = PG_TYPES[element][0]
+    arrays = [as_array(x) for x in col.to_numpy()]
+    present = np.array([a is not None for a in arrays], dtype=bool)
+    cells = [a for a in arrays if a is not None]
+    counts = np.fromiter(map(len, cells), dtype=np.int64, count=len(cells))
+    flat = pd.Series(list(chain.from_iterable(cells)), dtype=object,
+                     name=col.name)
+    element_lengths, element_payload = column_payload(flat, element)
+    cell_of = np.repeat(np.arange(len(cells)), counts)
+    element_sizes = 4 + np.maximum(element_lengths, 0)
+    has_null = np.bincount(cell_of[element_lengths < 0],
+                           minlength=len(cells)) > 0
+    sizes = np.where(counts > 0, 20, 12) + np.bincount(
+        cell_of, weights=element_sizes, minlength=len(cells)).astype(np.int64)
+    starts = np.cumsum(sizes) - sizes
+    buf = np.zeros(int(sizes.sum()), dtype=np.uint8)
+    header = np.column_stack([
+        (counts > 0).astype(np.int64), has_null.astype(np.int64),
+        np.full(len(cells), oid, dtype=np.int64), counts,
+        np.ones(len(cells), dtype=np.int64)]).astype(">i4")
+    header = header.view(np.uint8).reshape(len(cells), 20)
+    buf[starts[:, None] + np.arange(12)] = header[:, :12]
+    filled = counts > 0
+    buf[starts[filled][:, None] + 12 + np.arange(8)] = header[filled, 12:]
+    # each element's offset within its cell
+    offsets = np.cumsum(element_sizes) - element_sizes
+    firsts = np.cumsum(counts) - counts
+    within = offsets - offsets[firsts[cell_of]]
+    scatter_fields(buf, starts[cell_of] + 20 + within, element_lengths,
+                   element_payload)
+    lengths = np.full(len(col), -1, dtype=np.int64)
+    lengths[present] = sizes
+    return lengths, buf.tobytes()
+
+
+def text_payload(col):
+    """
+    :return: (lengths, payload) of a text column
+    """
+    present = col.notna().to_numpy()
+    values = [text_value(x) for x in col.to_numpy()[present]]
+    lengths = np.full(len(col), -1, dtype=np.int64)
+    lengths[present] = np.fromiter(map(len, values), dtype=np.int64,
+                                   count=len(values))
+    return lengths, b"".join(values)
+
+
+def column_payload(col, pg):
+    if pg in PG_ARRAY_TYPES:
+        return array_payload(col, pg)
+    if PG_TYPES[pg][1] is None:
+        return text_payload(col)
+    return fixed_payload(col, pg)
+
+
+def encode_rows(df, types):
+    """
+    :param df: rows to encode
+    :param types: binary type of each column of df
+    :return: bytes of the rows, tuple headers and fields, as COPY expects
+    them. Fields are scattered into one buffer with numpy, a column at a
+    time, rather than packed row by row.
+    """
+    n, k = len(df), len(types)
+    payloads = [column_payload(df.iloc[:, c], pg)
+                for c, pg in enumerate(types)]
+    lengths = np.column_stack([p[0] for p in payloads]) if k else \
+        np.zeros((n, 0), dtype=np.int64)
+    field_sizes = 4 + np.maximum(lengths, 0)
+    row_sizes = 2 + field_sizes.sum(axis=1)
+    row_starts = np.cumsum(row_sizes) - row_sizes
+    # where each field's length prefix starts
+    field_starts = row_starts[:, None] + 2 + \
+        np.concatenate([np.zeros((n, 1), dtype=np.int64),
+                        np.cumsum(field_sizes, axis=1)[:, :-1]], axis=1)
+    buf = np.zeros(int(row_sizes.sum()), dtype=np.uint8)
+    count = np.frombuffer(struct.pack(">h", k), dtype=np.uint8)
+    buf[row_starts[:, None] + np.arange(2)] = count
+    for c in range(k):
+        scatter_fields(buf, field_starts[:, c], lengths[:, c],
+                       payloads[c][1])
+    return buf.tobytes()
+
+
+def frame_pg_types(df, column_types=None):
+    """
+    :param df: processed dataframe
+    :param column_types: yaml column types (see Config.database_column_types)
+    :return: list of the binary type of each column of df
+    """
+    column_types = column_types or {}
+    return [pg_type(column_types[c]) if c in column_types
+            else infer_pg_type(df[c]) for c in df.columns]
+
+
+def pg_copy_columns(df, column_types=None, index=False):
+    """
+    :param df: processed dataframe
+    :param column_types: yaml column types
+    :param index: the index is sent as the first column
+    :return: list of (column, binary type), the column list a COPY of the
+    file needs (the binary format carries no column names)
+    """
+    if index:
+        df = df.iloc[:0].reset_index()
+    return list(zip([str(c) for c in df.columns],
+                    frame_pg_types(df, column_types)))
+
+
+def write_pg_copy(df, sink, column_types=None, index=False,
+                  chunksize=PG_COPY_CHUNK_ROWS):
+    """
+    Write df in PostgreSQL binary COPY format, chunksize rows at a time
+    :param df: processed dataframe
+    :param sink: binary file object
+    :param column_types: yaml column types, the rest are inferred from
+    their dtype
+    :param index: send the index as the first column
+    :param chunksize: rows encoded at a time
+    :return: list of (column, binary type), the column list of the COPY
+    """
+    if index:
+        df = df.reset_index()
+    columns = pg_copy_columns(df, column_types)
+    types = [pg for _, pg in columns]
+    sink.write(PG_COPY_SIGNATURE + struct.pack(">ii", 0, 0))
+    for start in range(0, len(df), chunksize):
+        sink.write(encode_rows(df.iloc[start:start + chunksize], types))
+    sink.write(struct.pack(">h", -1))
+    return columns
+
+
+def decode_value(data, pg):
+    if pg in PG_ARRAY_TYPES:
+        element = PG_ARRAY_TYPES[pg]
+        ndim, _, _ = struct.unpack_from(">iii", data)
+        if ndim == 0:
+            return []
+        n, _ = struct.unpack_from(">ii", data, 12)
+        values, pos = [], 20
+        for _ in range(n):
+            size, = struct.unpack_from(">i", data, pos)
+            pos += 4
+            if size == -1:
+                values.append(None)
+            else:
+                values.append(decode_value(data[pos:pos + size], element))
+                pos += size
+        return values
+    dtype = PG_TYPES[pg][1]
+    if dtype is None:
+        return data.decode("utf-8")
+    value = np.frombuffer(data, dtype=dtype)[0]
+    if pg == "bool":
+        return bool(value)
+    if pg == "date":
+        return PG_EPOCH.astype("datetime64[D]") + np.timedelta64(
+            int(value), "D")
+    if pg == "timestamp":
+        return PG_EPOCH + np.timedelta64(int(value), "us")
+    return value.item()
+
+
+def read_pg_copy(fileobj, columns):
+    """
+    Decode a binary COPY file, e.g. to check one written by write_pg_copy
+    :param fileobj: binary file object
+    :param columns: list of (column, binary type), as write_pg_copy returns
+    :return: dataframe of the rows (nulls are None)
+    """
+    data = fileobj.read()
+    if not data.startswith(PG_COPY_SIGNATURE):
+        raise ValueError("not a PostgreSQL binary COPY file")
+    pos = len(PG_COPY_SIGNATURE)
+    _, extension = struct.unpack_from(">ii", data, pos)
+    pos += 8 + extension
+    rows = []
+    while True:
+        count, = struct.unpack_from(">h", data, pos)
+        pos += 2
+        if count == -1:
+            break
+        if count != len(columns):
+            raise ValueError("row has {} fields, expected {}".format(
+                count, len(columns)))
+        row = []
+        for _, pg in columns:
+            size, = struct.unpack_from(">i", data, pos)
+            pos += 4
+            if size == -1:
+                row.append(None)
+            else:
+                row.append(decode_value(data[pos:pos + size], pg))
+                pos += size
+        rows.append(row)
+    return pd.DataFrame(rows, columns=[c for c, _ in columns])
@@ -0,0 +1,297 @@
+"""
+Streaming writers for processed voter files: output is compressed and
+written out (to a file, or uploaded to s3) block by block as it is
+produced, so no stage has to hold a second (or third) full copy of the
+file.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+import zlib
+
+from reggie.reggie_constants import GZIP_COMPRESSION_LEVEL, \
+    S3_MAX_POOL_CONNECTIONS
+
+GZIP_BLOCK_SIZE = 1 << 20
+CSV_CHUNK_ROWS = 100000
+# s3 rejects multipart parts under 5 MiB (except the last)
+S3_MIN_PART_SIZE = 5 << 20
+S3_PART_SIZE = 16 << 20
+
+
+def gzip_member(block, level=GZIP_COMPRESSION_LEVEL):
+    """
+    :param block: bytes
+    :param level: zlib compression level
+    :return: block as a complete gzip member (zlib releases the GIL while
+    compressing, so members can be built on a thread pool)
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(block) + compressor.flush()
+
+
+class ParallelGzipWriter(io.BufferedIOBase):
+    """
+    Writable gzip stream in the style of pigz: input is cut into blocks
+    that are compressed in parallel, each into its own gzip member, and the
+    members are written to the target in order. Concatenated members are a
+    valid gzip file (gzip, zcat and pandas read them as one stream).
+    At most max_pending blocks are in flight, which bounds memory.
+
+    ```
+        with ParallelGzipWriter("out.csv.gz") as gz:
+            for chunk in chunks:
+                gz.write(chunk)
+    ```
+    """
+
+    def __init__(self, target, level=GZIP_COMPRESSION_LEVEL,
+                 block_size=GZIP_BLOCK_SIZE, max_workers=None,
+                 max_pending=None, encoding="utf-8"):
+        """
+        :param target: path or binary file object (e.g. an upload stream);
+        file objects are left open on close
+        :param level: zlib compression level, 1 (fast) to 9 (small)
+        :param block_size: bytes per gzip member
+        :param max_workers: compression threads (default: number of cpus,
+        at most 8)
+        :param max_pending: blocks compressing or waiting to be written
+        (default: twice max_workers)
+        :param encoding: used for str writes
+        """
+        super(ParallelGzipWriter, self).__init__()
+        if isinstance(target, str):
+            self.target = open(target, "wb")
+            self.owns_target = True
+        else:
+            self.target = target
+            self.owns_target = False
+        if max_workers is None:
+            max_workers = min(8, os.cpu_count() or 1)
+        self.level = level
+        self.block_size = block_size
+        self.max_pending = max_pending or 2 * max_workers
+        self.encoding = encoding
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.members = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write to closed ParallelGzipWriter")
+        if isinstance(data, str):
+            data = data.encode(self.encoding)
+        self.buffer += data
+        self.bytes_in += len(data)
+        while len(self.buffer) >= self.block_size:
+            self.submit(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return len(data)
+
+    def submit(self, block):
+        self.pending.append(self.pool.submit(gzip_member, block, self.level))
+        self.members += 1
+        while len(self.pending) > self.max_pending:
+            self.write_member()
+
+    def write_member(self):
+        member = self.pending.popleft().result()
+        self.target.write(member)
+        self.bytes_out += len(member)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            # an empty input still makes a (one empty member) gzip file
+            if self.buffer or self.members == 0:
+                self.submit(bytes(self.buffer))
+                self.buffer = bytearray()
+            while self.pending:
+                self.write_member()
+            self.target.flush()
+        finally:
+            self.pool.shutdown()
+            if self.owns_target:
+                self.target.close()
+            super(ParallelGzipWriter, self).close()
+
+
+def gzip_stream(source, target, level=GZIP_COMPRESSION_LEVEL,
+                chunk_size=GZIP_BLOCK_SIZE, **kwargs):
+    """
+    Compress a readable file object (text or binary) into target, a chunk
+    at a time
+    :param source: file object to read from its current position
+    :param target: path or binary file object
+    :param level: zlib compression level
+    :param chunk_size: characters/bytes read at a time
+    :param kwargs: further ParallelGzipWriter arguments
+    :return: the closed ParallelGzipWriter, for its byte counts
+    """
+    with ParallelGzipWriter(target, level=level, **kwargs) as gz:
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            gz.write(chunk)
+    return gz
+
+
+def write_csv_chunks(df, sink, chunksize=CSV_CHUNK_ROWS, encoding="utf-8",
+                     **to_csv_kwargs):
+    """
+    Write df as csv to a binary sink, chunksize rows at a time, so only one
+    chunk of csv text exists at once
+    :param df: dataframe
+    :param sink: binary file object: a file, a ParallelGzipWriter, an
+    upload stream...
+    :param chunksize: rows per chunk
+    :param encoding: of the csv
+    :param to_csv_kwargs: further to_csv arguments (index, sep, ...)
+    :return: number of bytes written
+    """
+    header = to_csv_kwargs.pop("header", True)
+    written = 0
+    for start in range(0, max(len(df), 1), chunksize):
+        chunk = df.iloc[start:start + chunksize].to_csv(
+            header=header if start == 0 else False, **to_csv_kwargs)
+        written += sink.write(chunk.encode(encoding))
+    return written
+
+
+class S3MultipartWriter(io.BufferedIOBase):
+    """
+    Writable stream onto an S3 object. Writes are cut into parts that are
+    uploaded concurrently (multipart upload) while the producer keeps
+    writing, so e.g. compression and upload overlap and at most
+    max_pending parts are held in memory. Objects smaller than one part
+    are sent with a single put. Leaving a with block on an exception
+    aborts the upload.
+    """
+
+    def __init__(self, bucket, key, client=None, part_size=S3_PART_SIZE,
+                 max_workers=None, max_pending=None, **extra_args):
+        """
+        :param bucket: s3 bucket
+        :param key: s3 key
+        :param client: boto3 s3 client (default: the shared, pooled one of
+        utils.s3; pass another to point at a local s3 stand-in)
+        :param part_size: bytes per part, at least 5 MiB
+        :param max_workers: concurrent part uploads (default: 8, at most
+        the connection pool size)
+        :param max_pending: parts uploading or waiting (default: twice
+        max_workers)
+        :param extra_args: passed with the upload, e.g.
+        ServerSideEncryption='AES256'
+        """
+        super(S3MultipartWriter, self).__init__()
+        if client is None:
+            from reggie.ingestion.utils import s3
+            client = s3.client()
+        if max_workers is None:
+            max_workers = min(8, S3_MAX_POOL_CONNECTIONS)
+        self.bucket = bucket
+        self.key = key
+        self.client = client
+        self.part_size = max(part_size, S3_MIN_PART_SIZE)
+        self.max_pending = max_pending or 2 * max_workers
+        self.extra_args = extra_args
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.pending = deque()
+        self.parts = []
+        self.upload_id = None
+        self.buffer = bytearray()
+        self.bytes_out = 0
+        self.position = 0
+        self.etag = None
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        # not seekable, but writers that ask where they are (pyarrow's
+        # file wrappers) get the number of bytes written so far
+        return self.position
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write to closed S3MultipartWriter")
+        self.buffer += data
+        self.position += len(data)
+        while len(self.buffer) >= self.part_size:
+            self.submit(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+
+    def submit(self, body):
+        if self.upload_id is None:
+            self.upload_id = self.client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key,
+                **self.extra_args)["UploadId"]
+        part_number = len(self.parts) + len(self.pending) + 1
+        self.bytes_out += len(body)
+        self.pending.append(self.pool.submit(
+            self.upload_part, part_number, body))
+        while len(self.pending) > self.max_pending:
+            self.parts.append(self.pending.popleft().result())
+
+    def upload_part(self, part_number, body):
+        response = self.client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            PartNumber=part_number, Body=body)
+        return {"PartNumber": part_number, "ETag": response["ETag"]}
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.upload_id is None:
+                response = self.client.put_object(
+                    Bucket=self.bucket, Key=self.key,
+                    Body=bytes(self.buffer), **self.extra_args)
+                self.bytes_out = len(self.buffer)
+            else:
+                if self.buffer:
+                    self.submit(bytes(self.buffer))
+                while self.pending:
+                    self.parts.append(self.pending.popleft().result())
+                response = self.client.complete_multipart_upload(
+                    Bucket=self.bucket, Key=self.key,
+                    UploadId=self.upload_id,
+                    MultipartUpload={"Parts": self.parts})
+            self.etag = response.get("ETag")
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self.buffer = bytearray()
+            self.pool.shutdown()
+            super(S3MultipartWriter, self).close()
+
+    def abort(self):
+        """
+        Drop the upload (and its uploaded parts)
+        """
+        for future in self.pending:
+            future.cancel()
+        self.pool.shutdown()
+        if self.upload_id is not None:
+            self.client.abort_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            self.upload_id = None
+        self.buffer = bytearray()
+        super(S3MultipartWriter, self).close()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
@@ -1,17 +1,68 @@
-import boto3
+import bisect
+import datetime
 import json
 import re
 import logging
+import numpy as np
+import pandas as pd
+import threading
+import time
 
 from dateutil import parser
-from botocore.exceptions import ClientError
 
 from reggie.configs.configs import Config
+from reggie.ingestion.metadata import loads_meta
+from reggie.ingestion.partitions import MANIFEST_FILE
+from reggie.local_store import load_local_store, local_store_path, \
+    save_local_store
 from reggie.reggie_constants import META_FILE_PREFIX, NULL_CHAR, \
-    PROCESSED_FILE_PREFIX, RAW_FILE_PREFIX
+    PROCESSED_FILE_PREFIX, RAW_FILE_PREFIX, S3_ENDPOINT_URL, \
+    S3_MAX_POOL_CONNECTIONS
+
+SNAPSHOT_INDEX_STORE = "snapshots_{}_{}.json"
+SNAPSHOT_INDEX_FORMAT = 1
+# seconds an in process index is used before listing new keys again
+SNAPSHOT_INDEX_TTL = 300
+# seconds before the index is rebuilt from a full listing, picking up
+# backfilled or deleted snapshots
+SNAPSHOT_INDEX_MAX_AGE = 24 * 3600
+# (bucket, prefix) -> SnapshotIndex, see SnapshotIndex.for_state
+snapshot_indexes = {}
+snapshot_index_lock = threading.Lock()
+
+
+class LazyS3(object):
+    """
+    Stands in for boto3.resource("s3"). boto3 is only imported, and the
+    resource created (and credentials looked up), the first time s3 is
+    used; after that every caller in the process shares the resource and
+    its connection pool.
+    """
+
+    def __init__(self):
+        self.s3_resource = None
+        self.lock = threading.Lock()
+
+    def resource(self):
+        if self.s3_resource is None:
+            with self.lock:
+                if self.s3_resource is None:
+                    import boto3
+                    from botocore.config import Config as BotoConfig
+                    self.s3_resource = boto3.resource(
+                        "s3", endpoint_url=S3_ENDPOINT_URL,
+                        config=BotoConfig(
+                            max_pool_connections=S3_MAX_POOL_CONNECTIONS))
+        return self.s3_resource
+
+    def client(self):
+        return self.resource().meta.client
 
+    def __getattr__(self, name):
+        return getattr(self.resource(), name)
 
-s3 = boto3.resource("s3")
+
+s3 = LazyS3()
 
 
 class MissingElectionCodesError(Exception):
@@ -78,6 +129,46 @@ def strcol_to_array(str_col, delim=","):
         .replace("]", "").str.split(delim)
 
 
+def tokenize_delimited(str_col, delim=",", chunksize=500000):
+    """
+    Split a delimited string column into tokens chunk by chunk (cleaned as in
+    strcol_to_array) and factorize them as they stream by, without ever
+    holding the whole column as one string or as lists of strings.
+    :param str_col: pandas Series of delimited strings, no nulls
+    :param delim: token delimiter
+    :param chunksize: number of rows tokenized at a time
+    :return: (codes, offsets, uniques): codes holds the int32 index into
+    uniques of every token, and the tokens of row i are
+    codes[offsets[i]:offsets[i + 1]]
+    """
+    token_index = {}
+    uniques = []
+    code_chunks = []
+    lengths = np.empty(len(str_col), dtype=np.int64)
+    for start in range(0, len(str_col), chunksize):
+        chunk = str_col.iloc[start:start + chunksize]
+        chunk = chunk.str.replace(" ", "_", regex=False) \
+            .str.replace("[", "", regex=False) \
+            .str.replace("]", "", regex=False)
+        lengths[start:start + len(chunk)] = \
+            chunk.str.count(re.escape(delim)).values + 1
+        tokens = np.array(chunk.str.cat(sep=delim).split(delim),
+                          dtype=object)
+        chunk_codes, chunk_uniques = pd.factorize(tokens)
+        for k in chunk_uniques:
+            if k not in token_index:
+                token_index[k] = len(uniques)
+                uniques.append(k)
+        to_global = np.array([token_index[k] for k in chunk_uniques],
+                             dtype=np.int32)
+        code_chunks.append(to_global[chunk_codes])
+    codes = np.concatenate(code_chunks) if code_chunks else \
+        np.empty(0, dtype=np.int32)
+    offsets = np.zeros(len(str_col) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return codes, offsets, np.array(uniques, dtype=object)
+
+
 def get_s3_uploads(state, file_class, source, s3_bucket, testing=False):
     """
     returns any files uploaded to s3 for a state, fileclass, source, and
@@ -100,92 +191,330 @@ def get_s3_uploads(state, file_class, source, s3_bucket, testing=False):
 
 
 def get_processed_s3_uploads(state, s3_bucket, testing=False):
-    configs = Config(state=state)
+    configs = Config.for_state(state=state)
     keys = get_s3_uploads(configs["state"], configs["file_class"],
                           configs["source"], s3_bucket, testing)
     return keys
 
 
+def processed_prefix(state, testing=False):
+    """
+    :return: s3 prefix of a state's processed files, as get_s3_uploads
+    lists them
+    """
+    configs = Config.for_state(state=state)
+    if testing:
+        return "testing/{}/{}/".format(configs["file_class"],
+                                       configs["state"])
+    return "{}/{}/{}".format(configs["file_class"], configs["state"],
+                             configs["source"])
+
+
+def snapshot_key_date(key, prefix=""):
+    """
+    :param key: s3 key under a state's processed prefix
+    :param prefix: that prefix
+    :return: date of the snapshot the key is, or None if it is not one.
+    A partitioned snapshot is its manifest; its part files are not
+    snapshots.
+    """
+    if key[-1] == "/":
+        return None
+    if ".parts/" in key and not key.endswith(".parts/" + MANIFEST_FILE):
+        return None
+    date = date_from_str(key[len(prefix):])
+    if date is None:
+        logging.info("no date in processed key {}, not indexed".format(key))
+        return None
+    return parser.parse(date).date()
+
+
+class SnapshotIndex(object):
+    """
+    Sorted index of the processed snapshots of a state on s3: (date, key)
+    pairs, with each key's etag. The index is kept in the local store and
+    in process, and is brought up to date from s3 by listing only keys
+    after the last one it knows (processed keys end in their date, so new
+    snapshots list last). That can miss a backfilled snapshot, which lists
+    before the last key, so lookups of a date that is not after every
+    indexed snapshot want a full listing (see for_state), as does an index
+    older than SNAPSHOT_INDEX_MAX_AGE. Lookups are a bisect of the index.
+    """
+
+    def __init__(self, s3_bucket, prefix, entries=None, etags=None,
+                 listed_at=None, full_listed_at=None):
+        """
+        :param s3_bucket: bucket holding the processed snapshots
+        :param prefix: s3 prefix of the state's processed files
+        :param entries: (date, key) pairs
+        :param etags: key -> etag
+        :param listed_at: time of the last listing
+        :param full_listed_at: time of the last full listing
+        """
+        self.s3_bucket = s3_bucket
+        self.prefix = prefix
+        self.entries = sorted(entries or [])
+        self.etags = dict(etags or {})
+        self.listed_at = listed_at
+        self.full_listed_at = full_listed_at
+        # guards entries and etags; listings run without it
+        self.lock = threading.Lock()
+
+    @classmethod
+    def store_name(cls, s3_bucket, prefix):
+        return SNAPSHOT_INDEX_STORE.format(
+            s3_bucket, prefix.strip("/").replace("/", "_"))
+
+    @classmethod
+    def load(cls, s3_bucket, prefix):
+        """
+        :return: SnapshotIndex from the local store (empty if there is
+        none), as it was last listed
+        """
+        stored = load_local_store(cls.store_name(s3_bucket, prefix))
+        if stored is None or stored.get("format") != SNAPSHOT_INDEX_FORMAT:
+            return cls(s3_bucket, prefix)
+        return cls(s3_bucket, prefix,
+                   entries=[(parser.isoparse(d).date(), k)
+                            for d, k, _ in stored["entries"]],
+                   etags={k: e for _, k, e in stored["entries"]},
+                   listed_at=stored["listed_at"],
+                   full_listed_at=stored["full_listed_at"])
+
+    def save(self):
+        with self.lock:
+            stored = {"format": SNAPSHOT_INDEX_FORMAT,
+                      "listed_at": self.listed_at,
+                      "full_listed_at": self.full_listed_at,
+                      "entries": [[d.isoformat(), k, self.etags.get(k)]
+                                  for d, k in self.entries]}
+        save_local_store(self.store_name(self.s3_bucket, self.prefix), stored)
+
+    @classmethod
+    def for_state(cls, state, s3_bucket, testing=False, client=None,
+                  date=None, max_age=None):
+        """
+        The state's index, shared in process. It is listed again at most
+        every SNAPSHOT_INDEX_TTL seconds: incrementally, or in full if
+        date is given and is not after every indexed snapshot.
+        :param state: state name
+        :param s3_bucket: bucket holding the processed snapshots
+        :param testing: index the testing prefix
+        :param client: boto3 s3 client (default: the shared one of s3; pass
+        another to point at a local s3 stand-in)
+        :param date: date about to be looked up
+        :param max_age: seconds a listing is used for, instead of
+        SNAPSHOT_INDEX_TTL (0 to always list)
+        :return: SnapshotIndex
+        """
+        prefix = processed_prefix(state, testing)
+        with snapshot_index_lock:
+            index = snapshot_indexes.get((s3_bucket, prefix))
+            if index is None:
+                index = cls.load(s3_bucket, prefix)
+                snapshot_indexes[(s3_bucket, prefix)] = index
+        now = time.time()
+        max_age = SNAPSHOT_INDEX_TTL if max_age is None else max_age
+        if date is not None and index.within(date):
+            stale = index.full_listed_at is None or \
+                now - index.full_listed_at >= max_age
+            full = True
+        else:
+            stale = index.listed_at is None or \
+                now - index.listed_at >= max_age
+            full = None
+        if stale:
+            index.refresh(client=client, full=full)
+            index.save()
+        return index
+
+    def within(self, date):
+        """
+        :return: True if date is not after the last indexed snapshot (so a
+        snapshot backfilled since the last full listing could neighbour it)
+        """
+        date = as_date(date)
+        with self.lock:
+            return len(self.entries) > 0 and date <= self.entries[-1][0]
+
+    def add(self, key, etag=None):
+        """
+        Add (or update) a processed key
+        :return: True if the key is a snapshot and was added
+        """
+        date = snapshot_key_date(key, self.prefix)
+        if date is None:
+            return False
+        with self.lock:
+            if key not in self.etags:
+                bisect.insort(self.entries, (date, key))
+            self.etags[key] = etag
+        return True
+
+    def list_snapshots(self, client, start_after=None):
+        """
+        :return: list of (date, key, etag) of the snapshots listed under
+        the prefix, after start_after if given
+        """
+        kwargs = {"Bucket": self.s3_bucket, "Prefix": self.prefix}
+        if start_after is not None:
+            kwargs["StartAfter"] = start_after
+        listed = []
+        paginator = client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(**kwargs):
+            for obj in page.get("Contents", []):
+                date = snapshot_key_date(obj["Key"], self.prefix)
+                if date is not None:
+                    listed.append((date, obj["Key"], obj["ETag"]))
+        return listed
+
+    def refresh(self, client=None, full=None):
+        """
+        List the processed keys on s3 that are new to the index. The
+        listing is done without holding any lock, and swapped in after.
+        :param client: boto3 s3 client
+        :param full: list every key (and drop deleted ones) rather than only
+        those after the last known key; by default when the last full
+        listing is older than SNAPSHOT_INDEX_MAX_AGE
+        :return: self
+        """
+        client = s3.client() if client is None else client
+        now = time.time()
+        with self.lock:
+            if full is None:
+                full = self.full_listed_at is None or \
+                    now - self.full_listed_at > SNAPSHOT_INDEX_MAX_AGE
+            start_after = max(self.etags) if self.etags and not full \
+                else None
+        listed = self.list_snapshots(client, start_after)
+        logging.info("{} listing of {} found {} snapshots".format(
+            "full" if full else "incremental", self.prefix, len(listed)))
+        with self.lock:
+            if full:
+                self.entries = sorted((d, k) for d, k, _ in listed)
+                self.etags = {k: e for _, k, e in listed}
+                self.full_listed_at = now
+            else:
+                for date, key, etag in listed:
+                    if key not in self.etags:
+                        bisect.insort(self.entries, (date, key))
+                    self.etags[key] = etag
+            self.listed_at = now
+        return self
+
+    @property
+    def keys(self):
+        with self.lock:
+            return [k for _, k in self.entries]
+
+    def etag(self, key):
+        return self.etags.get(key)
+
+    def surrounding(self, date):
+        """
+        :param date: date of a snapshot
+        :return: (pre_date, post_date, pre_key, post_key) of the closest
+        snapshots before and after date, None where there is none
+        """
+        date = as_date(date)
+        with self.lock:
+            entries = self.entries
+            i = bisect.bisect_left(entries, (date,))
+            j = bisect.bisect_left(entries,
+                                   (date + datetime.timedelta(days=1),))
+            pre_date, pre_key = entries[i - 1] if i > 0 else (None, None)
+            post_date, post_key = entries[j] if j < len(entries) \
+                else (None, None)
+        return pre_date, post_date, pre_key, post_key
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def as_date(date):
+    """
+    :param date: date, datetime or date string
+    :return: date
+    """
+    if isinstance(date, str):
+        return parser.parse(date).date()
+    if isinstance(date, datetime.datetime):
+        return date.date()
+    return date
+
+
+def record_snapshot(s3_bucket, key, etag=None):
+    """
+    Add a just uploaded processed key (a partitioned snapshot's manifest
+    key) to the snapshot indexes loaded in process, so they don't need
+    listing to see it
+    """
+    with snapshot_index_lock:
+        indexes = [index for (bucket, prefix), index in
+                   snapshot_indexes.items()
+                   if bucket == s3_bucket and key.startswith(prefix)]
+    for index in indexes:
+        if index.add(key, etag):
+            index.save()
+
+
 def pull_sorted_upload_keys(state, s3_bucket, testing=False):
-    keys = get_processed_s3_uploads(state, s3_bucket, testing)
-    return sorted([k.key for k in keys],
-                  key=lambda x: parser.parse(date_from_str(x)))
+    return SnapshotIndex.for_state(state, s3_bucket, testing=testing).keys
 
 
 def get_surrounding_dates(date,
                           state,
                           s3_bucket,
-                          testing=False):
-    this_date = date
-    pre_date = None
-    post_date = None
-    keys = pull_sorted_upload_keys(state, s3_bucket, testing=testing)
-
-    pre_key = None
-    post_key = None
-
-    key_list = list(
-        filter(
-            lambda x: parser.parse(date_from_str(x)).date() != this_date,
-            keys))
-    dates = list(
-        filter(
-            lambda x: x != this_date, [parser.parse(date_from_str(k)).date()
-                                       for k in keys]))
-
-    # iterate thru all processed file dates
-    for i, d in enumerate(dates):
-
-        # this_date is earlier than any snapshot file
-        if i == 0 and this_date < d:
-            post_date = d
-            post_key = key_list[i]
-
-        # this_date is later than any snapshot file
-        elif i == len(dates) - 1 and this_date > d:
-            pre_date = d
-            pre_key = key_list[i]
-
-        # this_date is between dates[i -1] and d
-        elif i > 0 and dates[i - 1] < this_date < d:
-            pre_date = dates[i - 1]
-            post_date = d
-            pre_key = key_list[i - 1]
-            post_key = key_list[i]
-
-    # in the special case where we are trying insert the first file for a
-    # state, this method returns (None, None)
-    return pre_date, post_date, pre_key, post_key
+                          testing=False,
+                          client=None):
+    """
+    :param date: date of a snapshot
+    :return: (pre_date, post_date, pre_key, post_key) of the processed
+    snapshots closest before and after date, None where there is none (e.g.
+    (None, None, None, None) when inserting the first file for a state)
+    """
+    index = SnapshotIndex.for_state(state, s3_bucket, testing=testing,
+                                    client=client, date=date)
+    return index.surrounding(date)
+
+
+def meta_key_for(k):
+    """
+    :param k: a processed file key
+    :return: key of its meta data
+    """
+    dir_array = k.split("/")
+    if dir_array[0] == "testing":
+        k_0 = "/".join(k.split("/")[2:])
+        return "testing/{}/{}.json".format(META_FILE_PREFIX, k_0)
+    k_0 = "/".join(k.split("/")[1:])
+    return "{}/{}.json".format(META_FILE_PREFIX, k_0)
 
 
 def get_metadata_for_key(k, s3_bucket):
     """
     Get complimentary metadata for an s3 object.
-    :param k: a processed file
+    :param k: a processed file, or the manifest key of a partitioned one
     :return:
     """
+    if k.endswith(".parts/" + MANIFEST_FILE):
+        manifest = json.loads(
+            s3.Object(s3_bucket, k).get()["Body"].read().decode("utf-8"))
+        # manifests name their meta key, else it is that of a csv snapshot
+        k = manifest.get("meta_key") or meta_key_for(
+            k[:-len("parts/" + MANIFEST_FILE)] + "csv.gz")
     if k[-4:] == 'json':
         meta_key = k
         meta = {}
     else:
         obj = s3.Object(s3_bucket, k).get()
-        dir_array = k.split("/")
-        if dir_array[0] == "testing":
-            k_0 = "/".join(k.split("/")[2:])
-            meta_key = "testing/{}/{}.json".format(META_FILE_PREFIX, k_0)
-        else:
-            k_0 = "/".join(k.split("/")[1:])
-            meta_key = "{}/{}.json".format(META_FILE_PREFIX, k_0)
+        meta_key = meta_key_for(k)
         meta = obj["Metadata"]
 
+    from botocore.exceptions import ClientError
     try:
         meta_obj = s3.Object(s3_bucket, meta_key).get()
-        meta_temp = json.loads(meta_obj["Body"].read().decode("utf-8") )
-        for k in meta_temp:
-            if type(meta_temp[k]) == str\
-                    and k not in ["message", "last_updated"]:
-                meta_temp[k] = json.loads(meta_temp[k])
-        meta.update(meta_temp)
+        meta.update(loads_meta(meta_obj["Body"].read().decode("utf-8")))
     except (ClientError, ValueError) as e:
         print(e)
         if isinstance(e, ValueError) or e.response['Error']['Code'] == \
@@ -0,0 +1,41 @@
+import json
+import logging
+import os
+
+from reggie.reggie_constants import CACHE_DIR
+
+
+def local_store_path(name):
+    return os.path.join(CACHE_DIR, name)
+
+
+def load_local_store(name, default=None):
+    """
+    Load a json object persisted in the local reggie store (CACHE_DIR).
+    :param name: file name within the store
+    :param default: returned if the object is missing or unreadable
+    :return: stored object or default
+    """
+    try:
+        with open(local_store_path(name)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return default
+
+
+def save_local_store(name, obj):
+    """
+    Persist a json serializable object to the local reggie store. The store
+    is only a cache, so failing to write it is logged and otherwise ignored.
+    :param name: file name within the store
+    :param obj: object to write
+    """
+    path = local_store_path(name)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(obj, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logging.info("could not write local store {}: {}".format(path, e))
@@ -1,25 +1,83 @@
-from reggie.configs.configs import Config
-from reggie.ingestion.download import Preprocessor
 import datetime
 import click
+import time
 
 
 def convert_voter_file(state=None, local_file=None,
-                       file_date=None, write_file=False):
+                       file_date=None, write_file=False,
+                       stable_election_codes=False, history_bitmaps=False,
+                       persist_date_memo=False, output_format="csv",
+                       compare_formats=False, partition_by=None,
+                       buckets=16):
+    # pandas and the ingestion code are only loaded when a file is converted,
+    # which keeps `reg --help` and the other commands fast
+    from reggie.configs.configs import Config
+    from reggie.ingestion.download import Preprocessor
+    from reggie.ingestion.metadata import legacy_meta
+
     config_file = Config.config_file_from_state(state)
     file_date = str(datetime.datetime.strptime(file_date, '%Y-%m-%d').date())
     with Preprocessor(None,
                       config_file,
                       force_file=local_file,
-                      force_date=file_date) as preprocessor:
+                      force_date=file_date,
+                      stable_election_codes=stable_election_codes,
+                      history_bitmaps=history_bitmaps,
+                      persist_date_memo=persist_date_memo,
+                      output_format=output_format) \
+            as preprocessor:
         file_item = preprocessor.execute()
+        if compare_formats:
+            from reggie.ingestion.output_formats import \
+                compare_output_formats
+            click.echo(compare_output_formats(file_item.frame).to_string())
         if not write_file:
+            # the processed frame itself, never serialized, and the meta in
+            # the layout the state's preprocessor used to return
             return(preprocessor.output_dataframe(file_item),
-                   preprocessor.meta)
-        preprocessor.local_dump(file_item)
+                   legacy_meta(preprocessor.meta, preprocessor.state))
+        if partition_by is not None:
+            preprocessor.local_partitioned_dump(
+                file_item, partition_by=partition_by, buckets=buckets)
+        else:
+            preprocessor.local_dump(file_item)
+
+
+class ConvertGroup(click.Group):
+    """
+    `reg` converts a voter file unless the first argument names one of the
+    other commands, so `reg --state ...` keeps working next to e.g.
+    `reg configs compile`
+    """
+
+    def parse_args(self, ctx, args):
+        if not args or args[0] not in self.commands:
+            if not any(a in ctx.help_option_names for a in args[:1]):
+                args = ["convert"] + list(args)
+        return super(ConvertGroup, self).parse_args(ctx, args)
+
+
+@click.group(cls=ConvertGroup)
+def cli():
+    pass
+
+
+@cli.group(help="manage state configs")
+def configs():
+    pass
+
+
+@configs.command(name="compile", help="pre-build the compiled config cache")
+def compile_configs():
+    from reggie.configs.configs import Config
+
+    start = time.time()
+    config_files = Config.compile_all()
+    click.echo("compiled {} configs in {:.2f}s".format(
+        len(config_files), time.time() - start))
 
 
-@click.command(help="convert a non-standard voter file")
+@cli.command(name="convert", help="convert a non-standard voter file")
 @click.option("--state", required=True, default=None,
               help="U.S. state name: e.g. florida")
 @click.option("--local_file", required=True, default=None,
@@ -28,8 +86,38 @@ def convert_voter_file(state=None, local_file=None,
               default=None,
               help="date of voter file in format 'YYYY-MM-DD'")
 @click.option("--write_file", required=False, default=True, is_flag=True)
-def convert_cli(state, local_file, file_date, write_file):
+@click.option("--stable_election_codes", required=False, default=False,
+              is_flag=True,
+              help="keep sparse_history indices of earlier snapshots")
+@click.option("--history_bitmaps", required=False, default=False,
+              is_flag=True,
+              help="add a bit-packed history_bitmap column")
+@click.option("--persist_date_memo", required=False, default=False,
+              is_flag=True,
+              help="reuse date strings parsed in earlier runs")
+@click.option("--output_format", required=False, default="csv",
+              type=click.Choice(["csv", "parquet", "arrow", "pgcopy"]),
+              help="format of the processed file")
+@click.option("--compare_formats", required=False, default=False,
+              is_flag=True,
+              help="print size and load time of the processed file in "
+                   "each output format")
+@click.option("--partition_by", required=False, default=None,
+              type=click.Choice(["locale", "voter_id"]),
+              help="write one file per primary locale or voter_id hash "
+                   "bucket, plus a manifest")
+@click.option("--buckets", required=False, default=16, type=int,
+              help="number of voter_id hash buckets")
+def convert_cli(state, local_file, file_date, write_file,
+                stable_election_codes, history_bitmaps, persist_date_memo,
+                output_format, compare_formats, partition_by, buckets):
     if file_date is None:
         file_date = datetime.datetime.today().date().isoformat()
     convert_voter_file(state=state, local_file=local_file,
-                       file_date=file_date, write_file=write_file)
+                       file_date=file_date, write_file=write_file,
+                       stable_election_codes=stable_election_codes,
+                       history_bitmaps=history_bitmaps,
+                       persist_date_memo=persist_date_memo,
+                       output_format=output_format,
+                       compare_formats=compare_formats,
+                       partition_by=partition_by, buckets=buckets)
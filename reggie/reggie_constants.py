@@ -21,6 +21,14 @@ CONFIG_DIR = REGGIE_PROJECT_DIR + "/configs/data/"
 LOCALE_DIR = REGGIE_PROJECT_DIR + "/configs/{}/".format(PRIMARY_LOCALE_NAMES)
 CONFIG_OHIO_FILE = CONFIG_DIR + "ohio.yaml"
 CONFIG_CHUNK_URLS = "data_chunk_links"
+CACHE_DIR = os.environ.get("REGGIE_CACHE_DIR",
+                           os.path.join(os.path.expanduser("~"), ".reggie"))
+
+S3_MAX_POOL_CONNECTIONS = int(os.environ.get("S3_MAX_POOL_CONNECTIONS", 32))
+# e.g. a local s3 stand-in (minio, moto server); None is aws itself
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL")
+# zlib level of the gzip files written by reggie (6 is gzip's default)
+GZIP_COMPRESSION_LEVEL = int(os.environ.get("GZIP_COMPRESSION_LEVEL", 6))
 
 RAW_FILE_PREFIX = "raw_voter_file"
 PROCESSED_FILE_PREFIX = "voter_file"
@@ -20,11 +20,12 @@ setuptools.setup(
                       "requests<2.21,>=2.20.0",
                       "xlrd",
                       "bs4"],
+    extras_require={"columnar": ["pyarrow"]},
     url="https://github.com/Voteshield/reggie",
     packages=setuptools.find_packages(),
     include_package_data=True,
     entry_points='''
     [console_scripts]
-    reg=reggie:convert_cli
+    reg=reggie:cli
     '''
 )
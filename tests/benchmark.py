@@ -0,0 +1,96 @@
+"""
+Timings of the vectorized code paths against what they replaced, on
+synthetic inputs (see reference.py); no state file is needed.
+
+    python tests/benchmark.py [name ...] [--rows N]
+"""
+import argparse
+import os
+import time
+
+from reggie.configs.configs import Config, DateMemo
+from reggie.ingestion.download import history_lists, iowa_history
+
+from reference import florida_voters, iowa_voters, legacy_iowa_history
+
+
+def timed(f, *args, **kwargs):
+    start = time.perf_counter()
+    result = f(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def bench_iowa_history(rows):
+    election_dates = Config.for_state("iowa")["election_dates"]
+    df = iowa_voters(rows)
+    legacy_time, expected = timed(legacy_iowa_history, df, election_dates)
+
+    def factorized():
+        elections, counts, codes, code_index, voted = iowa_history(
+            df, election_dates)
+        all_history, sparse_history, _ = history_lists(
+            elections, code_index, codes, voted, len(election_dates))
+        return elections, counts, all_history, sparse_history
+
+    new_time, result = timed(factorized)
+    assert result[2] == expected[2] and result[3] == expected[3]
+    return legacy_time, new_time
+
+
+def bench_coerce_all(rows):
+    """
+    coerce_strings, coerce_dates and coerce_numeric one after the other
+    against coerce_all in the calling thread
+    """
+    config = Config.for_state("florida")
+    df = florida_voters(rows)
+
+    def separate():
+        memo = DateMemo()
+        coerced = config.coerce_strings(df.copy())
+        coerced = config.coerce_dates(coerced, memo=memo)
+        return config.coerce_numeric(coerced)
+
+    separate_time, expected = timed(separate)
+    new_time, result = timed(config.coerce_all, df.copy(), memo=DateMemo(),
+                             max_workers=1)
+    assert result.equals(expected)
+    return separate_time, new_time
+
+
+def bench_coerce_all_threads(rows):
+    """
+    coerce_all in the calling thread against a pool of one thread per cpu
+    """
+    config = Config.for_state("florida")
+    df = florida_voters(rows)
+    one_time, expected = timed(config.coerce_all, df.copy(), memo=DateMemo(),
+                               max_workers=1)
+    pool_time, result = timed(config.coerce_all, df.copy(), memo=DateMemo(),
+                              max_workers=os.cpu_count() or 1)
+    assert result.equals(expected)
+    return one_time, pool_time
+
+
+BENCHMARKS = {"iowa_history": bench_iowa_history,
+              "coerce_all": bench_coerce_all,
+              "coerce_all_threads": bench_coerce_all_threads}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("names", nargs="*", metavar="name", help="one of "
+                        "{}".format(", ".join(sorted(BENCHMARKS))))
+    parser.add_argument("--rows", type=int, default=100000)
+    args = parser.parse_args()
+    for name in args.names or sorted(BENCHMARKS):
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark {}".format(name))
+        before, after = BENCHMARKS[name](args.rows)
+        print("{:<18} {:>9} rows  before {:8.2f}s  after {:8.2f}s  "
+              "{:6.1f}x".format(name, args.rows, before, after,
+                                before / after))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+import os
+import tempfile
+
+import pytest
+
+# keep the local store (compiled configs, date memos, snapshot indexes...)
+# of test runs out of the user's own
+os.environ["REGGIE_CACHE_DIR"] = tempfile.mkdtemp(prefix="reggie_tests_")
+
+BUCKET = "reggie-tests"
+
+
+@pytest.fixture
+def s3_client(monkeypatch, tmp_path):
+    """
+    boto3 s3 client of a moto mocked s3 holding an empty BUCKET; the shared
+    utils.s3 resource, the snapshot indexes and the local store start
+    afresh with it
+    """
+    moto = pytest.importorskip("moto")
+    for name in ["AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY",
+                 "AWS_SESSION_TOKEN"]:
+        monkeypatch.setenv(name, "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    import boto3
+    from reggie import local_store
+    from reggie.ingestion import utils
+    monkeypatch.setattr(local_store, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(utils.s3, "s3_resource", None)
+    monkeypatch.setattr(utils, "snapshot_indexes", {})
+    with moto.mock_aws():
+        client = boto3.client("s3")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
@@ -0,0 +1,131 @@
+"""
+What vectorized code paths did before they were vectorized, and synthetic
+inputs shaped like the state files, shared by the tests and benchmark.py
+"""
+from datetime import datetime
+import random
+
+import numpy as np
+import pandas as pd
+
+from reggie.configs.configs import Config
+
+
+def iowa_voters(n, seed=0, voted=0.4):
+    """
+    :param n: number of voters
+    :param voted: share of election slots a voter has voted in
+    :return: frame of iowa.yaml's election columns
+    """
+    config = Config.for_state("iowa")
+    rng = random.Random(seed)
+    dates = ["11/03/2020", " 11/06/2018", "06/02/2020 ", "11/08/2016",
+             "03/03/2020"]
+    methods = ["A", "E ", " P", None]
+    parties = ["DEM", "REP ", "LIB", None]
+    orgs = ["Dem Org", "Rep O'rg", '"quoted"', None]
+    columns = {c: [None] * n for c in config["election_columns"]}
+    for c in config["election_dates"]:
+        method = c.replace("ELECTION_DATE", "VOTERVOTEMETHOD")
+        party = c.replace("PRIMARY_ELECTION_DATE", "POLITICAL_PARTY")
+        org = c.replace("PRIMARY_ELECTION_DATE", "POLITICAL_ORGANIZATION")
+        for i in range(n):
+            if rng.random() < voted:
+                columns[c][i] = rng.choice(dates)
+                columns[method][i] = rng.choice(methods)
+                if c.startswith("PRIMARY"):
+                    columns[party][i] = rng.choice(parties)
+                    columns[org][i] = rng.choice(orgs)
+    return pd.DataFrame(columns, index=np.arange(n) * 2)
+
+
+def florida_voters(n, seed=0):
+    """
+    :param n: number of voters
+    :return: frame of florida.yaml's columns as read from the file: text
+    with stray spaces and blanks, dates as m/d/Y strings, districts as
+    digits
+    """
+    config = Config.for_state("florida")
+    rng = random.Random(seed)
+    words = ["  Smith", "JONES ", "o'brien", "", "Lee", None, "Garcia  "]
+    dates = ["{:02d}/{:02d}/{}".format(m, d, y) for m in range(1, 13)
+             for d in (1, 15, 28) for y in range(1930, 2020, 7)] + [""]
+    columns = {}
+    for field, field_type in config["columns"].items():
+        if field_type == "date":
+            values = dates
+        elif field_type == "int":
+            values = [str(i) for i in range(1, 40)] + [""]
+        else:
+            values = words
+        columns[field] = [rng.choice(values) for _ in range(n)]
+    return pd.DataFrame(columns)
+
+
+def legacy_iowa_history(df_voters, election_dates, key_delim="_"):
+    """
+    preprocess_iowa's history step before it was factorized, row by row
+    string building (without its chained assignments, which pandas no
+    longer writes through)
+    :return: (elections, counts, all_history, sparse_history)
+    """
+    df_voters = df_voters.copy()
+    df_voters["all_history"] = ''
+    for c in election_dates:
+        df_voters[c] = df_voters[c].fillna("")
+        prefix = c.split("_")[0] + key_delim
+        vote_type_col = c.replace("ELECTION_DATE", "VOTERVOTEMETHOD")
+        df_voters[vote_type_col] = df_voters[vote_type_col].fillna("")
+        df_voters[c] = prefix + df_voters[c].str.strip()
+        df_voters[c] += key_delim + df_voters[vote_type_col].str.strip()
+        if "PRIMARY" in prefix:
+            org_col = c.replace("PRIMARY_ELECTION_DATE",
+                                "POLITICAL_ORGANIZATION")
+            party_col = c.replace("PRIMARY_ELECTION_DATE",
+                                  "POLITICAL_PARTY")
+            df_voters[org_col] = df_voters[org_col].fillna("")
+            df_voters[party_col] = df_voters[party_col].fillna("")
+            party_info = df_voters[party_col].str.strip() + key_delim + \
+                df_voters[org_col].str.replace(" ", "")
+            df_voters[c] += key_delim + party_info
+        else:
+            df_voters[c] += key_delim + key_delim
+        df_voters[c] = df_voters[c].str.replace(prefix + key_delim * 3, '',
+                                                regex=False)
+        df_voters[c] = df_voters[c].str.replace('"', '', regex=False)
+        df_voters[c] = df_voters[c].str.replace("'", '', regex=False)
+        df_voters.all_history += " " + df_voters[c]
+
+    df_voters.all_history = df_voters.all_history.str.split()
+    elections, counts = np.unique(
+        df_voters[election_dates].values.astype(str), return_counts=True)
+    count_order = counts.argsort()[::-1]
+    elections = elections[count_order]
+    counts = counts[count_order]
+    sorted_codes_dict = {j: {"index": i} for i, j in enumerate(elections)}
+    default_item = {"index": len(elections)}
+    sparse_history = [[sorted_codes_dict.get(k, default_item)["index"]
+                       for k in a] for a in df_voters.all_history]
+    return elections, counts, df_voters.all_history.tolist(), sparse_history
+
+
+def legacy_election_order(combo_history, date_format="%Y%m%d",
+                          date_token=lambda x: x[0:8]):
+    """
+    How the preprocessors ordered election codes before ElectionCatalog
+    (preprocess_georgia's version): np.unique, then sorted() on a strptime
+    key per code, newest first
+    :return: (sorted_codes, counts, array position of each history row)
+    """
+    valid_elections, counts = np.unique(combo_history, return_counts=True)
+    date_order = [idx for idx, election in
+                  sorted(enumerate(valid_elections),
+                         key=lambda x: datetime.strptime(
+                             date_token(x[1]), date_format), reverse=True)]
+    valid_elections = valid_elections[date_order]
+    counts = counts[date_order]
+    sorted_codes = valid_elections.tolist()
+    index = {k: i for i, k in enumerate(sorted_codes)}
+    positions = [index[x] for x in combo_history]
+    return sorted_codes, counts.tolist(), positions
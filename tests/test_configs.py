@@ -0,0 +1,235 @@
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+import os
+import pickle
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from reggie.configs import configs
+from reggie.configs.configs import coerce_string_column, Config, \
+    DateFormatInference, DateMemo
+from reggie.reggie_constants import CONFIG_DIR
+
+from reference import florida_voters
+
+
+def florida_frame():
+    return pd.DataFrame({
+        "County_Code": ["ala", "bak", "zzz", "ala"],
+        "Birth_Date": ["03/24/1927", "01/02/1980", "07/04/1976",
+                       "12/31/1999"],
+        "Congressional_District": ["1", "2", "x", "3"]})
+
+
+def test_coerce_numeric():
+    config = Config.for_state("florida")
+    df = config.coerce_numeric(florida_frame())
+    assert df["Congressional_District"].tolist()[:2] == [1, 2]
+    assert np.isnan(df["Congressional_District"][2])
+    assert df["County_Code"].tolist() == ["ala", "bak", "zzz", "ala"]
+
+
+def georgia_frame():
+    return pd.DataFrame({
+        "Residence_zipcode": ["30301", "", "40001", "30302"],
+        "County_code": ["1", "2", "159", None],
+        "Mail_zip_code": ["30301", "x", "2.5", "30302"],
+        "Land_lot": ["12", "7", None, "300"],
+        "Mail_address_2": ["3", "APT 4", "", "5"]})
+
+
+def test_coerce_numeric_downcast():
+    config = Config.for_state("georgia")
+    extra_cols = ["Land_lot", "Mail_address_2"]
+    assert config.coerce_numeric(georgia_frame(), extra_cols=extra_cols)[
+        "County_code"].dtype == np.float64
+
+    df = config.coerce_numeric(georgia_frame(), extra_cols=extra_cols,
+                               downcast=True)
+    # nullable integers, missing values kept as NA
+    assert df["Residence_zipcode"].dtype == "Int32"
+    assert df["Residence_zipcode"].tolist()[::2] == [30301, 40001]
+    assert df["Residence_zipcode"].isna().tolist()[1]
+    assert df["County_code"].dtype == "Int16"
+    assert df["Land_lot"].dtype == "Int16"
+    # an int column that holds a fraction is not truncated
+    assert df["Mail_zip_code"].dtype == np.float32
+    assert df["Mail_zip_code"][2] == 2.5
+    # text of an extra column moves to its own column
+    assert df["Mail_address_2"].dtype == "Int8"
+    assert df["Mail_address_2"].isna().tolist() == [False, True, True, False]
+    assert df["Mail_address_2_text"].tolist()[1] == "APT 4"
+    assert df["Mail_address_2_text"].isna().tolist() == \
+        [True, False, False, True]
+    assert "Land_lot_text" not in df
+
+
+def test_coerce_all_categorical_locale():
+    config = Config.for_state("florida")
+    df = config.coerce_all(florida_frame(), categorical_locale=True)
+    col = df["County_Code"]
+    assert isinstance(col.dtype, pd.CategoricalDtype)
+    assert col.tolist() == ["ala", "bak", "zzz", "ala"]
+    # known locales keep their position in the locale names file
+    assert list(col.cat.categories[:len(config.locales())]) == \
+        list(config.locales().index)
+    assert col.cat.categories[-1] == "zzz"
+
+    df = config.coerce_all(florida_frame(), categorical_locale=False)
+    assert not isinstance(df["County_Code"].dtype, pd.CategoricalDtype)
+    assert df["County_Code"].tolist() == ["ala", "bak", "zzz", "ala"]
+
+
+def test_coerce_all_matches_separate_passes():
+    config = Config.for_state("florida")
+    df = florida_voters(500)
+    expected = config.coerce_numeric(config.coerce_dates(
+        config.coerce_strings(df.copy()), memo=DateMemo()))
+    assert config.coerce_all(df.copy(), memo=DateMemo()).equals(expected)
+    assert config.coerce_all(df.copy(), memo=DateMemo(),
+                             max_workers=4).equals(expected)
+
+
+def test_coerce_date_column_missing_dates():
+    config = Config.for_state("florida")
+    col = pd.Series(["03/24/1927", np.nan, "", "01/02/1980", None])
+    dates = config.coerce_date_column(col, "Birth_Date")
+    assert dates[0] == pd.Timestamp("1927-03-24")
+    assert dates[3] == pd.Timestamp("1980-01-02")
+    assert dates[[1, 2, 4]].isna().all()
+
+    df = config.coerce_all(pd.DataFrame({"Registration_Date": col}))
+    assert df["Registration_Date"][[1, 2, 4]].isna().all()
+
+
+def test_date_memo_threads():
+    memo = DateMemo()
+    days = pd.date_range("1990-01-01", periods=400).strftime("%Y%m%d")
+    chunks = [days[i:i + 150].values for i in range(0, 400, 50)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda x: memo.parse(x, "%Y%m%d"),
+                                chunks * 4))
+    for strings, parsed in zip(chunks * 4, results):
+        assert (parsed == pd.to_datetime(strings, format="%Y%m%d")
+                .values).all()
+    assert len(memo.parsed["%Y%m%d"]) == 400
+
+
+def baseline_coerce_string(col):
+    # coerce_strings before it went through the distinct values
+    string_copy = col.astype(str)
+    stripped_copy = string_copy.str.strip()
+    lower_copy = stripped_copy.str.lower()
+    utf_decoded = lower_copy.str.encode('utf-8', errors='ignore')
+    return utf_decoded.str.decode('utf-8')
+
+
+def test_coerce_string_column_nulls():
+    df = pd.read_csv(StringIO(
+        "Name_Last,Name_Suffix\n Ann ,JR\nBOB,\n ann,Jr \nCy,\n"))
+    df["objects"] = pd.Series(["A ", None, np.nan, "a"], dtype=object)
+    config = Config.for_state("florida")
+    for field in df.columns:
+        expected = baseline_coerce_string(df[field]).tolist()
+        out = coerce_string_column(df[field])
+        assert values(out) == values(expected), field
+        categorical = coerce_string_column(df[field], dtype="category")
+        assert values(categorical.astype(object)) == values(expected), field
+    coerced = config.coerce_all(df)
+    assert values(coerced["Name_Suffix"]) == ["jr", None, "jr", None]
+    assert values(coerced["Name_Last"]) == ["ann", "bob", "ann", "cy"]
+
+
+def values(col):
+    return [None if pd.isna(x) else x for x in col]
+
+
+def birthdays(n, parseable):
+    return pd.Series(["03/24/27"] * parseable + ["unknown"] * (n - parseable))
+
+
+def test_date_format_inference_threshold():
+    formats = Config.for_state("new_jersey2")["date_format"]
+    memo = DateMemo()
+    # whole columns are held to the threshold itself, not a band around it
+    for n, parseable, chosen in [(20, 11, "%m/%d/%y"), (20, 10, None),
+                                 (5000, 2750, "%m/%d/%y"),
+                                 (5000, 2500, None)]:
+        inference = DateFormatInference()
+        inference.formats = {}
+        inference.remember = lambda key, format_str: None
+        assert inference.infer(birthdays(n, parseable), formats, memo.parse,
+                               "new_jersey2/dob/x", min_parsed=0.5) == chosen
+
+
+@pytest.fixture
+def config_copy(tmp_path, monkeypatch):
+    import reggie.local_store
+    monkeypatch.setattr(reggie.local_store, "CACHE_DIR",
+                        str(tmp_path / "cache"))
+    monkeypatch.setattr(configs, "config_cache", {})
+    config_dir = tmp_path / "configs"
+    config_dir.mkdir()
+    config_file = str(config_dir / "florida.yaml")
+    shutil.copy(os.path.join(CONFIG_DIR, "florida.yaml"), config_file)
+    monkeypatch.setattr(configs, "CONFIG_DIR", str(config_dir))
+    return config_file
+
+
+def test_compiled_config_cache(config_copy):
+    locale_file = Config.infer_locale_file(config_copy)
+    config = Config.load_data(config_copy, locale_file)
+    assert os.path.exists(Config.compiled_file(config_copy))
+    assert Config.load_compiled(config_copy, locale_file) == config
+
+    # stale once the yaml changes
+    mtime = os.path.getmtime(config_copy)
+    os.utime(config_copy, (mtime + 10, mtime + 10))
+    assert Config.load_compiled(config_copy, locale_file) is None
+    Config.compile(config_copy)
+    assert Config.load_compiled(config_copy, locale_file) == config
+
+
+def test_corrupt_compiled_config(config_copy):
+    locale_file = Config.infer_locale_file(config_copy)
+    config = Config.compile(config_copy)
+    path = Config.compiled_file(config_copy)
+    with open(path, "rb") as f:
+        good = f.read()
+    corrupt = [good[:len(good) // 2], b"not a pickle",
+               # pickled by code that no longer exists
+               b"cno_such_module\nCompiledConfig\n.",
+               pickle.dumps(["an", "older", "layout"]),
+               pickle.dumps({"source": None})]
+    for content in corrupt:
+        with open(path, "wb") as f:
+            f.write(content)
+        assert Config.load_compiled(config_copy, locale_file) is None
+        configs.config_cache.clear()
+        assert Config.load_data(config_copy, locale_file) == config
+        # and rebuilt
+        assert Config.load_compiled(config_copy, locale_file) == config
+
+
+def test_downcast_numeric_setting(config_copy):
+    with open(config_copy, "a") as f:
+        f.write("\ndowncast_numeric: true\n")
+    config = Config(file_name=config_copy)
+    df = config.coerce_all(florida_frame())
+    assert df["Congressional_District"].dtype == "Int8"
+    assert df["Congressional_District"].isna().tolist()[2]
+    df = config.coerce_numeric(florida_frame(), downcast=False)
+    assert df["Congressional_District"].dtype == np.float64
+
+
+def test_configs_compile_command(config_copy):
+    from click.testing import CliRunner
+    from reggie.reggie import cli
+    result = CliRunner().invoke(cli, ["configs", "compile"])
+    assert result.exit_code == 0, result.output
+    assert result.output.startswith("compiled 1 configs")
+    assert Config.load_compiled(
+        config_copy, Config.infer_locale_file(config_copy)) is not None
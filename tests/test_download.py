@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import BUCKET
+from reggie.configs.configs import Config
+from reggie.ingestion.download import history_lists, iowa_history, \
+    Preprocessor
+from reggie.ingestion.elections import ElectionCodeTable
+from reggie.ingestion.metadata import dumps_meta
+from reggie.ingestion.utils import MissingElectionCodesError
+from reggie.reggie_constants import CONFIG_DIR
+
+from reference import iowa_voters, legacy_iowa_history
+
+CODES = {"31000": {"Date": "2020-11-03",
+                   "Slug": "2020-11-03_31000_GENERAL-ELECTION"},
+         "30800": {"Date": "2020-08-04",
+                   "Slug": "2020-08-04_30800_AUGUST-PRIMARY"}}
+
+
+def test_iowa_history_matches_legacy():
+    election_dates = Config.for_state("iowa")["election_dates"]
+    df = iowa_voters(300)
+    # a voter who never voted, and one who voted in every slot
+    df.iloc[0] = None
+    expected = legacy_iowa_history(df, election_dates)
+
+    elections, counts, codes, code_index, voted = iowa_history(
+        df, election_dates)
+    all_history, sparse_history, _ = history_lists(
+        elections, code_index, codes, voted, len(election_dates))
+    assert elections.tolist() == expected[0].tolist()
+    assert counts.tolist() == expected[1].tolist()
+    assert all_history == expected[2]
+    assert sparse_history == expected[3]
+    assert all_history[0] == [] and len(elections) > 10
+    # no key keeps quotes or blank primary parts
+    assert not any("'" in k or '"' in k for k in elections)
+    assert "PRIMARY_11/03/2020_A_DEM_DemOrg" in elections
+    assert np.array_equal(np.sort(code_index), np.arange(len(elections)))
+
+
+def michigan(date, output_format="csv"):
+    preprocessor = Preprocessor(None, CONFIG_DIR + "michigan.yaml",
+                                force_date=date, s3_bucket=BUCKET,
+                                testing=True, output_format=output_format)
+    preprocessor.raw_s3_file = "testing/raw/michigan/{}.zip".format(date)
+    return preprocessor
+
+
+def put_michigan_snapshot(client, date, meta, output_format="parquet"):
+    # as s3_dump writes it
+    snapshot = michigan(date, output_format)
+    client.put_object(Bucket=BUCKET, Key=snapshot.generate_key(), Body=b"x")
+    client.put_object(Bucket=BUCKET, Key=snapshot.generate_meta_key(),
+                      Body=dumps_meta(meta))
+
+
+def test_election_code_table_from_frame():
+    edf = pd.DataFrame({"Election_Code": [31000, 30800],
+                        "Date": pd.to_datetime(["2020-11-03", "2020-08-04"]),
+                        "Title": ["GENERAL ELECTION", "AUGUST_PRIMARY"]})
+    table = ElectionCodeTable.from_frame("michigan", edf)
+    assert table.codes == CODES
+    assert table.missing([31000, "31000", 1, "2"]) == ["1", "2"]
+    resolved = table.resolve(pd.Series([30800, 1, 30800], index=[5, 6, 7]))
+    assert resolved.to_dict() == {5: CODES["30800"]["Slug"], 6: "1",
+                                  7: CODES["30800"]["Slug"]}
+
+
+def test_election_code_table_versions(s3_client):
+    assert len(ElectionCodeTable.load("michigan")) == 0
+    table = ElectionCodeTable("michigan")
+    assert table.update(CODES, snapshot="2020-11-10")
+    assert not table.update({"31000": CODES["31000"]}, snapshot="2020-12-01")
+    table.save()
+    stored = ElectionCodeTable.load("michigan")
+    assert (stored.codes, stored.version, stored.snapshot) == \
+        (CODES, 1, "2020-11-10")
+
+
+def test_codes_from_nearby_meta(s3_client):
+    put_michigan_snapshot(s3_client, "2020-11-10",
+                          {"message": "x", "elec_code_dict": CODES})
+    table = michigan("2020-12-01").election_code_table(
+        pd.Series(["31000", "30800"]))
+    assert table.codes == CODES and table.snapshot == "2020-11-10"
+    # and they are kept for the next snapshot, without looking again
+    s3_client.delete_object(Bucket=BUCKET,
+                            Key=michigan("2020-11-10", "parquet")
+                            .generate_meta_key())
+    assert michigan("2020-12-15").election_code_table(
+        pd.Series(["31000"])).version == 1
+
+
+def test_no_codes_in_nearby_meta(s3_client):
+    put_michigan_snapshot(s3_client, "2020-11-10", {"message": "x"})
+    with pytest.raises(MissingElectionCodesError,
+                       match="No election codes in nearby meta data"):
+        michigan("2020-12-01").election_code_table(pd.Series(["31000"]))
+    # nor a snapshot before this one
+    with pytest.raises(MissingElectionCodesError,
+                       match="No election code file or nearby meta data"):
+        michigan("2020-11-01").election_code_table(pd.Series(["31000"]))
@@ -0,0 +1,157 @@
+import datetime
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import BUCKET
+from reference import legacy_election_order
+from reggie.ingestion import elections
+from reggie.ingestion.elections import election_turnout, ElectionCatalog, \
+    ElectionRegistry, pack_history, unpack_history, voted_in
+from reggie.ingestion.metadata import dumps_meta
+from reggie.ingestion.utils import meta_key_for, processed_prefix
+
+D = datetime.date
+
+
+@pytest.fixture
+def date_cache(tmp_path, monkeypatch):
+    import reggie.local_store
+    monkeypatch.setattr(reggie.local_store, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(elections, "election_date_cache", None)
+
+
+def georgia_history(n, seed=0):
+    rng = random.Random(seed)
+    dates = ["20201103", "20200609", "20181106", "20200609", "20160308"]
+    types = ["GEN", "PPP", "GEN_PRIMARY"]
+    return pd.Series(["{}_{}_{}".format(rng.choice(dates), rng.choice(types),
+                                        rng.choice(["R", "D", "NP"]))
+                      for _ in range(n)])
+
+
+def test_catalog_matches_legacy_order(date_cache):
+    history = georgia_history(500)
+    catalog = ElectionCatalog(history, "%Y%m%d", date_token=lambda x: x[0:8])
+    catalog.sort(reverse=True)
+    codes, counts, positions = legacy_election_order(history.tolist())
+    sorted_codes, sorted_codes_dict = catalog.encoding()
+    assert sorted_codes == codes
+    assert catalog.counts.tolist() == counts
+    assert catalog.positions.tolist() == positions
+    assert sorted_codes_dict[codes[0]] == {
+        "index": 0, "count": counts[0], "date": codes[0][0:8]}
+    assert catalog.iso_dates()[0] == "2020-11-03"
+
+
+def test_catalog_dates(date_cache):
+    history = pd.Series(["20200609", "bad", "20181106", "20200609"])
+    with pytest.raises(ValueError, match="bad"):
+        ElectionCatalog(history, "%Y%m%d")
+    catalog = ElectionCatalog(history, "%Y%m%d", default_date="1900-01-01")
+    assert catalog.sort().codes.tolist() == ["bad", "20181106", "20200609"]
+    assert catalog.positions.tolist() == [2, 0, 1, 2]
+    with pytest.raises(ValueError, match="null"):
+        ElectionCatalog(pd.Series(["20200609", None]), "%Y%m%d")
+    # parsed dates are kept for the next run
+    elections.election_date_cache = None
+    assert elections.parse_election_dates(["20181106", "bad"], "%Y%m%d") == \
+        ["2018-11-06", None]
+    assert "20181106" in elections.election_date_cache["%Y%m%d"]
+
+
+def test_history_bitmaps():
+    n_codes = 11
+    histories = {"v1": [0, 7, 8, 10], "v2": [], "v3": [3, 3], "v4": [10]}
+    voter_ids = [v for v, h in histories.items() for _ in h]
+    positions = [i for h in histories.values() for i in h]
+    bitmaps = pack_history(voter_ids, positions, n_codes)
+    assert bitmaps.to_dict() == {"v1": "81a0", "v3": "1000", "v4": "0020"}
+
+    # voters without history get no bitmap, and unpack to zeros
+    column = bitmaps.reindex(list(histories))
+    matrix = unpack_history(column)
+    assert matrix.shape == (4, 2)
+    for index in range(n_codes):
+        assert voted_in(matrix, index).tolist() == \
+            [index in h for h in histories.values()]
+    assert election_turnout(matrix, n_codes).tolist() == \
+        [1, 0, 0, 1, 0, 0, 0, 1, 1, 0, 2]
+    assert unpack_history([None, None]).tolist() == [[0], [0]]
+
+
+def test_history_bitmap_of_lists():
+    from reggie.ingestion.download import Preprocessor
+    from reggie.reggie_constants import CONFIG_DIR
+    preprocessor = Preprocessor(None, CONFIG_DIR + "kansas.yaml",
+                                force_date="2020-01-01",
+                                history_bitmaps=True)
+    # the index may repeat voter ids
+    histories = pd.Series([[1, 2], np.nan, [], [0]],
+                          index=["a", "b", "a", "c"])
+    bitmaps = preprocessor.history_bitmap_of_lists(histories, 3)
+    assert bitmaps.index.tolist() == ["a", "b", "a", "c"]
+    assert bitmaps.tolist()[0] == "60" and bitmaps.tolist()[3] == "80"
+    assert bitmaps.isna().tolist() == [False, True, True, False]
+    preprocessor.history_bitmaps = False
+    assert preprocessor.history_bitmap_of_lists(histories, 3) is None
+
+
+def put_snapshot(client, date, codes, testing=False):
+    key = "{}/{}.csv.gz".format(processed_prefix("texas", testing), date)
+    if testing:
+        key = "{}{}.csv.gz".format(processed_prefix("texas", testing), date)
+    client.put_object(Bucket=BUCKET, Key=key, Body=b"x")
+    client.put_object(Bucket=BUCKET, Key=meta_key_for(key), Body=dumps_meta({
+        "array_decoding": codes,
+        "array_encoding": {k: {"index": i} for i, k in enumerate(codes)}}))
+    return key
+
+
+def test_register_skips_empty_codes():
+    registry = ElectionRegistry("iowa")
+    index = registry.register(["GENERAL_2018", "", "PRIMARY_2018", None])
+    assert index.tolist() == [0, -1, 1, -1]
+    assert registry.codes == ["GENERAL_2018", "PRIMARY_2018"]
+    codes, encoding, index_map = registry.encoding(
+        ["", "SPECIAL_2019"], {"": {"index": 0}, "SPECIAL_2019": {"index": 1}})
+    assert codes == ["GENERAL_2018", "PRIMARY_2018", "SPECIAL_2019"]
+    assert "" not in encoding and index_map.tolist() == [-1, 2]
+
+
+def test_local_registry_is_per_bucket_and_prefix(s3_client):
+    local = ElectionRegistry.load("texas")
+    local.register(["a"])
+    local.save()
+    assert ElectionRegistry.load("texas").codes == ["a"]
+    # the bucket and testing stores are not the local one
+    assert ElectionRegistry.load("texas", testing=True).codes == []
+    assert ElectionRegistry.load("texas", D(2020, 1, 1),
+                                 s3_bucket=BUCKET).codes == []
+
+
+def test_s3_registry_is_the_source_of_truth(s3_client):
+    put_snapshot(s3_client, "2020-01-01", ["a", "b"])
+    registry = ElectionRegistry.load("texas", D(2020, 2, 1),
+                                     s3_bucket=BUCKET)
+    assert registry.codes == ["a", "b"]
+    # codes registered by this worker stay out of the store
+    registry.register(["c"])
+    registry.save()
+    assert ElectionRegistry.load("texas", D(2020, 2, 1),
+                                 s3_bucket=BUCKET).codes == ["a", "b"]
+
+    # a newer snapshot on s3 wins over the cached registry
+    put_snapshot(s3_client, "2020-02-01", ["a", "b", "d"])
+    registry = ElectionRegistry.load("texas", D(2020, 3, 1),
+                                     s3_bucket=BUCKET)
+    assert registry.codes == ["a", "b", "d"]
+
+    # testing runs are seeded from the testing prefix only
+    put_snapshot(s3_client, "2020-01-01", ["t"], testing=True)
+    assert ElectionRegistry.load("texas", D(2020, 3, 1), s3_bucket=BUCKET,
+                                 testing=True).codes == ["t"]
+    assert ElectionRegistry.load("texas", D(2020, 3, 1),
+                                 s3_bucket=BUCKET).codes == ["a", "b", "d"]
@@ -0,0 +1,49 @@
+import subprocess
+import sys
+
+# cumulative microseconds `import reggie` may take; it is around 30ms
+# (click), where pulling in pandas and boto3 takes several hundred
+IMPORT_BUDGET_US = 150000
+# network and data dependencies only the commands themselves import
+LAZY_MODULES = ["boto3", "botocore", "pandas", "numpy", "requests", "bs4",
+                "xlrd", "reggie.ingestion.download"]
+
+
+def run_python(code, *args):
+    return subprocess.run([sys.executable] + list(args) + ["-c", code],
+                          capture_output=True, text=True, check=True)
+
+
+def import_time_us(module):
+    """
+    :return: cumulative import time of module, from python -X importtime
+    """
+    stderr = run_python("import {}".format(module), "-X", "importtime").stderr
+    for line in stderr.splitlines():
+        fields = [f.strip() for f in line.split("|")]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1])
+    raise ValueError("{} not in the importtime output".format(module))
+
+
+def test_import_reggie_is_lazy():
+    loaded = run_python(
+        "import sys, reggie\n"
+        "print(' '.join(m for m in {} if m in sys.modules))".format(
+            LAZY_MODULES)).stdout.split()
+    assert loaded == []
+
+
+def test_utils_create_s3_lazily():
+    out = run_python(
+        "import sys\n"
+        "from reggie.ingestion.utils import s3\n"
+        "print('boto3' in sys.modules, s3.s3_resource is None)").stdout
+    assert out.split() == ["False", "True"]
+
+
+def test_import_time_budget():
+    # best of a few runs, so a busy machine doesn't fail the test
+    best = min(import_time_us("reggie") for _ in range(3))
+    assert best < IMPORT_BUDGET_US, \
+        "import reggie took {}us, budget {}us".format(best, IMPORT_BUDGET_US)
@@ -0,0 +1,79 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from reggie.ingestion.metadata import dumps_meta, legacy_meta, loads_meta, \
+    META_FORMAT
+
+
+def preprocessor_meta():
+    return {
+        "message": "georgia_2020-11-04T00:00:00",
+        "array_encoding": {
+            "g2020": {"index": 0, "count": np.int64(12),
+                      "date": pd.Timestamp("2020-11-03")},
+            "p2020": {"index": 1, "count": np.int32(3),
+                      "date": pd.Timestamp("2020-06-09")}},
+        "array_decoding": ["g2020", "p2020"],
+        "election_type": {"003": "GEN"}}
+
+
+def test_round_trip():
+    text = dumps_meta(preprocessor_meta())
+    compact = json.loads(text)
+    assert compact["meta_format"] == META_FORMAT
+    assert compact["elections"] == {
+        "codes": ["g2020", "p2020"], "counts": [12, 3],
+        "dates": ["2020-11-03 00:00:00", "2020-06-09 00:00:00"]}
+    meta = loads_meta(text)
+    assert meta["array_decoding"] == ["g2020", "p2020"]
+    assert meta["array_encoding"]["g2020"] == {
+        "index": 0, "count": 12, "date": "2020-11-03 00:00:00"}
+    assert meta["election_type"] == {"003": "GEN"}
+
+
+def test_numpy_values():
+    text = dumps_meta({"message": "x", "rows": np.int64(12),
+                       "share": np.float32(0.5), "valid": np.bool_(True),
+                       "counts": np.array([1, 2])})
+    meta = loads_meta(text)
+    assert meta["rows"] == 12 and isinstance(meta["rows"], int)
+    assert meta["share"] == 0.5
+    assert meta["valid"] is True
+    assert meta["counts"] == [1, 2]
+
+
+def test_not_serializable():
+    with pytest.raises(TypeError):
+        dumps_meta({"message": "x", "frame": pd.DataFrame({"a": [1]})})
+    with pytest.raises(TypeError):
+        dumps_meta({"message": "x", "codes": {"a", "b"}})
+
+
+def test_old_layout():
+    meta = preprocessor_meta()
+    legacy = legacy_meta(meta, "georgia")
+    assert legacy["message"] == "georgia_2020-11-04T00:00:00"
+    assert legacy["array_decoding"] == json.dumps(["g2020", "p2020"])
+    # as preprocess_georgia used to encode it
+    plain = {k: dict(v, count=int(v["count"]))
+             for k, v in meta["array_encoding"].items()}
+    assert legacy["array_encoding"] == json.dumps(
+        plain, indent=4, sort_keys=True, default=str)
+    assert legacy["election_type"] == json.dumps({"003": "GEN"})
+    assert loads_meta(json.dumps(legacy)) == loads_meta(dumps_meta(meta))
+    assert loads_meta(json.dumps(None)) == {}
+
+
+def test_old_layout_of_unencoded_states():
+    # preprocess_kansas returned its codes as python values
+    meta = {"message": "kansas_2020-11-04T00:00:00",
+            "array_encoding": {"2020-11-03_general": {
+                "index": 0, "count": 5, "date": "2020-11-03"}},
+            "array_decoding": ["2020-11-03_general"]}
+    assert legacy_meta(meta, "kansas") == meta
+    assert legacy_meta(meta, "kansas")["array_decoding"] == \
+        ["2020-11-03_general"]
+    assert isinstance(legacy_meta(meta, "texas")["array_decoding"], str)
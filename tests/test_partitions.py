@@ -0,0 +1,124 @@
+import json
+from io import BytesIO
+import os
+
+import pandas as pd
+import pytest
+
+from conftest import BUCKET
+from reggie.ingestion.download import Loader, ProcessedFile
+from reggie.ingestion.metadata import loads_meta
+from reggie.ingestion.output_formats import read_frame
+from reggie.ingestion.partitions import MANIFEST_FILE, UNKNOWN_LOCALE
+from reggie.reggie_constants import CONFIG_DIR
+
+
+def florida_voters(n=200):
+    counties = ["bay", "ala", "zzz", None, "bak"]
+    return pd.DataFrame({
+        "Voter_ID": ["{:09d}".format(i * 7) for i in range(n)],
+        "County_Code": [counties[i % len(counties)] for i in range(n)],
+        "age": [18 + i % 80 for i in range(n)]})
+
+
+def florida(output_format="csv"):
+    loader = Loader(config_file=CONFIG_DIR + "florida.yaml",
+                    force_date="2020-05-01", s3_bucket=BUCKET,
+                    output_format=output_format)
+    loader.meta = {"message": "florida_partitioned"}
+    return loader
+
+
+def by_voter(df):
+    return df.sort_values("Voter_ID").reset_index(drop=True)
+
+
+def check_parts(manifest, df, read_part):
+    """
+    :param read_part: function(file name) -> dataframe of the part
+    :return: the parts, as read back
+    """
+    assert manifest["rows"] == len(df)
+    parts = [read_part(p["file"]) for p in manifest["parts"]]
+    assert [len(p) for p in parts] == [p["rows"] for p in manifest["parts"]]
+    assert by_voter(pd.concat(parts)).astype(str).equals(
+        by_voter(df).astype(str))
+    return parts
+
+
+def test_local_partitioned_dump(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    loader = florida()
+    df = florida_voters()
+    manifest = loader.local_partitioned_dump(
+        ProcessedFile("florida", df, index=False))
+    directory = loader.generate_local_key(partitioned=True)
+    with open(os.path.join(directory, MANIFEST_FILE)) as f:
+        assert json.load(f) == manifest
+    with open(loader.generate_local_key(meta=True)) as f:
+        assert loads_meta(f.read())["message"] == "florida_partitioned"
+
+    def read_part(name):
+        path = os.path.join(directory, name)
+        assert os.path.getsize(path) == [
+            p["bytes"] for p in manifest["parts"] if p["file"] == name][0]
+        return pd.read_csv(path, dtype={"Voter_ID": str})
+
+    parts = check_parts(manifest, df, read_part)
+    # locales of the names file in its order, then the others, then none
+    assert [p["locale"] for p in manifest["parts"]] == \
+        ["ala", "bak", "bay", "zzz", UNKNOWN_LOCALE]
+    assert manifest["parts"][0]["locale_name"] == "Alachua"
+    assert manifest["parts"][3]["locale_name"] is None
+    for part, frame in zip(manifest["parts"], parts):
+        if part["locale"] == UNKNOWN_LOCALE:
+            assert frame["County_Code"].isna().all()
+        else:
+            assert frame["County_Code"].unique().tolist() == [part["locale"]]
+    assert sorted(os.listdir(directory)) == sorted(
+        [MANIFEST_FILE] + [p["file"] for p in manifest["parts"]])
+
+
+@pytest.mark.parametrize("output_format", ["csv", "parquet"])
+def test_s3_partitioned_dump(s3_client, output_format):
+    if output_format == "parquet":
+        pytest.importorskip("pyarrow")
+    loader = florida(output_format)
+    df = florida_voters()
+    manifest = loader.s3_partitioned_dump(
+        ProcessedFile("florida", df, index=False, output_format=output_format),
+        partition_by="voter_id", buckets=4, client=s3_client)
+    prefix = loader.generate_key(partitioned=True)
+    stored = json.loads(s3_client.get_object(
+        Bucket=BUCKET, Key=prefix + MANIFEST_FILE)["Body"].read())
+    assert stored == manifest
+    assert manifest["buckets"] == 4 and manifest["meta_key"] == \
+        loader.generate_meta_key()
+
+    def read_part(name):
+        body = s3_client.get_object(Bucket=BUCKET, Key=prefix + name)[
+            "Body"].read()
+        assert len(body) == [p["bytes"] for p in manifest["parts"]
+                             if p["file"] == name][0]
+        if output_format == "csv":
+            return pd.read_csv(BytesIO(body), compression="gzip",
+                               dtype={"Voter_ID": str})
+        return read_frame(BytesIO(body), output_format)
+
+    parts = check_parts(manifest, df, read_part)
+    buckets = {}
+    for part, frame in zip(manifest["parts"], parts):
+        for voter_id in frame["Voter_ID"]:
+            buckets[voter_id] = part["bucket"]
+
+    # a voter stays in their bucket in the next snapshot
+    later = florida(output_format)
+    later.download_date = "2020-06-01"
+    manifest = later.s3_partitioned_dump(
+        ProcessedFile("florida", df.iloc[::3], index=False,
+                      output_format=output_format),
+        partition_by="voter_id", buckets=4, client=s3_client)
+    prefix = later.generate_key(partitioned=True)
+    for part, frame in zip(manifest["parts"],
+                           check_parts(manifest, df.iloc[::3], read_part)):
+        assert {buckets[v] for v in frame["Voter_ID"]} == {part["bucket"]}
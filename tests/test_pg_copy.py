@@ -0,0 +1,107 @@
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from reggie.ingestion.pg_copy import infer_pg_type, read_pg_copy, \
+    write_pg_copy
+
+
+def round_trip(df, **kwargs):
+    buf = BytesIO()
+    columns = write_pg_copy(df, buf, **kwargs)
+    buf.seek(0)
+    return columns, read_pg_copy(buf, columns)
+
+
+def values(col):
+    """
+    :return: col as a list, None for missing values whatever pandas made of
+    them
+    """
+    return [x if isinstance(x, list) or not pd.isna(x) else None
+            for x in col]
+
+
+def test_round_trip():
+    df = pd.DataFrame({
+        "voter_id": ["a1", None, "c3", "d4"],
+        "age": pd.array([34, None, 71, 18], dtype="Int16"),
+        "active": [True, False, True, False],
+        "registered": pd.to_datetime(["2001-02-03 04:05:06", None,
+                                      "1999-12-31 00:00:00",
+                                      "2020-01-01 23:59:59"]),
+        "birth_date": pd.to_datetime(["1980-01-02", "1927-03-24", None,
+                                      "2002-06-30"]),
+        "all_history": [["g2016", "p2018"], [], None, ["g2020"]],
+        "sparse_history": ["{1,4}", "{}", None, "{2}"]})
+    column_types = {"birth_date": "date", "sparse_history": "int[]"}
+    columns, out = round_trip(df, column_types=column_types,
+                              chunksize=3)
+    assert columns == [("voter_id", "text"), ("age", "int2"),
+                       ("active", "bool"), ("registered", "timestamp"),
+                       ("birth_date", "date"), ("all_history", "text[]"),
+                       ("sparse_history", "int4[]")]
+    assert values(out["voter_id"]) == ["a1", None, "c3", "d4"]
+    assert values(out["age"]) == [34, None, 71, 18]
+    assert values(out["active"]) == [True, False, True, False]
+    assert out["registered"][0] == np.datetime64("2001-02-03T04:05:06")
+    assert values(out["registered"])[1] is None
+    assert out["birth_date"][1] == np.datetime64("1927-03-24")
+    assert values(out["birth_date"])[2] is None
+    assert values(out["all_history"]) == [["g2016", "p2018"], [], None,
+                                           ["g2020"]]
+    assert values(out["sparse_history"]) == [[1, 4], [], None, [2]]
+
+
+def test_round_trip_index_and_empty():
+    df = pd.DataFrame({"x": [1.5, np.nan]},
+                      index=pd.Index(["a", "b"], name="voter_id"))
+    columns, out = round_trip(df, index=True)
+    assert columns == [("voter_id", "text"), ("x", "float8")]
+    assert values(out["voter_id"]) == ["a", "b"]
+    assert out["x"][0] == 1.5 and np.isnan(out["x"][1])
+
+    columns, out = round_trip(df.iloc[:0])
+    assert len(out) == 0 and columns == [("x", "float8")]
+
+
+def test_integer_widths():
+    widths = {"int8": "int2", "int16": "int2", "int32": "int4",
+              "int64": "int8", "uint8": "int2", "uint16": "int4",
+              "Int8": "int2", "Int32": "int4"}
+    for dtype, pg in widths.items():
+        assert infer_pg_type(pd.Series([1, 2], dtype=dtype)) == pg, dtype
+    df = pd.DataFrame({"small": np.array([-128, 127], dtype=np.int8),
+                       "medium": np.array([-32768, 32767], dtype=np.int16),
+                       "large": np.array([2 ** 40, -1], dtype=np.int64)})
+    columns, out = round_trip(df)
+    assert [pg for _, pg in columns] == ["int2", "int2", "int8"]
+    assert out["small"].tolist() == [-128, 127]
+    assert out["medium"].tolist() == [-32768, 32767]
+    assert out["large"].tolist() == [2 ** 40, -1]
+
+
+def test_integers_that_do_not_fit():
+    types = {"phone_number": "int"}
+    df = pd.DataFrame({"phone_number": [6095551234, 2015550000]})
+    with pytest.raises(ValueError, match="phone_number.*int4 range"):
+        round_trip(df, column_types=types)
+    df = pd.DataFrame({"phone_number": [12.7, np.nan]})
+    with pytest.raises(ValueError, match="phone_number.*whole numbers"):
+        round_trip(df, column_types=types)
+    df = pd.DataFrame({"history": [[1, 2 ** 31], []]})
+    with pytest.raises(ValueError, match="history.*int4 range"):
+        round_trip(df, column_types={"history": "int[]"})
+
+    df = pd.DataFrame({"phone_number": [12.0, np.nan, -2.0 ** 31],
+                       "ward": pd.array([3, None, 32767], dtype="Int64")})
+    columns, out = round_trip(df, column_types={"phone_number": "int",
+                                                "ward": "smallint"})
+    assert values(out["phone_number"]) == [12, None, -2 ** 31]
+    assert values(out["ward"]) == [3, None, 32767]
+    with pytest.raises(ValueError, match="ward"):
+        round_trip(df.assign(ward=pd.array([32768], dtype="Int64")
+                             .repeat(3)),
+                   column_types={"ward": "smallint"})
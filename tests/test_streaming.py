@@ -0,0 +1,193 @@
+import gzip
+from io import BytesIO, StringIO
+import os
+
+import pandas as pd
+import pytest
+
+from reggie.ingestion.output_formats import compare_output_formats, \
+    read_frame, write_frame
+from reggie.ingestion.streaming import gzip_stream, ParallelGzipWriter, \
+    S3_MIN_PART_SIZE, S3MultipartWriter
+
+from conftest import BUCKET
+
+
+@pytest.fixture
+def client(s3_client):
+    return s3_client
+
+
+def get_body(client, key):
+    return client.get_object(Bucket=BUCKET, Key=key)["Body"].read()
+
+
+def test_multipart_upload(client):
+    data = os.urandom(2 * S3_MIN_PART_SIZE + 12345)
+    with S3MultipartWriter(BUCKET, "big", client=client,
+                           part_size=S3_MIN_PART_SIZE, max_workers=2,
+                           max_pending=1) as upload:
+        # writes smaller than a part are gathered into parts
+        for start in range(0, len(data), 1 << 20):
+            upload.write(data[start:start + (1 << 20)])
+    assert len(upload.parts) == 3
+    assert upload.bytes_out == len(data) == upload.tell()
+    assert upload.etag.strip('"').endswith("-3")
+    assert get_body(client, "big") == data
+    assert "Uploads" not in client.list_multipart_uploads(Bucket=BUCKET)
+
+
+def test_small_upload_is_one_put(client):
+    with S3MultipartWriter(BUCKET, "small", client=client) as upload:
+        upload.write(b"voter_id\n1\n")
+    assert upload.upload_id is None and upload.parts == []
+    assert get_body(client, "small") == b"voter_id\n1\n"
+
+    with S3MultipartWriter(BUCKET, "empty", client=client):
+        pass
+    assert get_body(client, "empty") == b""
+
+
+def test_abort_on_error(client):
+    with pytest.raises(RuntimeError):
+        with S3MultipartWriter(BUCKET, "broken", client=client,
+                               part_size=S3_MIN_PART_SIZE) as upload:
+            upload.write(os.urandom(S3_MIN_PART_SIZE + 1))
+            assert upload.upload_id is not None
+            raise RuntimeError("producer failed")
+    assert "Uploads" not in client.list_multipart_uploads(Bucket=BUCKET)
+    assert "Contents" not in client.list_objects_v2(Bucket=BUCKET)
+
+
+@pytest.mark.parametrize("output_format", ["csv", "pgcopy", "parquet",
+                                           "arrow"])
+def test_output_formats_stream_to_s3(client, output_format):
+    if output_format in ("parquet", "arrow"):
+        pytest.importorskip("pyarrow")
+    df = pd.DataFrame({"voter_id": ["a", "b", "c"], "age": [18, 40, 99]})
+    with S3MultipartWriter(BUCKET, output_format, client=client) as upload:
+        write_frame(df, upload, output_format, index=False)
+    out = read_frame(BytesIO(get_body(client, output_format)),
+                     output_format, index=False,
+                     copy_columns=[("voter_id", "text"), ("age", "int8")])
+    assert out["voter_id"].tolist() == ["a", "b", "c"]
+    assert out["age"].tolist() == [18, 40, 99]
+
+
+def test_s3_dump(client):
+    from reggie.ingestion.download import Loader, ProcessedFile
+    from reggie.reggie_constants import CONFIG_DIR
+    loader = Loader(config_file=CONFIG_DIR + "texas.yaml",
+                    force_date="2020-01-01", s3_bucket=BUCKET)
+    loader.meta = {"message": "texas_2020-01-01"}
+    df = pd.DataFrame({"voter_id": ["a", "b"], "age": [18, 40]})
+    loader.s3_dump(ProcessedFile("texas.processed", df, index=False),
+                   client=client)
+    key = loader.generate_key()
+    assert gzip.decompress(get_body(client, key)) == \
+        df.to_csv(index=False).encode()
+    assert b"texas_2020-01-01" in get_body(client,
+                                           loader.generate_meta_key())
+
+
+def test_s3_dump_meta_of_columnar_output(client):
+    pytest.importorskip("pyarrow")
+    from reggie.ingestion.download import Loader, ProcessedFile
+    from reggie.ingestion.utils import get_metadata_for_key
+    from reggie.reggie_constants import CONFIG_DIR
+    loader = Loader(config_file=CONFIG_DIR + "texas.yaml",
+                    force_date="2020-01-01", s3_bucket=BUCKET,
+                    output_format="parquet")
+    loader.meta = {"message": "texas_parquet", "array_decoding": ["g2020"],
+                   "array_encoding": {"g2020": {"index": 0}}}
+    df = pd.DataFrame({"voter_id": ["a", "b"], "age": [18, 40]})
+    loader.s3_dump(ProcessedFile("texas.processed", df, index=False,
+                                 output_format="parquet"), client=client)
+    key = loader.generate_key()
+    assert key.endswith(".parquet")
+    assert loader.generate_meta_key().endswith(".parquet.json")
+    meta = get_metadata_for_key(key, BUCKET)
+    assert meta["message"] == "texas_parquet"
+    assert meta["array_decoding"] == ["g2020"]
+
+
+def test_parallel_gzip_round_trip(tmp_path):
+    data = os.urandom(50000) + b"voter_id,age\n" * 1000
+    buf = BytesIO()
+    with ParallelGzipWriter(buf, level=1, block_size=4096, max_workers=3,
+                            max_pending=2) as gz:
+        for start in range(0, len(data), 1000):
+            gz.write(data[start:start + 1000])
+    # one gzip member per block, written in order
+    assert gz.members == -(-len(data) // 4096)
+    assert gz.bytes_in == len(data) and gz.bytes_out == len(buf.getvalue())
+    assert not buf.closed
+    assert gzip.decompress(buf.getvalue()) == data
+
+    path = str(tmp_path / "voters.csv.gz")
+    text = "voter_id,name\n" + "".join(
+        "{},Zoë {}\n".format(i, i) for i in range(5000))
+    gz = gzip_stream(StringIO(text), path, chunk_size=999, block_size=1024)
+    assert gz.members > 1
+    assert pd.read_csv(path)["name"].tolist()[-1] == "Zoë 4999"
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        assert f.read() == text
+
+
+def test_parallel_gzip_empty_input():
+    buf = BytesIO()
+    with ParallelGzipWriter(buf):
+        pass
+    assert gzip.decompress(buf.getvalue()) == b""
+    gz = ParallelGzipWriter(BytesIO())
+    gz.close()
+    with pytest.raises(ValueError):
+        gz.write(b"x")
+
+
+def test_compress_and_local_dump(tmp_path, monkeypatch):
+    from reggie.ingestion.download import FileItem, Loader, ProcessedFile
+    from reggie.ingestion.metadata import loads_meta
+    from reggie.reggie_constants import CONFIG_DIR
+    monkeypatch.chdir(tmp_path)
+    loader = Loader(config_file=CONFIG_DIR + "texas.yaml",
+                    force_date="2020-01-01", compression_level=1)
+    loader.meta = {"message": "texas_2020-01-01"}
+    df = pd.DataFrame({"voter_id": ["a", "b", "c"], "age": [18, 40, 99]})
+
+    loader.main_file = FileItem("texas.csv",
+                                io_obj=StringIO(df.to_csv(index=False)))
+    loader.compress()
+    assert loader.is_compressed
+    assert pd.read_csv(loader.main_file.obj,
+                       compression="gzip").equals(df)
+
+    loader.local_dump(ProcessedFile("texas.processed", df, index=False))
+    assert pd.read_csv(loader.generate_local_key()).equals(df)
+    with open(loader.generate_local_key(meta=True)) as f:
+        assert loads_meta(f.read())["message"] == "texas_2020-01-01"
+
+
+def test_compare_output_formats():
+    pytest.importorskip("pyarrow")
+    df = pd.DataFrame({"voter_id": ["v{}".format(i) for i in range(500)],
+                       "county": ["ala", "bak"] * 250,
+                       "age": range(500)})
+    comparison = compare_output_formats(df, index=False)
+    assert comparison.index.tolist() == ["csv", "parquet", "arrow"]
+    assert comparison.loc["csv", "size_vs_csv"] == 1
+    assert (comparison["bytes"] > 0).all()
+    assert (comparison[["write_seconds", "load_seconds"]] >= 0).all().all()
+    # each size is that of the file the format writes
+    for output_format in comparison.index:
+        buf = BytesIO()
+        write_frame(df, buf, output_format, index=False)
+        assert comparison.loc[output_format, "bytes"] == \
+            len(buf.getvalue())
+        buf.seek(0)
+        assert read_frame(buf, output_format, index=False)[
+            "age"].tolist() == list(range(500))
+
+    comparison = compare_output_formats(df, formats=["pgcopy"], index=False)
+    assert comparison.index.tolist() == ["pgcopy"]
+    assert "size_vs_csv" not in comparison
@@ -0,0 +1,128 @@
+import datetime
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import BUCKET
+from reggie.ingestion import utils
+from reggie.ingestion.utils import get_metadata_for_key, \
+    get_surrounding_dates, processed_prefix, SnapshotIndex, \
+    strcol_to_array, tokenize_delimited
+from reggie.reggie_constants import NULL_CHAR
+
+D = datetime.date
+
+
+@pytest.fixture
+def prefix(s3_client):
+    prefix = processed_prefix("texas")
+    for date in ["2020-01-01", "2020-03-01", "2020-02-01"]:
+        put(s3_client, "{}/{}.csv.gz".format(prefix, date))
+    return prefix
+
+
+def put(client, key, body=b"x"):
+    client.put_object(Bucket=BUCKET, Key=key, Body=body)
+
+
+def key_of(prefix, date):
+    return "{}/{}.csv.gz".format(prefix, date)
+
+
+def test_surrounding_dates(s3_client, prefix):
+    assert get_surrounding_dates(D(2020, 2, 1), "texas", BUCKET) == (
+        D(2020, 1, 1), D(2020, 3, 1), key_of(prefix, "2020-01-01"),
+        key_of(prefix, "2020-03-01"))
+    assert get_surrounding_dates(D(2020, 2, 15), "texas", BUCKET)[2:] == (
+        key_of(prefix, "2020-02-01"), key_of(prefix, "2020-03-01"))
+    assert get_surrounding_dates(D(2019, 1, 1), "texas", BUCKET) == (
+        None, D(2020, 1, 1), None, key_of(prefix, "2020-01-01"))
+    assert get_surrounding_dates("2021-01-01", "texas", BUCKET) == (
+        D(2020, 3, 1), None, key_of(prefix, "2020-03-01"), None)
+    assert get_surrounding_dates(D(2020, 1, 1), "ohio", BUCKET) == \
+        (None, None, None, None)
+
+
+def test_index_is_not_listed_on_each_call(s3_client, prefix):
+    index = SnapshotIndex.for_state("texas", BUCKET)
+    assert len(index) == 3
+    put(s3_client, key_of(prefix, "2020-04-01"))
+    assert SnapshotIndex.for_state("texas", BUCKET) is index
+    assert get_surrounding_dates(D(2020, 5, 1), "texas", BUCKET)[2] == \
+        key_of(prefix, "2020-03-01")
+    # an incremental listing only asks for keys after the last one
+    index.refresh(full=False)
+    assert index.keys[-1] == key_of(prefix, "2020-04-01")
+    assert index.etag(index.keys[-1]) is not None
+
+
+def test_backfilled_snapshot(s3_client, prefix, monkeypatch):
+    index = SnapshotIndex.for_state("texas", BUCKET)
+    put(s3_client, key_of(prefix, "2020-02-15"))
+    index.refresh(full=False)
+    assert key_of(prefix, "2020-02-15") not in index.keys
+    # a lookup inside the indexed dates lists in full once the last full
+    # listing is older than the ttl
+    monkeypatch.setattr(utils, "SNAPSHOT_INDEX_TTL", 0)
+    assert get_surrounding_dates(D(2020, 2, 20), "texas", BUCKET)[2] == \
+        key_of(prefix, "2020-02-15")
+
+
+def test_index_is_stored(s3_client, prefix):
+    SnapshotIndex.for_state("texas", BUCKET)
+    stored = SnapshotIndex.load(BUCKET, prefix)
+    assert stored.keys == [key_of(prefix, d) for d in
+                           ["2020-01-01", "2020-02-01", "2020-03-01"]]
+
+
+def test_partitioned_snapshot(s3_client, prefix):
+    from reggie.ingestion.download import Loader, ProcessedFile
+    from reggie.reggie_constants import CONFIG_DIR
+    index = SnapshotIndex.for_state("texas", BUCKET)
+    loader = Loader(config_file=CONFIG_DIR + "texas.yaml",
+                    force_date="2020-05-01", s3_bucket=BUCKET)
+    loader.meta = {"message": "texas_partitioned",
+                   "array_decoding": ["a", "b"],
+                   "array_encoding": {"a": {"index": 0}, "b": {"index": 1}}}
+    df = pd.DataFrame({"VUID": ["1", "2", "3"],
+                       "County_Code": [1, 2, 1]})
+    loader.s3_partitioned_dump(ProcessedFile("texas", df, index=False),
+                               partition_by="voter_id", buckets=2,
+                               client=s3_client)
+    manifest_key = loader.generate_key(partitioned=True) + "manifest.json"
+    # recorded on upload, without listing
+    assert index.keys[-1] == manifest_key
+    # and a listing indexes the manifest, not the part files
+    index.refresh(full=True)
+    assert index.keys[-1] == manifest_key and len(index) == 4
+    meta = get_metadata_for_key(manifest_key, BUCKET)
+    assert meta["message"] == "texas_partitioned"
+    assert meta["array_decoding"] == ["a", "b"]
+    manifest = json.loads(s3_client.get_object(
+        Bucket=BUCKET, Key=manifest_key)["Body"].read())
+    assert sum(p["rows"] for p in manifest["parts"]) == 3
+
+
+def test_tokenize_delimited():
+    # voterhistory as New York writes it
+    histories = pd.Series([
+        "20201103 GE;20181106 GE", NULL_CHAR, "[20201103 GE]",
+        "20200623 PR;20201103 GE;20160419 PP", "20181106 GE", NULL_CHAR,
+        "20200623 PR", "20201103 GE;20201103 GE", "20160419 PP", "x y z"])
+    expected = strcol_to_array(histories, delim=";")
+    tokens = [t for row in expected for t in row]
+    for chunksize in [3, 4, 100]:
+        codes, offsets, uniques = tokenize_delimited(
+            histories, delim=";", chunksize=chunksize)
+        assert len(offsets) == len(histories) + 1
+        rows = [uniques[codes[offsets[i]:offsets[i + 1]]].tolist()
+                for i in range(len(histories))]
+        assert rows == expected.tolist()
+        assert uniques.tolist() == pd.unique(np.array(tokens)).tolist()
+        _, counts = np.unique(tokens, return_counts=True)
+        order = uniques.argsort()
+        assert np.bincount(codes)[order].tolist() == counts.tolist()
+    codes, offsets, uniques = tokenize_delimited(pd.Series([], dtype=str))
+    assert len(codes) == 0 and offsets.tolist() == [0] and len(uniques) == 0